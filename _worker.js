@@ -133,6 +133,36 @@ async function checkProxyIP(proxyIPInput, env) {
     };
 }
 
+const BATCH_CHECK_MAX_TARGETS = 25;
+const BATCH_CHECK_CONCURRENCY = 6;
+
+// Checks a list of targets and writes one JSON line per target as soon as its
+// check finishes, so the caller can consume results out of order.
+function streamBatchChecks(targets, env, ctx) {
+    const { readable, writable } = new TransformStream();
+    const writer = writable.getWriter();
+    const encoder = new TextEncoder();
+    let next = 0;
+
+    const runLane = async () => {
+        while (next < targets.length) {
+            const proxyIPInput = targets[next++];
+            let result;
+            try {
+                result = await checkProxyIP(proxyIPInput, env);
+            } catch (error) {
+                result = { success: false, error: error.message };
+            }
+            await writer.write(encoder.encode(JSON.stringify({ ...result, target: proxyIPInput }) + '\n'));
+        }
+    };
+
+    const lanes = Array.from({ length: Math.min(BATCH_CHECK_CONCURRENCY, targets.length) }, runLane);
+    const done = Promise.all(lanes).finally(() => writer.close());
+    if (ctx) ctx.waitUntil(done);
+    return readable;
+}
+
 async function getIpInfo(ip) {
     const defaultResponse = { country: 'N/A', countryCode: 'N/A', as: 'N/A' };
     try {
@@ -184,11 +214,12 @@ async function resolveDomain(domain) {
     const ipv4Data = ipv4Response.ok ? await ipv4Response.json() : {};
     const ipv6Data = ipv6Response.ok ? await ipv6Response.json() : {};
 
-    const ips = [];
-    if (ipv4Data.Answer) ips.push(...ipv4Data.Answer.filter(r => r.type === 1).map(r => r.data));
-    if (ipv6Data.Answer) ips.push(...ipv6Data.Answer.filter(r => r.type === 28).map(r => `[${r.data}]`));
+    const ipv4Records = (ipv4Data.Answer || []).filter(r => r.type === 1);
+    const ipv6Records = (ipv6Data.Answer || []).filter(r => r.type === 28);
+    const ips = [...ipv4Records.map(r => r.data), ...ipv6Records.map(r => `[${r.data}]`)];
     if (ips.length === 0) throw new Error('No A or AAAA records found for this domain.');
-    return ips;
+    const ttl = Math.min(...[...ipv4Records, ...ipv6Records].map(r => r.TTL));
+    return { ips, ttl };
   } catch (error) {
     throw new Error(`DNS resolution failed: ${error.message}`);
   }
@@ -1208,12 +1239,28 @@ export default {
                 return new Response(JSON.stringify(result), { status: 200, headers: { "Content-Type": "application/json" } });
             }
             
+            if (path.toLowerCase() === '/api/check-batch' && request.method === 'POST') {
+                let targets;
+                try {
+                    targets = (await request.json()).targets;
+                } catch (e) {
+                    targets = null;
+                }
+                if (!Array.isArray(targets) || targets.length === 0 || targets.some(t => typeof t !== 'string')) {
+                    return new Response(JSON.stringify({success: false, error: 'Body must be {"targets": [...]}'}), { status: 400, headers: { "Content-Type": "application/json" }});
+                }
+                if (targets.length > BATCH_CHECK_MAX_TARGETS) {
+                    return new Response(JSON.stringify({success: false, error: `At most ${BATCH_CHECK_MAX_TARGETS} targets per batch`}), { status: 413, headers: { "Content-Type": "application/json" }});
+                }
+                return new Response(streamBatchChecks(targets, env, ctx), { status: 200, headers: { "Content-Type": "application/x-ndjson" } });
+            }
+
             if (path.toLowerCase() === '/api/resolve') {
                 const domain = url.searchParams.get('domain');
                 if (!domain) return new Response(JSON.stringify({success: false, error: 'Missing domain parameter'}), { status: 400, headers: { "Content-Type": "application/json" }});
                 try {
-                    const ips = await resolveDomain(domain);
-                    return new Response(JSON.stringify({ success: true, domain, ips }), { headers: { "Content-Type": "application/json" } });
+                    const { ips, ttl } = await resolveDomain(domain);
+                    return new Response(JSON.stringify({ success: true, domain, ips, ttl }), { headers: { "Content-Type": "application/json" } });
                 } catch (error) {
                     return new Response(JSON.stringify({ success: false, error: error.message }), { status: 500, headers: { "Content-Type": "application/json" } });
                 }
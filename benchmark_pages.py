@@ -0,0 +1,67 @@
+# Paginates 10k formatted check results into Telegram messages with the
+# bot's ResultPages and with the old join-per-append /post loop, to check
+# that sharing the paginator costs nothing: both take about the same time.
+# Formatting the result blocks is timed separately since both share it.
+# Usage: python benchmark_pages.py [results]
+import importlib.util
+import os
+import sys
+import time
+
+def load_bot():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy-ip-bot.py")
+    spec = importlib.util.spec_from_file_location("proxy_ip_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_results(bot, count: int) -> list:
+    return [bot.CheckResult(f"10.{i // 65536}.{i // 256 % 256}.{i % 256}:443", 80 + i % 400, "Germany", "Hetzner Online GmbH", None, ())
+            for i in range(count)]
+
+def format_blocks(bot, results: list) -> list[str]:
+    return [bot.format_result_block(res, i) for i, res in enumerate(results)]
+
+def render_with_pages(bot, blocks: list, title: str) -> list[str]:
+    pages = bot.ResultPages(title, header_reserve=bot.POST_FOOTER_RESERVE)
+    for block in blocks:
+        pages.append(block, 1)
+    return [pages.render(i) for i in range(len(pages.pages))]
+
+def render_with_joins(bot, blocks: list, title: str, limit: int = 4000) -> list[str]:
+    # The loop run_test_and_post used before ResultPages: it re-joins the
+    # whole page on every append.
+    messages, parts = [], []
+    for line in blocks:
+        if not parts:
+            parts = [f"**{title}**", "---"]
+        if len("\n".join(parts)) + len(line) + 2 > limit:
+            messages.append("\n".join(parts))
+            parts = [f"**Continuation {title}**", "---", line]
+        else:
+            parts.append(line)
+    if parts:
+        messages.append("\n".join(parts))
+    return messages
+
+def timed(function, *args) -> tuple[float, list]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bot = load_bot()
+    results = make_results(bot, count)
+    title = "Proxy IP Test Results:"
+    elapsed, blocks = timed(format_blocks, bot, results)
+    print(f"{'formatting':>16}: {count:,} result blocks in {elapsed * 1000:.1f} ms")
+    for name, function in (("ResultPages", render_with_pages), ("join per append", render_with_joins)):
+        elapsed, messages = timed(function, bot, blocks, title)
+        longest = max(len(text) for text in messages)
+        entities = max(bot.count_markdown_entities(text) for text in messages)
+        print(f"{name:>16}: {count:,} results -> {len(messages)} message(s) in {elapsed * 1000:.1f} ms "
+              f"(longest {longest} chars, at most {entities} entities)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Measures the per-target overhead of handing out work for a live test, with
+# no network: the old loop that rescanned the whole target list against the
+# checked set for every 30-target batch, and draining the bot's TargetQueue.
+# Usage: python benchmark_queue.py [targets ...]
+import importlib.util
+import os
+import sys
+import time
+
+def load_bot():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy-ip-bot.py")
+    spec = importlib.util.spec_from_file_location("proxy_ip_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_addresses(count: int) -> list[str]:
+    return [f"1.{i // 65536}.{i // 256 % 256}.{i % 256}:443" for i in range(count)]
+
+def drain_with_rescan(ips: list[dict], batch_size: int = 30) -> int:
+    # The loop process_ips_in_batches used before TargetQueue.
+    checked_ips = set()
+    while len(checked_ips) < len(ips):
+        unchecked = [ip_obj for ip_obj in ips if ip_obj['ip'] not in checked_ips]
+        for ip_obj in unchecked[:batch_size]:
+            checked_ips.add(ip_obj['ip'])
+    return len(checked_ips)
+
+def drain_with_queue(bot, targets) -> int:
+    queue = bot.TargetQueue(targets)
+    for _ in queue:
+        queue.checked += 1
+    return queue.checked
+
+def timed(function, *args) -> tuple[float, int]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1024, 4096, 16384, 65536]
+    bot = load_bot()
+    print(f"{'targets':>8}  {'rescan':>14}  {'TargetQueue':>14}")
+    for count in sizes:
+        addresses = make_addresses(count)
+        # Only handing out the targets is timed, not building the lists.
+        ips = [{'ip': address, 'range_index': 0} for address in addresses]
+        targets = bot.compact_targets(addresses)
+        old_elapsed, old_checked = timed(drain_with_rescan, ips)
+        new_elapsed, new_checked = timed(drain_with_queue, bot, targets)
+        assert old_checked == new_checked == count
+        print(f"{count:>8,}  {old_elapsed / count * 1e6:>10.2f} us/IP  {new_elapsed / count * 1e6:>10.2f} us/IP")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Measures memory and time for holding one 65,536-target scan with 10% hits:
+# the old list of dicts + checked set + full worker dicts, a lazy range
+# (/iprange) and CompactTargets (/file, /proxyip), both with CheckResult.
+# Memory is traced with tracemalloc and time is taken on a separate untraced
+# run; the input address strings are built beforehand and not counted.
+# Usage: python benchmark_targets.py [targets] [hit percent]
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+def load_bot():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy-ip-bot.py")
+    spec = importlib.util.spec_from_file_location("proxy_ip_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def worker_body(address: str, i: int) -> str:
+    # Shaped like a successful /api/check answer from _worker.js.
+    return json.dumps({'success': True, 'proxyIP': address, 'portRemote': 443, 'ping': 80 + i % 400, 'timestamp': '2026-01-01T00:00:00.000Z',
+                       'info': {'country': 'Germany', 'countryCode': 'DE', 'as': 'AS24940 Hetzner Online GmbH'}, 'method': 'API'})
+
+def old_layout(bot, addresses: list[str], bodies: dict) -> tuple:
+    ips = [{'ip': address, 'range_index': 0} for address in addresses]
+    checked_ips, successful = set(), []
+    for ip_obj in ips:
+        checked_ips.add(ip_obj['ip'])
+        if ip_obj['ip'] in bodies:
+            successful.append(json.loads(bodies[ip_obj['ip']]))
+    return ips, checked_ips, successful
+
+def drain(bot, targets, bodies: dict) -> tuple:
+    queue, successful = bot.TargetQueue(targets), []
+    for target in queue:
+        queue.checked += 1
+        if target.address in bodies:
+            outcome, summary = bot.worker_verdict(json.loads(bodies[target.address]))
+            successful.append(bot.CheckResult(*summary, target.source_index, target.sort_key))
+    return queue, successful
+
+def range_layout(bot, addresses: list[str], bodies: dict) -> tuple:
+    return drain(bot, bot.RangeTargets([(0, bot.parse_ip_range(f"{addresses[0]}-{addresses[-1]}"))]), bodies)
+
+def compact_layout(bot, addresses: list[str], bodies: dict) -> tuple:
+    return drain(bot, bot.compact_targets(addresses), bodies)
+
+def measure(function, *args) -> tuple[float, int, int]:
+    tracemalloc.start()
+    kept = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start, current, peak
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 65536
+    hit_percent = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    bot = load_bot()
+    # Public addresses from 1.0.0.1 upwards, so none are dropped as bogons.
+    addresses = [bot.format_ip_int(0x01000001 + i, 4) for i in range(count)]
+    bodies = {address: worker_body(address, i) for i, address in enumerate(addresses) if i % 100 < hit_percent}
+    print(f"{count:,} targets, {len(bodies):,} successes")
+    layouts = (("old dicts", old_layout), ("/iprange", range_layout), ("/file list", compact_layout))
+    for name, function in layouts:
+        elapsed, current, peak = measure(function, bot, addresses, bodies)
+        print(f"{name:>12}: {current / 1e6:6.1f} MB held, {peak / 1e6:6.1f} MB peak, {elapsed * 1000:7.1f} ms "
+              f"({count / elapsed / 1e3:,.0f}k targets/s)")
+
+if __name__ == "__main__":
+    main()
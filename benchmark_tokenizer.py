@@ -0,0 +1,62 @@
+# Measures how fast /file input is turned into targets: the chunked
+# AddressTokenizer alone, a full FileTargets ingestion served from memory,
+# and the old decode + findall + compact_targets path, in MB/s.
+# Usage: python benchmark_tokenizer.py [lines]
+import asyncio
+import importlib.util
+import os
+import random
+import re
+import sys
+import time
+
+import httpx
+
+def load_bot():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy-ip-bot.py")
+    spec = importlib.util.spec_from_file_location("proxy_ip_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_body(count: int) -> bytes:
+    rng = random.Random(1)
+    lines = (f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}:{rng.choice((443, 8443, 2053))},DE,Hetzner Online GmbH"
+             for _ in range(count))
+    return "\n".join(lines).encode()
+
+def tokenize(bot, body: bytes) -> int:
+    tokenizer = bot.AddressTokenizer()
+    found = 0
+    for i in range(0, len(body), bot.FILE_CHUNK_SIZE):
+        found += len(tokenizer.feed(body[i:i + bot.FILE_CHUNK_SIZE]))
+    return found + len(tokenizer.finish())
+
+def ingest(bot, body: bytes) -> int:
+    async def run():
+        bot.http_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+        targets = bot.FileTargets("http://list.test/proxies.txt", max_bytes=len(body))
+        await targets.task
+        await bot.http_client.aclose()
+        return len(targets)
+    return asyncio.run(run())
+
+def old_path(bot, body: bytes) -> int:
+    text = body.decode()
+    return len(bot.compact_targets(re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', text)))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bot = load_bot()
+    bot.logger.disabled = True
+    body = make_body(count)
+    megabytes = len(body) / 1e6
+    print(f"{count:,} lines, {megabytes:.1f} MB")
+    for name, function in (("tokenizer", tokenize), ("FileTargets", ingest), ("old path", old_path)):
+        start = time.perf_counter()
+        found = function(bot, body)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {megabytes / elapsed:6.1f} MB/s ({elapsed:.2f} s, {found:,} tokens/targets)")
+
+if __name__ == "__main__":
+    main()
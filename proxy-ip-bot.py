@@ -2,17 +2,33 @@
 # 10:30 AM
 import os
 import logging
+import random
 import uuid
 import asyncio
+import csv
+import gzip
+import heapq
+import itertools
 import httpx
 import io
 import re
 import ipaddress
 import json
+import sqlite3
+import secrets
+import importlib.util
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter, OrderedDict, deque
+from operator import attrgetter
+from typing import NamedTuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, ContextTypes, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
 from telegram.constants import ParseMode, ChatType, ChatMemberStatus
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
 from termcolor import cprint
 
 logging.basicConfig(
@@ -22,16 +38,131 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
-WORKER_URL = "https://YourProxyIPChecker.pages.dev"
+WORKER_URLS = [url.strip().rstrip("/") for url in os.environ.get("WORKER_URL", "https://YourProxyIPChecker.pages.dev").split(",") if url.strip()]
+ADMIN_IDS = {int(uid) for uid in os.environ.get("ADMIN_IDS", "").replace(' ', '').split(',') if uid.lstrip('-').isdigit()}
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_AVAILABLE = importlib.util.find_spec("tornado") is not None
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "32"))
+UPDATE_BACKLOG_LIMIT = 4096
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "30"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "1") == "1" and importlib.util.find_spec("h2") is not None
+WORKER_TIMEOUT = float(os.environ.get("WORKER_TIMEOUT", "45"))
+WORKER_TIMEOUT_MIN = float(os.environ.get("WORKER_TIMEOUT_MIN", "5"))
+WORKER_TIMEOUT_MULTIPLIER = 2.0
+WORKER_LATENCY_WINDOW = 500
+WORKER_LATENCY_MIN_SAMPLES = 50
+WORKER_HEDGING = os.environ.get("WORKER_HEDGING", "1") == "1"
+WORKER_HEDGE_BUDGET = 0.05
+CIRCUIT_WINDOW = 50
+CIRCUIT_MIN_CALLS = 20
+CIRCUIT_ERROR_THRESHOLD = float(os.environ.get("CIRCUIT_ERROR_THRESHOLD", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "15"))
+CIRCUIT_MAX_OPEN_SECONDS = 240
+CIRCUIT_PROBES = 2
+WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", "25"))
+WORKER_BATCH_LINGER = 0.02
+WORKER_BATCH_REPROBE_INTERVAL = 600
+WORKER_HEALTH_WINDOW = 20
+WORKER_LATENCY_SMOOTHING = 0.2
+WORKER_EJECT_FAILURES = 5
+WORKER_EJECT_ERROR_RATE = 0.5
+WORKER_EJECT_SECONDS = float(os.environ.get("WORKER_EJECT_SECONDS", "30"))
+WORKER_MAX_EJECT_SECONDS = 300
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", "15"))
+FILE_MAX_BYTES = int(os.environ.get("FILE_MAX_BYTES", str(256 * 1024 * 1024)))
+FILE_CHUNK_SIZE = 64 * 1024
+
+CHECK_CONCURRENCY_INITIAL = int(os.environ.get("CHECK_CONCURRENCY_INITIAL", "30"))
+CHECK_CONCURRENCY_MIN = int(os.environ.get("CHECK_CONCURRENCY_MIN", "4"))
+CHECK_CONCURRENCY_MAX = int(os.environ.get("CHECK_CONCURRENCY_MAX", "200"))
+AIMD_WINDOW = 50
+AIMD_TROUBLE_THRESHOLD = 0.1
+AIMD_BACKOFF = 0.5
+AIMD_DECREASE_COOLDOWN = 5.0
+LIVE_UPDATE_INTERVAL = 1.5
+LIVE_EDIT_INTERVAL = float(os.environ.get("LIVE_EDIT_INTERVAL", "3"))
+
+TELEGRAM_GLOBAL_RATE = 30.0
+TELEGRAM_PRIVATE_CHAT_RATE = 1.0
+TELEGRAM_GROUP_CHAT_RATE = 20 / 60
+TELEGRAM_CHAT_BURST = 3
+OUTBOX_CONCURRENCY = 8
+OUTBOX_MAX_RETRIES = 5
+
+PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND = 'interactive', 'background'
+PRIORITY_QUANTUM = {PRIORITY_INTERACTIVE: 8, PRIORITY_BACKGROUND: 1}
+
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "100000"))
+RESULT_CACHE_SUCCESS_TTL = float(os.environ.get("RESULT_CACHE_SUCCESS_TTL", "600"))
+RESULT_CACHE_FAILURE_TTL = float(os.environ.get("RESULT_CACHE_FAILURE_TTL", "300"))
+FRESH_FLAGS = {'--fresh', '-f'}
+TOP_FLAGS = {'--top', '-t'}
+MAX_PING_FLAGS = {'--max-ping', '-p'}
+TOP_RESULTS_MAX = 100
+MAX_RANGE_ADDRESSES = int(os.environ.get("MAX_RANGE_ADDRESSES", "262144"))
+ADAPTIVE_MAX_ADDRESSES = int(os.environ.get("ADAPTIVE_MAX_ADDRESSES", str(1 << 24)))
+ADAPTIVE_SAMPLES_PER_BLOCK = int(os.environ.get("ADAPTIVE_SAMPLES_PER_BLOCK", "8"))
+ADAPTIVE_BUDGET_FRACTION = float(os.environ.get("ADAPTIVE_BUDGET_FRACTION", "0.25"))
+ADAPTIVE_DEFAULT_PREFIX = {4: 24, 6: 120}
+SAMPLE_FLAGS = {'--sample', '-s'}
+COUNTRY_CACHE_DIR = os.environ.get("COUNTRY_CACHE_DIR", "country_cache")
+COUNTRY_CACHE_TTL = float(os.environ.get("COUNTRY_CACHE_TTL", "1800"))
+COUNTRY_PREFETCH_CONCURRENCY = 4
+DNS_CONCURRENCY = int(os.environ.get("DNS_CONCURRENCY", "10"))
+DNS_CACHE_MAX_ENTRIES = int(os.environ.get("DNS_CACHE_MAX_ENTRIES", "10000"))
+DNS_CACHE_DEFAULT_TTL = 300
+DNS_CACHE_MIN_TTL = 30
+DNS_CACHE_MAX_TTL = float(os.environ.get("DNS_CACHE_MAX_TTL", "3600"))
+DNS_CACHE_FAILURE_TTL = 60
 
 DB_FILE = "bot_data.json"
+DB_PATH = os.environ.get("DB_PATH", "bot_data.sqlite3")
+CLEANUP_SHARD_INTERVAL = float(os.environ.get("CLEANUP_SHARD_INTERVAL", "900"))
+CLEANUP_MIN_SHARD_SIZE = 50
+CLEANUP_CONCURRENCY = int(os.environ.get("CLEANUP_CONCURRENCY", "5"))
+CLEANUP_RATE = float(os.environ.get("CLEANUP_RATE", "10"))
+CLEANUP_CURSOR_KEY = "cleanup_cursor"
+HISTORY_PATH = os.environ.get("HISTORY_PATH", "check_history.sqlite3")
+HISTORY_GOOD_SECONDS = float(os.environ.get("HISTORY_GOOD_SECONDS", "86400"))
+HISTORY_SKIP_DEAD_SECONDS = float(os.environ.get("HISTORY_SKIP_DEAD_SECONDS", "1800"))
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", "7"))
+HISTORY_FLUSH_INTERVAL = 2.0
+HISTORY_FLUSH_SIZE = 1000
+HISTORY_PRUNE_INTERVAL = 3600
+HISTORY_LOOKUP_CHUNK = 500
+HISTORY_LIST_LIMIT = 20
+HISTORY_DEFAULT_MINUTES = 60
+HISTORY_COUNTRY_PATTERN = re.compile(r"[^\W\d_](?:[^\W\d_]|[ .'()-])*")
+SCHEDULE_INTERVAL_HOURS = (1, 2, 3, 6, 12, 24)
+SCHEDULE_CONCURRENCY = int(os.environ.get("SCHEDULE_CONCURRENCY", "2"))
+SCHEDULE_MAX_PER_USER = int(os.environ.get("SCHEDULE_MAX_PER_USER", "10"))
+SCHEDULE_JITTER = 0.1
+SCHEDULE_MAX_JITTER = 300
+SCHEDULE_STARTUP_DELAY = 60
+SCHEDULE_POLL_INTERVAL = 300
 MESSAGE_ENTITY_LIMIT = 45
+PAGE_HEADER_RESERVE = 160
+POST_FOOTER_RESERVE = 32
+EXPORT_GZIP_THRESHOLD = int(os.environ.get("EXPORT_GZIP_THRESHOLD", str(1024 * 1024)))
+COPY_BLOCK_LIMIT = 4000
+COPY_BLOCK_MAX_MESSAGES = int(os.environ.get("COPY_BLOCK_MAX_MESSAGES", "5"))
 RISK_SCORE_URL_TEMPLATE = "https://fraundrisk.arshiaplus.com/{ip}"
 
 AWAIT_MAIN_INPUT = 0
 SELECT_ADD_TYPE, AWAIT_CHAT_ID, AWAIT_ADD_CONFIRMATION, AWAIT_CHAT_NAME = range(1, 5)
 SELECT_TARGET_CHAT, SELECT_COMMAND, AWAIT_COMMAND_INPUT, AWAIT_POST_COUNTRY = range(5, 9)
 SELECT_CHAT_TO_DELETE, CONFIRM_DELETION = range(9, 11)
+SELECT_SCHEDULE_CHAT, SELECT_SCHEDULE_COMMAND, AWAIT_SCHEDULE_INPUT, AWAIT_SCHEDULE_COUNTRY, SELECT_SCHEDULE_INTERVAL = range(11, 16)
+SELECT_SCHEDULE_TO_DELETE = 16
 AWAIT_DOMAIN_INPUT = 300
 AWAIT_POST_DOMAIN_INPUT = 300
 
@@ -42,99 +173,2357 @@ COUNTRY_URLS = {"ALL": "https://raw.githubusercontent.com/NiREvil/vless/main/sub
 COUNTRY_FILE_BASE_URL = "https://raw.githubusercontent.com/NiREvil/vless/main/sub/country_proxies/"
 NUMBER_EMOJIS = ['0ï¸âƒ£', '1ï¸âƒ£', '2ï¸âƒ£', '3ï¸âƒ£', '4ï¸âƒ£', '5ï¸âƒ£', '6ï¸âƒ£', '7ï¸âƒ£', '8ï¸âƒ£', '9ï¸âƒ£']
 
-def load_db():
+def load_db(path: str = DB_FILE):
     try:
-        with open(DB_FILE, 'r') as f:
+        with open(path, 'r') as f:
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
         return {}
 
-def save_db(data):
-    with open(DB_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+class ChatStore:
+    # Registered destinations per user, kept in SQLite (WAL mode) with an
+    # in-memory cache of the users touched so far. Every write is a single
+    # transaction, so a crash can never leave a half-written file behind.
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chats (
+                user_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (user_id, chat_id)
+            );
+            CREATE INDEX IF NOT EXISTS chats_by_chat ON chats (chat_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS schedules (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                command TEXT NOT NULL,
+                inputs TEXT NOT NULL,
+                interval INTEGER NOT NULL,
+                next_run REAL NOT NULL,
+                UNIQUE (user_id, chat_id, command, inputs, interval)
+            );
+            CREATE INDEX IF NOT EXISTS schedules_by_next_run ON schedules (next_run);
+            CREATE INDEX IF NOT EXISTS schedules_by_source ON schedules (command, inputs, interval);
+        """)
+        self.cache = {}
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    def migrate_from_json(self, json_path: str):
+        if not os.path.exists(json_path) or self.conn.execute("SELECT 1 FROM chats LIMIT 1").fetchone():
+            return 0
+        data = load_db(json_path)
+        rows = [(str(user_id), int(chat['chat_id']), chat['name'], position)
+                for user_id, chats in data.items() for position, chat in enumerate(chats)]
+        with self.transaction():
+            self.conn.executemany("INSERT OR IGNORE INTO chats (user_id, chat_id, name, position) VALUES (?, ?, ?, ?)", rows)
+        os.replace(json_path, f"{json_path}.migrated")
+        logger.info(f"Migrated {len(rows)} registered chat(s) for {len(data)} user(s) from {json_path}.")
+        return len(rows)
+
+    def get_user_chats(self, user_id) -> list[dict]:
+        user_id = str(user_id)
+        if user_id not in self.cache:
+            rows = self.conn.execute("SELECT chat_id, name FROM chats WHERE user_id = ? ORDER BY position", (user_id,)).fetchall()
+            self.cache[user_id] = [{"chat_id": chat_id, "name": name} for chat_id, name in rows]
+        return list(self.cache[user_id])
+
+    def add_user_chat(self, user_id, chat_id: int, name: str) -> bool:
+        user_id = str(user_id)
+        with self.transaction():
+            position = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM chats WHERE user_id = ?", (user_id,)).fetchone()[0]
+            added = self.conn.execute("INSERT OR IGNORE INTO chats (user_id, chat_id, name, position) VALUES (?, ?, ?, ?)", (user_id, int(chat_id), name, position)).rowcount > 0
+        self.cache.pop(user_id, None)
+        return added
+
+    def delete_user_chat(self, user_id, chat_id) -> bool:
+        user_id = str(user_id)
+        with self.transaction():
+            deleted = self.conn.execute("DELETE FROM chats WHERE user_id = ? AND chat_id = ?", (user_id, int(chat_id))).rowcount > 0
+            self.conn.execute("DELETE FROM schedules WHERE user_id = ? AND chat_id = ?", (user_id, int(chat_id)))
+        self.cache.pop(user_id, None)
+        return deleted
+
+    def delete_user(self, user_id) -> bool:
+        user_id = str(user_id)
+        with self.transaction():
+            deleted = self.conn.execute("DELETE FROM chats WHERE user_id = ?", (user_id,)).rowcount > 0
+            self.conn.execute("DELETE FROM schedules WHERE user_id = ?", (user_id,))
+        self.cache.pop(user_id, None)
+        return deleted
+
+    def count_users(self) -> int:
+        return self.conn.execute("SELECT COUNT(DISTINCT user_id) FROM chats").fetchone()[0]
+
+    def list_user_ids(self, after: str = None, limit: int = None) -> list[str]:
+        query, params = "SELECT DISTINCT user_id FROM chats", []
+        if after is not None:
+            query += " WHERE user_id > ?"
+            params.append(after)
+        query += " ORDER BY user_id"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def add_schedule(self, user_id, chat_id: int, command: str, inputs: str, interval: int, next_run: float) -> bool:
+        # A new entry joins the slot of any existing entry for the same test
+        # and interval, so both are served by one scan.
+        user_id = str(user_id)
+        with self.transaction():
+            if self.conn.execute("SELECT COUNT(*) FROM schedules WHERE user_id = ?", (user_id,)).fetchone()[0] >= SCHEDULE_MAX_PER_USER:
+                return False
+            shared = self.conn.execute("SELECT MIN(next_run) FROM schedules WHERE command = ? AND inputs = ? AND interval = ?", (command, inputs, interval)).fetchone()[0]
+            return self.conn.execute("INSERT OR IGNORE INTO schedules (user_id, chat_id, command, inputs, interval, next_run) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (user_id, int(chat_id), command, inputs, interval, shared if shared is not None else next_run)).rowcount > 0
+
+    def get_user_schedules(self, user_id) -> list[dict]:
+        rows = self.conn.execute("""
+            SELECT s.id, s.chat_id, c.name, s.command, s.inputs, s.interval, s.next_run
+            FROM schedules s JOIN chats c ON c.user_id = s.user_id AND c.chat_id = s.chat_id
+            WHERE s.user_id = ? ORDER BY c.position, s.id
+        """, (str(user_id),)).fetchall()
+        return [{"id": row[0], "chat_id": row[1], "name": row[2], "command": row[3], "inputs": row[4], "interval": row[5], "next_run": row[6]} for row in rows]
+
+    def delete_schedule(self, user_id, schedule_id: int) -> bool:
+        with self.transaction():
+            return self.conn.execute("DELETE FROM schedules WHERE user_id = ? AND id = ?", (str(user_id), int(schedule_id))).rowcount > 0
+
+    def due_schedules(self, now: float) -> list[tuple]:
+        # One row per (command, inputs, interval) slot that is due, with every
+        # distinct chat subscribed to it.
+        rows = self.conn.execute("""
+            SELECT command, inputs, interval, GROUP_CONCAT(DISTINCT chat_id) FROM schedules
+            WHERE next_run <= ? GROUP BY command, inputs, interval ORDER BY MIN(next_run)
+        """, (now,)).fetchall()
+        return [(command, inputs, interval, [int(chat_id) for chat_id in chat_ids.split(',')]) for command, inputs, interval, chat_ids in rows]
+
+    def set_schedule_next_run(self, command: str, inputs: str, interval: int, next_run: float):
+        with self.transaction():
+            self.conn.execute("UPDATE schedules SET next_run = ? WHERE command = ? AND inputs = ? AND interval = ?", (next_run, command, inputs, interval))
+
+    def next_schedule_run(self) -> float | None:
+        return self.conn.execute("SELECT MIN(next_run) FROM schedules").fetchone()[0]
+
+    def count_schedules(self) -> tuple[int, int]:
+        return self.conn.execute("SELECT COUNT(*), COUNT(DISTINCT command || ' ' || inputs || ' ' || interval) FROM schedules").fetchone()
+
+    def get_meta(self, key: str, default: str = None) -> str | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        with self.transaction():
+            self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def close(self):
+        self.conn.close()
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+chat_store: ChatStore | None = None
+
+def get_chat_store() -> ChatStore:
+    global chat_store
+    if chat_store is None:
+        chat_store = ChatStore(DB_PATH)
+        chat_store.migrate_from_json(DB_FILE)
+    return chat_store
+
+def close_chat_store():
+    global chat_store
+    if chat_store is not None:
+        chat_store.close()
+    chat_store = None
+
+def history_ip_key(version: int, value) -> str:
+    # Fixed-width hex keeps numeric order under text comparison, so a range
+    # of addresses is one BETWEEN on the index (IPv6 does not fit INTEGER).
+    return f"{version}:{value:032x}" if version != 99 else f"99:{value}"
+
+class HistoryStore:
+    # On-disk history of worker verdicts per normalized proxy address: every
+    # check goes into `checks`, the newest one per address into `latest`.
+    # Verdicts are queued in memory and written in batches, one transaction
+    # per batch in a worker thread, so the event loop never waits on disk.
+    # All SQLite access goes through the one connection under `lock`.
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checks (
+                proxy TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                success INTEGER NOT NULL,
+                ping INTEGER,
+                country TEXT,
+                as_name TEXT
+            );
+            CREATE INDEX IF NOT EXISTS checks_by_proxy ON checks (proxy, checked_at);
+            CREATE INDEX IF NOT EXISTS checks_by_time ON checks (checked_at);
+            CREATE TABLE IF NOT EXISTS latest (
+                proxy TEXT PRIMARY KEY,
+                ip_key TEXT NOT NULL,
+                port INTEGER NOT NULL,
+                checked_at REAL NOT NULL,
+                success INTEGER NOT NULL,
+                ping INTEGER,
+                country TEXT,
+                as_name TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS latest_by_ip ON latest (ip_key, port);
+            CREATE INDEX IF NOT EXISTS latest_by_time ON latest (checked_at);
+        """)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flush_handle = None
+        self.flushing = None
+        self.last_prune = 0.0
+        self.closed = False
+        self.recorded = self.written = self.flushes = 0
+
+    def record(self, proxy: str, outcome: str, summary: tuple | None):
+        version, value, port, host = address_sort_key(proxy)
+        ping = None
+        if summary is not None:
+            try: ping = int(float(summary[1]))
+            except (TypeError, ValueError): pass
+        country, as_name = (summary[2], summary[3]) if summary is not None else (None, None)
+        self.pending.append((proxy, history_ip_key(version, host if version == 99 else value), port or DEFAULT_PROXY_PORT, time.time(), int(outcome == OUTCOME_SUCCESS), ping, country, as_name))
+        self.recorded += 1
+        self._schedule()
+
+    def _schedule(self):
+        # At most one write is running; the next one starts once the queue is
+        # full or HISTORY_FLUSH_INTERVAL after the first queued verdict.
+        if self.closed or (self.flushing is not None and not self.flushing.done()): return
+        if len(self.pending) >= HISTORY_FLUSH_SIZE:
+            self._start_flush()
+        elif self.pending and self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(HISTORY_FLUSH_INTERVAL, self._start_flush)
+
+    def _start_flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.flushing = asyncio.create_task(self.flush())
+        self.flushing.add_done_callback(lambda _: self._schedule())
+
+    async def flush(self):
+        rows, self.pending = self.pending, []
+        if not rows: return
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} check result(s) to history: {e}")
+
+    def _write(self, rows: list[tuple]):
+        with self.lock, _Transaction(self.conn):
+            self.conn.executemany("INSERT INTO checks (proxy, checked_at, success, ping, country, as_name) VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(proxy, at, success, ping, country, as_name) for proxy, _, _, at, success, ping, country, as_name in rows])
+            self.conn.executemany("""
+                INSERT INTO latest (proxy, ip_key, port, checked_at, success, ping, country, as_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(proxy) DO UPDATE SET checked_at = excluded.checked_at, success = excluded.success,
+                    ping = excluded.ping, country = excluded.country, as_name = excluded.as_name
+                WHERE excluded.checked_at >= latest.checked_at
+            """, rows)
+            if time.monotonic() - self.last_prune >= HISTORY_PRUNE_INTERVAL:
+                cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+                self.conn.execute("DELETE FROM checks WHERE checked_at < ?", (cutoff,))
+                self.conn.execute("DELETE FROM latest WHERE checked_at < ?", (cutoff,))
+                self.last_prune = time.monotonic()
+        self.written += len(rows)
+        self.flushes += 1
+
+    def lookup_keys(self, ip_keys: list[str]) -> list[tuple]:
+        # (ip_key, port, success, checked_at) for every known address.
+        found = []
+        with self.lock:
+            for i in range(0, len(ip_keys), HISTORY_LOOKUP_CHUNK):
+                chunk = ip_keys[i:i + HISTORY_LOOKUP_CHUNK]
+                found += self.conn.execute(f"SELECT ip_key, port, success, checked_at FROM latest WHERE ip_key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        return found
+
+    def lookup_span(self, version: int, first: int, last: int, port: int) -> list[tuple]:
+        with self.lock:
+            return self.conn.execute("SELECT ip_key, port, success, checked_at FROM latest WHERE ip_key BETWEEN ? AND ? AND port = ?",
+                                     (history_ip_key(version, first), history_ip_key(version, last), port)).fetchall()
+
+    def recent_good(self, since: float, country: str = None, limit: int = HISTORY_LIST_LIMIT) -> tuple[int, list[tuple]]:
+        where, params = "success = 1 AND checked_at >= ?", [since]
+        if country:
+            where += " AND country = ? COLLATE NOCASE"
+            params.append(country)
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM latest WHERE {where}", params).fetchone()[0]
+            rows = self.conn.execute(f"SELECT proxy, ping, country, as_name, checked_at FROM latest WHERE {where} ORDER BY ping IS NULL, ping LIMIT ?", params + [limit]).fetchall()
+        return total, rows
+
+    def stats(self) -> dict:
+        return {'pending': len(self.pending), 'recorded': self.recorded, 'written': self.written, 'flushes': self.flushes}
+
+    async def close(self):
+        self.closed = True
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.flushing is not None:
+            await self.flushing
+        while self.pending:
+            await self.flush()
+        self.conn.close()
+
+history_store: HistoryStore | None = None
+
+def get_history_store() -> HistoryStore:
+    global history_store
+    if history_store is None:
+        history_store = HistoryStore(HISTORY_PATH)
+    return history_store
+
+async def close_history_store():
+    global history_store
+    if history_store is not None:
+        await history_store.close()
+    history_store = None
+
+async def _check_user_still_exists(bot, store: ChatStore, user_id: str, limiter: asyncio.Semaphore, bucket: "TokenBucket") -> bool:
+    # A lookup that hits flood control is retried once after the wait, which
+    # pauses the whole shard through the shared bucket.
+    async with limiter:
+        for attempt in range(2):
+            while (delay := bucket.delay(time.monotonic())) > 0:
+                await asyncio.sleep(delay)
+            bucket.take(time.monotonic())
+            try:
+                await bot.get_chat(chat_id=user_id)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+                logger.warning(f"Cleanup job hit flood control, waiting {retry_after}s.")
+                bucket.pause(time.monotonic(), retry_after)
+                continue
+            except BadRequest as e:
+                if "chat not found" in e.message.lower():
+                    logger.info(f"User account {user_id} appears to be deleted. Removing their data.")
+                    return store.delete_user(user_id)
+            except Exception as e:
+                logger.error(f"Error checking user {user_id} during cleanup: {e}")
+            return False
+        logger.warning(f"Cleanup job skipped user {user_id} after repeated flood control; the next pass checks it again.")
+    return False
 
 async def cleanup_deleted_users(context: ContextTypes.DEFAULT_TYPE):
-    logger.info("Running scheduled job: Cleaning up deleted users...")
-    db = load_db()
-    
-    user_ids_to_check = list(db.keys())
-    if not user_ids_to_check:
+    # Checks one shard of users per run. Shards are sized so that a full pass
+    # over every user takes about a day, and the position is persisted so a
+    # restart resumes where the previous run stopped.
+    store = get_chat_store()
+    total_users = store.count_users()
+    if not total_users:
         logger.info("Cleanup job: Database is empty. Nothing to do.")
         return
 
-    users_deleted_count = 0
-    for user_id in user_ids_to_check:
-        try:
-            await context.bot.get_chat(chat_id=user_id)
-            await asyncio.sleep(0.1)
-        except BadRequest as e:
-            if "chat not found" in e.message.lower():
-                logger.info(f"User account {user_id} appears to be deleted. Removing their data.")
-                if user_id in db:
-                    del db[user_id]
-                    users_deleted_count += 1
-        except Exception as e:
-            logger.error(f"Error checking user {user_id} during cleanup: {e}")
+    shards_per_day = max(1, int(86400 // CLEANUP_SHARD_INTERVAL))
+    shard_size = max(CLEANUP_MIN_SHARD_SIZE, -(-total_users // shards_per_day))
+    cursor = store.get_meta(CLEANUP_CURSOR_KEY, "")
+    user_ids_to_check = store.list_user_ids(after=cursor, limit=shard_size)
+    if not user_ids_to_check:
+        logger.info("Cleanup job: Finished a full pass over all users, starting over.")
+        store.set_meta(CLEANUP_CURSOR_KEY, "")
+        return
+
+    limiter = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+    bucket = TokenBucket(CLEANUP_RATE, CLEANUP_CONCURRENCY)
+    results = await asyncio.gather(*(_check_user_still_exists(context.bot, store, user_id, limiter, bucket) for user_id in user_ids_to_check))
+    store.set_meta(CLEANUP_CURSOR_KEY, user_ids_to_check[-1])
 
+    users_deleted_count = sum(1 for deleted in results if deleted)
     if users_deleted_count > 0:
-        save_db(db)
-        logger.info(f"Cleanup finished. Removed data for {users_deleted_count} deleted user(s).")
+        logger.info(f"Cleanup shard finished. Checked {len(user_ids_to_check)} user(s), removed data for {users_deleted_count} deleted user(s).")
     else:
-        logger.info("Cleanup finished. No deleted users found.")
+        logger.info(f"Cleanup shard finished. Checked {len(user_ids_to_check)} user(s), no deleted users found.")
 
 async def run_periodic_cleanup(application: Application):
     while True:
-        await asyncio.sleep(86400)
+        await asyncio.sleep(CLEANUP_SHARD_INTERVAL)
         try:
             await cleanup_deleted_users(context=application)
         except Exception as e:
             logger.error(f"An error occurred in the periodic cleanup loop: {e}")
 
-async def validate_proxy_with_worker(ip_obj: dict or str) -> dict | None:
-    proxy_address = ip_obj['ip'] if isinstance(ip_obj, dict) else ip_obj
-    async with httpx.AsyncClient() as client:
+http_client: httpx.AsyncClient | None = None
+
+def create_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(WORKER_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+    return httpx.AsyncClient(http2=HTTP2_ENABLED, limits=limits, timeout=timeout, follow_redirects=True)
+
+def get_http_client() -> httpx.AsyncClient:
+    # Every outbound HTTP call goes through this single pooled client so that
+    # connections (and TLS sessions) to the worker are reused across checks.
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None and not http_client.is_closed:
+        await http_client.aclose()
+    http_client = None
+
+def _read_http_pool(client: httpx.AsyncClient) -> dict | None:
+    # httpx exposes no pool metrics, so this looks at the httpcore pool behind
+    # the client's transport. Those attributes are private and may change
+    # between versions, or be missing for other transports; then it's None.
+    try:
+        pool = client._transport._pool
+        connections = list(pool.connections)
+        idle = sum(1 for conn in connections if conn.is_idle())
+        waiting = sum(1 for request in pool._requests if request.is_queued())
+    except (AttributeError, TypeError) as e:
+        logger.debug(f"HTTP pool stats unavailable: {e}")
+        return None
+    return {'open': len(connections), 'idle': idle, 'active': len(connections) - idle, 'waiting': waiting}
+
+def get_http_pool_stats() -> dict:
+    # Counts are 'n/a' when the pool could not be read.
+    stats = {'open': 0, 'idle': 0, 'active': 0, 'waiting': 0, 'http2': HTTP2_ENABLED}
+    if http_client is None or http_client.is_closed:
+        return stats
+    counts = _read_http_pool(http_client)
+    stats.update(counts if counts is not None else dict.fromkeys(('open', 'idle', 'active', 'waiting'), 'n/a'))
+    return stats
+
+OUTCOME_SUCCESS, OUTCOME_FAILED = 'success', 'failed'
+OUTCOME_TIMEOUT, OUTCOME_THROTTLED, OUTCOME_ERROR = 'timeout', 'throttled', 'error'
+OUTCOME_UNAVAILABLE = 'unavailable'
+WORKER_TROUBLE_OUTCOMES = (OUTCOME_TIMEOUT, OUTCOME_THROTTLED, OUTCOME_ERROR)
+WORKER_ERROR_OUTCOMES = (OUTCOME_THROTTLED, OUTCOME_ERROR, OUTCOME_UNAVAILABLE)
+
+class WorkerLatency:
+    # Rolling window of worker call latencies. The request timeout follows
+    # the observed tail (p99 times WORKER_TIMEOUT_MULTIPLIER, clamped to
+    # [WORKER_TIMEOUT_MIN, WORKER_TIMEOUT]) and p95 is the point at which a
+    # slow call gets a hedged duplicate. Until enough calls were seen the
+    # fixed WORKER_TIMEOUT applies and nothing is hedged.
+    def __init__(self, window: int, min_samples: int):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.ordered = None
+        self.calls = self.hedges = self.hedge_wins = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.ordered = None
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.samples) < self.min_samples: return None
+        if self.ordered is None:
+            self.ordered = sorted(self.samples)
+        return self.ordered[min(len(self.ordered) - 1, int(q * len(self.ordered)))]
+
+    def timeout(self) -> float:
+        p99 = self.percentile(0.99)
+        if p99 is None: return WORKER_TIMEOUT
+        return max(WORKER_TIMEOUT_MIN, min(WORKER_TIMEOUT, p99 * WORKER_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self) -> float | None:
+        return self.percentile(0.95) if WORKER_HEDGING else None
+
+    def take_hedge(self) -> bool:
+        # Hedges are capped at WORKER_HEDGE_BUDGET of all calls so a slow
+        # worker is not handed twice the load.
+        if self.hedges >= WORKER_HEDGE_BUDGET * self.calls: return False
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'samples': len(self.samples), 'p50': self.percentile(0.5), 'p95': self.percentile(0.95), 'p99': self.percentile(0.99),
+            'timeout': self.timeout(), 'calls': self.calls, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+        }
+
+class CircuitBreaker:
+    # Closed: calls flow. When more than CIRCUIT_ERROR_THRESHOLD of the last
+    # CIRCUIT_WINDOW worker calls ended in a timeout, 429 or error it opens:
+    # checks fail fast and the executor stops dispatching. After the cool-down
+    # a few probe calls are let through (half-open); a good answer closes it,
+    # trouble opens it again with a doubled cool-down.
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, window: int, min_calls: int, threshold: float, open_seconds: float):
+        self.recent = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.base_open_seconds = open_seconds
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.open_until = 0.0
+        self.probes = 0
+        self.trips = self.rejected = 0
+
+    def current_state(self) -> str:
+        if self.state == self.OPEN and time.monotonic() >= self.open_until:
+            self.state, self.probes = self.HALF_OPEN, 0
+        return self.state
+
+    def allow(self) -> bool:
+        state = self.current_state()
+        if state == self.CLOSED: return True
+        if state == self.HALF_OPEN and self.probes < CIRCUIT_PROBES:
+            self.probes += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def dispatch_limit(self, limit: int) -> int:
+        state = self.current_state()
+        if state == self.CLOSED: return limit
+        return min(limit, CIRCUIT_PROBES) if state == self.HALF_OPEN else 0
+
+    def retry_in(self) -> float:
+        return max(0.0, self.open_until - time.monotonic()) if self.current_state() == self.OPEN else 0.0
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + self.open_seconds
+        self.trips += 1
+        logger.warning(f"Worker error rate too high, pausing worker calls for {self.open_seconds:.0f}s.")
+        self.open_seconds = min(CIRCUIT_MAX_OPEN_SECONDS, self.open_seconds * 2)
+
+    def record(self, outcome: str):
+        trouble = outcome in WORKER_TROUBLE_OUTCOMES
+        state = self.current_state()
+        if state == self.HALF_OPEN:
+            self.probes = max(0, self.probes - 1)
+            if trouble:
+                self._trip()
+            else:
+                logger.info("Worker recovered, resuming worker calls.")
+                self.state, self.open_seconds = self.CLOSED, self.base_open_seconds
+                self.recent.clear()
+        elif state == self.CLOSED:
+            self.recent.append(trouble)
+            if len(self.recent) >= self.min_calls and sum(self.recent) / len(self.recent) > self.threshold:
+                self.recent.clear()
+                self._trip()
+
+    def stats(self) -> dict:
+        return {'state': self.current_state(), 'retry_in': self.retry_in(), 'trips': self.trips, 'rejected': self.rejected}
+
+worker_latency = WorkerLatency(WORKER_LATENCY_WINDOW, WORKER_LATENCY_MIN_SAMPLES)
+worker_circuit = CircuitBreaker(CIRCUIT_WINDOW, CIRCUIT_MIN_CALLS, CIRCUIT_ERROR_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+
+def worker_timeout() -> httpx.Timeout:
+    return httpx.Timeout(worker_latency.timeout(), connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+class WorkerEndpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.recent = deque(maxlen=WORKER_HEALTH_WINDOW)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = WORKER_EJECT_SECONDS
+        self.probing = False
+        self.batch_unsupported_until = 0.0
+        self.calls = self.errors = self.ejections = 0
+
+    def error_rate(self) -> float:
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def available(self, now: float) -> bool:
+        # Back from ejection, an endpoint gets one probe call at a time until
+        # it answers properly again.
+        return now >= self.ejected_until and not (self.probing and self.outstanding)
+
+    def supports_batch(self, now: float) -> bool:
+        return now >= self.batch_unsupported_until
+
+    def state(self, now: float) -> str:
+        if now < self.ejected_until: return 'ejected'
+        return 'probing' if self.probing else 'up'
+
+    def score(self, default_latency: float) -> float:
+        return (self.outstanding + 1) * (self.latency or default_latency) * (1 + 4 * self.error_rate())
+
+    def _eject(self):
+        logger.warning(f"Worker endpoint {self.url} ejected for {self.eject_seconds:.0f}s (error rate {self.error_rate():.0%}).")
+        self.ejected_until = time.monotonic() + self.eject_seconds
+        self.ejections += 1
+        self.probing = True
+        self.consecutive_failures = 0
+        self.recent.clear()
+        self.eject_seconds = min(WORKER_MAX_EJECT_SECONDS, self.eject_seconds * 2)
+
+    def record(self, outcome: str, elapsed: float):
+        trouble = outcome in WORKER_TROUBLE_OUTCOMES
+        self.calls += 1
+        if trouble: self.errors += 1
+        # Calls that were already in flight when the endpoint got ejected
+        # say nothing new about it.
+        if time.monotonic() < self.ejected_until: return
+        self.recent.append(trouble)
+        if trouble:
+            self.consecutive_failures += 1
+            if self.probing or self.consecutive_failures >= WORKER_EJECT_FAILURES or (len(self.recent) >= WORKER_HEALTH_WINDOW // 2 and self.error_rate() > WORKER_EJECT_ERROR_RATE):
+                self._eject()
+            return
+        self.consecutive_failures = 0
+        self.latency = elapsed if self.latency is None else self.latency + WORKER_LATENCY_SMOOTHING * (elapsed - self.latency)
+        if self.probing:
+            logger.info(f"Worker endpoint {self.url} is answering again.")
+            self.probing, self.eject_seconds = False, WORKER_EJECT_SECONDS
+
+class WorkerPool:
+    # Spreads worker calls over the WORKER_URL endpoints. Each call goes to
+    # the endpoint with the fewest outstanding checks, scaled by its smoothed
+    # latency and recent error rate. An endpoint that keeps failing is ejected
+    # for a doubling back-off, then probed with single calls.
+    def __init__(self, urls: list[str]):
+        self.endpoints = [WorkerEndpoint(url) for url in urls]
+
+    def pick(self, exclude: WorkerEndpoint = None) -> WorkerEndpoint:
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.available(now) and endpoint is not exclude]
+        if not candidates:
+            # Everything is ejected: rather than fail outright, use the
+            # endpoint that is due back first.
+            return min(self.endpoints, key=lambda endpoint: (endpoint is exclude, endpoint.ejected_until))
+        known = [endpoint.latency for endpoint in candidates if endpoint.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        return min(candidates, key=lambda endpoint: endpoint.score(default_latency))
+
+    def supports_batch(self) -> bool:
+        now = time.monotonic()
+        return any(endpoint.supports_batch(now) for endpoint in self.endpoints)
+
+    @staticmethod
+    def begin(endpoint: WorkerEndpoint, weight: int = 1) -> float:
+        endpoint.outstanding += weight
+        return time.monotonic()
+
+    @staticmethod
+    def finish(endpoint: WorkerEndpoint, started: float, outcome: str | None, weight: int = 1, latency: float = None):
+        # `outcome` is None for calls that ended without saying anything about
+        # the endpoint's health (cancelled hedges, missing batch endpoint).
+        endpoint.outstanding -= weight
+        if outcome is not None:
+            endpoint.record(outcome, time.monotonic() - started if latency is None else latency)
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [{
+            'url': endpoint.url, 'state': endpoint.state(now), 'outstanding': endpoint.outstanding, 'latency': endpoint.latency,
+            'error_rate': endpoint.error_rate(), 'calls': endpoint.calls, 'errors': endpoint.errors, 'ejections': endpoint.ejections,
+            'batching': endpoint.supports_batch(now),
+        } for endpoint in self.endpoints]
+
+worker_pool = WorkerPool(WORKER_URLS)
+
+def summarize_worker_result(data: dict) -> tuple:
+    # Only the fields the renderers need are kept: (proxyIP, ping, country, AS).
+    # Country and AS strings repeat across thousands of results, so intern them.
+    geo_info = data.get('info') or {}
+    return (data.get('proxyIP'), data.get('ping'), sys.intern(str(geo_info.get('country', 'N/A'))), sys.intern(str(geo_info.get('as', 'N/A'))))
+
+def worker_verdict(data: dict) -> tuple[str, tuple | None]:
+    return (OUTCOME_SUCCESS, summarize_worker_result(data)) if data.get("success") else (OUTCOME_FAILED, None)
+
+async def check_proxy_with_worker(proxy_address: str, endpoint: WorkerEndpoint = None, retry: bool = True) -> tuple[str, tuple | None]:
+    endpoint = endpoint or worker_pool.pick()
+    started = worker_pool.begin(endpoint)
+    verdict = (None, None)
+    try:
+        params = {'proxyip': proxy_address}
+        response = await get_http_client().get(f"{endpoint.url}/api/check", params=params, timeout=worker_timeout())
+        response.raise_for_status()
+        verdict = worker_verdict(response.json())
+    except httpx.TimeoutException:
+        logger.warning(f"Worker API timeout for {proxy_address} ({endpoint.url})")
+        verdict = OUTCOME_TIMEOUT, None
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Worker API Error for {proxy_address}: {e}")
+        verdict = (OUTCOME_THROTTLED if e.response.status_code == 429 else OUTCOME_ERROR), None
+    except Exception as e:
+        logger.error(f"Worker API Error for {proxy_address} ({endpoint.url}): {e}")
+        verdict = OUTCOME_ERROR, None
+    finally:
+        worker_pool.finish(endpoint, started, verdict[0])
+    if retry and verdict[0] == OUTCOME_ERROR and len(worker_pool.endpoints) > 1:
+        # Refused connections and 5xx mean the check most likely never ran,
+        # so it is safe to try once more on another endpoint.
+        return await check_proxy_with_worker(proxy_address, worker_pool.pick(exclude=endpoint), retry=False)
+    return verdict
+
+class WorkerBatcher:
+    # Packs concurrent checks into POST /api/check-batch requests and hands
+    # each NDJSON result line to the caller waiting on that target. Worker
+    # endpoints without the batch route are sent single checks instead and
+    # probed again after WORKER_BATCH_REPROBE_INTERVAL. A batch the worker
+    # rejects (400, or 413 when it caps the batch size lower than ours) is
+    # checked one by one on the same endpoint, and a 413 halves later
+    # batches. Targets of a batch that failed at one endpoint are retried
+    # once on another.
+    def __init__(self, batch_size: int, linger: float):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.waiting = deque()
+        self.timer = None
+        self.sending = set()
+        self.batches = self.batched = self.fallbacks = self.rerouted = 0
+
+    def enabled(self) -> bool:
+        return self.batch_size > 1 and worker_pool.supports_batch()
+
+    async def check(self, proxy_address: str) -> tuple[str, tuple | None]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiting.append((proxy_address, future))
+        if len(self.waiting) >= self.batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.waiting:
+            batch = {}
+            while self.waiting and len(batch) < self.batch_size:
+                address, future = self.waiting.popleft()
+                if not future.done():
+                    batch.setdefault(address, []).append(future)
+            if batch:
+                task = asyncio.create_task(self._send(batch))
+                self.sending.add(task)
+                task.add_done_callback(self.sending.discard)
+
+    @staticmethod
+    def _resolve(futures: list, verdict: tuple):
+        for future in futures:
+            if not future.done():
+                future.set_result(verdict)
+
+    async def _check_single(self, address: str, futures: list, endpoint: WorkerEndpoint = None, retry: bool = True):
+        self._resolve(futures, await check_proxy_with_worker(address, endpoint, retry))
+
+    async def _send_singles(self, batch: dict, endpoint: WorkerEndpoint = None, retry: bool = True):
+        await asyncio.gather(*(self._check_single(address, futures, endpoint, retry) for address, futures in batch.items()))
+
+    async def _send(self, batch: dict):
+        endpoint = worker_pool.pick()
+        if not endpoint.supports_batch(time.monotonic()):
+            self.fallbacks += len(batch)
+            await self._send_singles(batch, endpoint)
+            return
+        outcome, health, unsupported, failed = OUTCOME_ERROR, None, {}, {}
+        weight = len(batch)
+        started = worker_pool.begin(endpoint, weight)
+        answered, answer_time = 0, 0.0
         try:
-            params = {'proxyip': proxy_address}
-            response = await client.get(f"{WORKER_URL}/api/check", params=params, timeout=45.0)
+            async with get_http_client().stream('POST', f"{endpoint.url}/api/check-batch", json={'targets': list(batch)}, timeout=worker_timeout()) as response:
+                if response.status_code in (404, 405):
+                    logger.warning(f"Worker endpoint {endpoint.url} has no batch check endpoint, sending it single checks.")
+                    endpoint.batch_unsupported_until = time.monotonic() + WORKER_BATCH_REPROBE_INTERVAL
+                    unsupported, batch = batch, {}
+                elif response.status_code in (400, 413):
+                    logger.warning(f"Worker endpoint {endpoint.url} rejected a batch of {len(batch)} target(s) with HTTP {response.status_code}, sending it single checks.")
+                    if response.status_code == 413:
+                        self.batch_size = max(1, min(self.batch_size, len(batch)) // 2)
+                    unsupported, batch = batch, {}
+                else:
+                    response.raise_for_status()
+                    self.batches += 1
+                    self.batched += len(batch)
+                    async for line in response.aiter_lines():
+                        if not line.strip(): continue
+                        data = json.loads(line)
+                        futures = batch.pop(data.get('target'), None)
+                        if futures: self._resolve(futures, worker_verdict(data))
+                        answered += 1
+                        answer_time += time.monotonic() - started
+                    health = OUTCOME_SUCCESS
+            if batch:
+                logger.error(f"Worker batch ended without results for {len(batch)} target(s).")
+        except httpx.TimeoutException:
+            logger.warning(f"Worker API timeout for a batch of {len(batch)} target(s) ({endpoint.url})")
+            outcome = health = OUTCOME_TIMEOUT
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Worker API Error for a batch: {e}")
+            outcome = health = OUTCOME_THROTTLED if e.response.status_code == 429 else OUTCOME_ERROR
+            if outcome == OUTCOME_ERROR: failed, batch = batch, {}
+        except Exception as e:
+            logger.error(f"Worker API Error for a batch ({endpoint.url}): {e}")
+            health = OUTCOME_ERROR
+            failed, batch = batch, {}
+        finally:
+            # Endpoint latency is the mean time to each answer, which is what
+            # a single check on that endpoint would be compared against.
+            worker_pool.finish(endpoint, started, health, weight, answer_time / answered if answered else None)
+            for futures in batch.values():
+                self._resolve(futures, (outcome, None))
+        if unsupported:
+            self.fallbacks += len(unsupported)
+            await self._send_singles(unsupported, endpoint)
+        if failed and len(worker_pool.endpoints) > 1:
+            self.rerouted += len(failed)
+            await self._send_singles(failed, worker_pool.pick(exclude=endpoint), retry=False)
+        elif failed:
+            for futures in failed.values():
+                self._resolve(futures, (OUTCOME_ERROR, None))
+
+    def stats(self) -> dict:
+        return {
+            'mode': 'batched' if self.enabled() else 'single', 'batches': self.batches, 'in_flight': len(self.sending),
+            'avg_size': self.batched / self.batches if self.batches else 0.0, 'fallbacks': self.fallbacks, 'rerouted': self.rerouted,
+        }
+
+worker_batcher = WorkerBatcher(WORKER_BATCH_SIZE, WORKER_BATCH_LINGER)
+
+async def dispatch_worker_check(proxy_address: str) -> tuple[str, tuple | None]:
+    if worker_batcher.enabled():
+        return await worker_batcher.check(proxy_address)
+    return await check_proxy_with_worker(proxy_address)
+
+async def hedged_worker_check(primary: asyncio.Task, proxy_address: str, delay: float) -> tuple[str, tuple | None]:
+    # Past p95 a duplicate single check is raced against the original call;
+    # the first definite answer (working or failed proxy) wins.
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not worker_latency.take_hedge():
+        return await primary
+    hedge = asyncio.create_task(check_proxy_with_worker(proxy_address))
+    try:
+        pending = {primary, hedge}
+        verdict = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                verdict = task.result()
+                if verdict[0] not in WORKER_TROUBLE_OUTCOMES:
+                    if task is hedge: worker_latency.hedge_wins += 1
+                    return verdict
+        return verdict
+    finally:
+        hedge.cancel()
+
+async def run_worker_check(proxy_address: str) -> tuple[str, tuple | None]:
+    if not worker_circuit.allow():
+        return OUTCOME_UNAVAILABLE, None
+    worker_latency.calls += 1
+    started = time.monotonic()
+    primary = asyncio.create_task(dispatch_worker_check(proxy_address))
+    try:
+        delay = worker_latency.hedge_delay()
+        verdict = await (primary if delay is None else hedged_worker_check(primary, proxy_address, delay))
+    finally:
+        primary.cancel()
+    worker_latency.record(time.monotonic() - started)
+    worker_circuit.record(verdict[0])
+    return verdict
+
+def split_proxy_address(address: str) -> tuple[str, int | None]:
+    address = address.strip().lower()
+    host, port = address, None
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        if rest.startswith(':') and rest[1:].isdigit(): port = int(rest[1:])
+    elif address.count(':') == 1:
+        host, _, port_str = address.partition(':')
+        if port_str.isdigit(): port = int(port_str)
+    return host, port
+
+def normalize_proxy_address(address: str) -> str:
+    host, port = split_proxy_address(address)
+    try:
+        ip = ipaddress.ip_address(host)
+        host = f"[{ip.compressed}]" if ip.version == 6 else ip.compressed
+    except ValueError:
+        pass
+    return f"{host}:{port or 443}"
+
+def address_sort_key(address: str) -> tuple:
+    host, port = split_proxy_address(address)
+    try:
+        ip = ipaddress.ip_address(host)
+        return ip.version, int(ip), port or 0, ''
+    except ValueError:
+        return 99, 0, port or 0, host
+
+class Target(NamedTuple):
+    address: str
+    source_index: int | None = None
+    sort_key: tuple = ()
+
+class CheckResult:
+    __slots__ = ('proxy_ip', 'ping', 'country', 'as_name', 'source_index', 'sort_key')
+
+    def __init__(self, proxy_ip: str, ping, country: str, as_name: str, source_index: int | None = None, sort_key: tuple = ()):
+        self.proxy_ip = proxy_ip
+        self.ping = ping
+        self.country = country
+        self.as_name = as_name
+        self.source_index = source_index
+        self.sort_key = sort_key
+
+class ResultCache:
+    # LRU cache of worker verdicts keyed by normalized proxy address. Both
+    # successes and failures are cached (with their own TTLs); concurrent
+    # lookups for the same address share one in-flight worker call.
+    def __init__(self, max_entries: int, success_ttl: float, failure_ttl: float):
+        self.max_entries = max_entries
+        self.ttls = {OUTCOME_SUCCESS: success_ttl, OUTCOME_FAILED: failure_ttl}
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = self.misses = self.evictions = self.expirations = self.coalesced = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None: return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key: str, outcome: str, data: dict | None):
+        ttl = self.ttls.get(outcome)
+        if not ttl: return
+        self.entries[key] = (time.monotonic() + ttl, outcome, data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self.entries), 'in_flight': len(self.pending), 'hits': self.hits, 'misses': self.misses,
+            'coalesced': self.coalesced, 'evictions': self.evictions, 'expirations': self.expirations,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_SUCCESS_TTL, RESULT_CACHE_FAILURE_TTL)
+
+async def cached_check_proxy(proxy_address: str, fresh: bool = False) -> tuple[str, dict | None]:
+    key = normalize_proxy_address(proxy_address)
+    if not fresh:
+        cached = result_cache.get(key)
+        if cached is not None:
+            result_cache.hits += 1
+            return cached
+
+    shared = result_cache.pending.get(key)
+    if shared is None:
+        result_cache.misses += 1
+        task = asyncio.create_task(run_worker_check(proxy_address))
+        shared = result_cache.pending[key] = [task, 0]
+
+        def on_done(finished, key=key):
+            result_cache.pending.pop(key, None)
+            if not finished.cancelled() and finished.exception() is None:
+                outcome, summary = finished.result()
+                result_cache.put(key, outcome, summary)
+                if outcome in (OUTCOME_SUCCESS, OUTCOME_FAILED):
+                    get_history_store().record(key, outcome, summary)
+        task.add_done_callback(on_done)
+    else:
+        result_cache.coalesced += 1
+
+    task = shared[0]
+    shared[1] += 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if shared[1] == 1 and not task.done():
+            task.cancel()
+        raise
+    finally:
+        shared[1] -= 1
+
+def split_fresh_flag(inputs: list) -> tuple[list, bool]:
+    remaining = [item for item in inputs if item.lower() not in FRESH_FLAGS]
+    return remaining, len(remaining) != len(inputs)
+
+def ping_value(res: CheckResult) -> float:
+    try:
+        return float(res.ping)
+    except (TypeError, ValueError):
+        return float('inf')
+
+class TopResults:
+    # Goal of a "first N good proxies" test. Successes at or under max_ping
+    # qualify and the test is stopped once `limit` of them have been seen, so
+    # the kept set is the first N to qualify (plus any faster stragglers from
+    # checks already in flight), listed by ping - not the N fastest overall.
+    def __init__(self, limit: int | None, max_ping: int | None = None):
+        self.limit = limit
+        self.max_ping = max_ping
+        self.heap = []
+        self.qualified = 0
+        self.order = itertools.count()
+
+    def offer(self, res: CheckResult) -> bool:
+        # Returns True when the kept set changed.
+        ping = ping_value(res)
+        if self.max_ping is not None and ping > self.max_ping: return False
+        self.qualified += 1
+        entry = (-ping, next(self.order), res)
+        if self.limit is None or len(self.heap) < self.limit:
+            heapq.heappush(self.heap, entry)
+            return True
+        if ping < -self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+    def reached(self) -> bool:
+        return self.limit is not None and self.qualified >= self.limit
+
+    def results(self) -> list[CheckResult]:
+        return [res for _, _, res in sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))]
+
+    def describe(self) -> str:
+        parts = []
+        if self.limit is not None: parts.append(f"{min(self.qualified, self.limit)}/{self.limit}")
+        if self.max_ping is not None: parts.append(f"<={self.max_ping}ms")
+        return "Goal: " + " ".join(parts)
+
+def split_goal_options(inputs: list) -> tuple[list, TopResults | None, str | None]:
+    # Accepts `--top N` / `--top=N` and `--max-ping MS` / `--max-ping=MS`.
+    # The value must be a positive whole number; anything else is reported
+    # back as a usage error rather than silently consuming the next input.
+    remaining, limit, max_ping = [], None, None
+    items = list(inputs)
+    i = 0
+    while i < len(items):
+        name, has_value, value = items[i].partition('=')
+        name = name.lower()
+        if name not in TOP_FLAGS and name not in MAX_PING_FLAGS:
+            remaining.append(items[i])
+            i += 1
+            continue
+        if not has_value and i + 1 < len(items) and items[i + 1].isdigit():
+            value, i = items[i + 1], i + 1
+        i += 1
+        if not value.isdigit() or int(value) == 0:
+            usage = "--top N" if name in TOP_FLAGS else "--max-ping MS"
+            return remaining, None, f"{name} needs a positive whole number. Usage: {usage}"
+        if name in TOP_FLAGS: limit = min(int(value), TOP_RESULTS_MAX)
+        else: max_ping = int(value)
+    if limit is None and max_ping is None:
+        return remaining, None, None
+    return remaining, TopResults(limit, max_ping), None
+
+async def check_target(target: Target | str, fresh: bool = False) -> tuple[str, CheckResult | None]:
+    if isinstance(target, str):
+        target = Target(target, None, address_sort_key(target))
+    outcome, summary = await cached_check_proxy(target.address, fresh)
+    if summary is None:
+        return outcome, None
+    return outcome, CheckResult(*summary, target.source_index, target.sort_key)
+
+async def validate_proxy_with_worker(target: Target | str) -> CheckResult | None:
+    _, result = await check_target(target)
+    return result
+
+class AdaptiveConcurrency:
+    # Additive-increase / multiplicative-decrease limit on checks in flight,
+    # driven by the share of timeouts, 429s and errors among recent calls.
+    def __init__(self, initial: int = None, minimum: int = None, maximum: int = None):
+        self.minimum = minimum or CHECK_CONCURRENCY_MIN
+        self.maximum = maximum or CHECK_CONCURRENCY_MAX
+        self.value = float(max(self.minimum, min(self.maximum, initial or CHECK_CONCURRENCY_INITIAL)))
+        self.recent = deque(maxlen=AIMD_WINDOW)
+        self.last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self.value)
+
+    def trouble_rate(self) -> float:
+        if not self.recent: return 0.0
+        return sum(1 for outcome in self.recent if outcome in WORKER_TROUBLE_OUTCOMES) / len(self.recent)
+
+    def record(self, outcome: str):
+        if outcome == OUTCOME_UNAVAILABLE: return
+        self.recent.append(outcome)
+        now = time.monotonic()
+        if outcome in WORKER_TROUBLE_OUTCOMES and self.trouble_rate() > AIMD_TROUBLE_THRESHOLD:
+            if now - self.last_decrease >= AIMD_DECREASE_COOLDOWN:
+                self.value = max(self.minimum, self.value * AIMD_BACKOFF)
+                self.last_decrease = now
+        elif outcome not in WORKER_TROUBLE_OUTCOMES:
+            self.value = min(self.maximum, self.value + 1 / self.value)
+
+class CheckFlow:
+    def __init__(self, owner, priority: str, targets, on_result, total: int = None, is_paused=None, is_stopped=None, fresh: bool = False):
+        self.owner = owner
+        self.fresh = fresh
+        self.priority = priority
+        self.targets = targets
+        self.iterator = iter(targets)
+        self.ready = getattr(targets, 'ready', None)
+        self.record = getattr(targets, 'record', None)
+        self.on_result = on_result
+        self.total = total
+        self.is_paused = is_paused
+        self.is_stopped = is_stopped
+        self.dispatched = 0
+        self.exhausted = False
+        self.cancelled = False
+        self.in_flight = set()
+        self.changed = asyncio.Event()
+
+    def stopped(self) -> bool:
+        return self.cancelled or bool(self.is_stopped and self.is_stopped())
+
+    def eligible(self) -> bool:
+        if self.exhausted or self.stopped() or (self.is_paused and self.is_paused()): return False
+        return self.ready is None or self.ready()
+
+    def finished(self) -> bool:
+        return (self.exhausted or self.stopped()) and not self.in_flight
+
+    def next_target(self):
+        target = next(self.iterator, None)
+        if target is None:
+            self.exhausted = True
+        else:
+            self.dispatched += 1
+        return target
+
+    def queued(self) -> int | None:
+        if self.exhausted: return 0
+        total = self.total
+        if total is None and hasattr(self.targets, '__len__'):
+            total = len(self.targets)
+        return None if total is None else max(0, total - self.dispatched)
+
+    def cancel_in_flight(self):
+        for task in self.in_flight:
+            task.cancel()
+
+class FairQueue:
+    def __init__(self, owner, priority: str):
+        self.owner = owner
+        self.priority = priority
+        self.quantum = PRIORITY_QUANTUM[priority]
+        self.deficit = 0.0
+        self.flows = deque()
+
+    def next_eligible_flow(self) -> CheckFlow | None:
+        for _ in range(len(self.flows)):
+            flow = self.flows[0]
+            self.flows.rotate(-1)
+            if flow.eligible():
+                return flow
+        return None
+
+class CheckExecutor:
+    # Bot-wide pool of worker checks. Every test registers a flow; slots are
+    # handed out by deficit round-robin over (priority, user) queues, so a huge
+    # background scan cannot starve a small interactive test.
+    def __init__(self):
+        self.concurrency = AdaptiveConcurrency()
+        self.queues = {}
+        self.rotation = deque()
+        self.in_flight = set()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+
+    def _register(self, flow: CheckFlow):
+        key = (flow.priority, flow.owner)
+        if key not in self.queues:
+            self.queues[key] = FairQueue(flow.owner, flow.priority)
+            self.rotation.append(key)
+        self.queues[key].flows.append(flow)
+
+    def _unregister(self, flow: CheckFlow):
+        key = (flow.priority, flow.owner)
+        queue = self.queues.get(key)
+        if not queue: return
+        if flow in queue.flows:
+            queue.flows.remove(flow)
+        if not queue.flows:
+            del self.queues[key]
+            self.rotation.remove(key)
+
+    def _next_dispatch(self):
+        for _ in range(len(self.rotation)):
+            queue = self.queues[self.rotation[0]]
+            flow = queue.next_eligible_flow()
+            if flow is None:
+                queue.deficit = 0.0
+                self.rotation.rotate(-1)
+                continue
+            if queue.deficit < 1:
+                queue.deficit += queue.quantum
+            target = flow.next_target()
+            if target is None:
+                continue
+            queue.deficit -= 1
+            if queue.deficit < 1:
+                self.rotation.rotate(-1)
+            return flow, target
+        return None
+
+    def _fill(self):
+        while len(self.in_flight) < worker_circuit.dispatch_limit(self.concurrency.limit):
+            picked = self._next_dispatch()
+            if picked is None: break
+            flow, target = picked
+            task = asyncio.create_task(self._run_check(flow, target))
+            self.in_flight.add(task)
+            flow.in_flight.add(task)
+
+    async def _run_check(self, flow: CheckFlow, target):
+        task = asyncio.current_task()
+        try:
+            outcome, result = await check_target(target, flow.fresh)
+            self.concurrency.record(outcome)
+            if flow.record: flow.record(target, outcome, result)
+            await flow.on_result(target, outcome, result)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error while handling check result: {e}")
+        finally:
+            self.in_flight.discard(task)
+            flow.in_flight.discard(task)
+            flow.changed.set()
+            self.wakeup.set()
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                self._fill()
+            except Exception as e:
+                logger.error(f"Check dispatcher error: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def _ensure_dispatcher(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def run(self, targets, on_result, owner=None, priority: str = PRIORITY_INTERACTIVE, total: int = None, is_paused=None, is_stopped=None, fresh: bool = False):
+        flow = CheckFlow(owner, priority, targets, on_result, total, is_paused, is_stopped, fresh)
+        self._register(flow)
+        self._ensure_dispatcher()
+        self.wakeup.set()
+        try:
+            while not flow.finished():
+                if flow.stopped():
+                    flow.cancel_in_flight()
+                flow.changed.clear()
+                try:
+                    await asyncio.wait_for(flow.changed.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            flow.cancelled = True
+            flow.cancel_in_flight()
+            close = getattr(targets, 'close', None)
+            if close: close()
+            self._unregister(flow)
+            self.wakeup.set()
+
+    def snapshot(self) -> dict:
+        owners = {}
+        for (priority, owner), queue in self.queues.items():
+            entry = owners.setdefault(owner, {'tests': 0, 'queued': 0, 'unknown': False, 'in_flight': 0, 'priorities': set()})
+            entry['priorities'].add(priority)
+            for flow in queue.flows:
+                entry['tests'] += 1
+                entry['in_flight'] += len(flow.in_flight)
+                queued = flow.queued()
+                if queued is None: entry['unknown'] = True
+                else: entry['queued'] += queued
+        return {'limit': self.concurrency.limit, 'in_flight': len(self.in_flight), 'trouble_rate': self.concurrency.trouble_rate(), 'owners': owners}
+
+check_executor = CheckExecutor()
+
+async def stream_checks(targets, on_result, owner=None, priority: str = PRIORITY_INTERACTIVE, total: int = None, is_paused=None, is_stopped=None, fresh: bool = False):
+    await check_executor.run(targets, on_result, owner, priority, total, is_paused, is_stopped, fresh)
+
+class TargetQueue:
+    # Work queue for a live test: a read cursor over the (deduplicated) target
+    # source plus counters, so handing out the next target is O(1) and a paused
+    # test resumes exactly where it stopped. Sources may be lazy (ranges) or
+    # still growing (domains being resolved).
+    def __init__(self, targets):
+        self.targets = targets
+        self.source = iter(targets)
+        self.cursor = 0
+        self.checked = 0
+        self.outcomes = Counter()
+
+    @property
+    def total(self) -> int:
+        return len(self.targets)
+
+    def __len__(self) -> int:
+        return self.total
+
+    @property
+    def skipped(self) -> Counter:
+        return getattr(self.targets, 'skipped', None) or Counter()
+
+    def ready(self) -> bool:
+        ready = getattr(self.targets, 'ready', None)
+        return ready is None or ready()
+
+    def record(self, target: Target, outcome: str, result: CheckResult | None):
+        record = getattr(self.targets, 'record', None)
+        if record: record(target, outcome, result)
+
+    def coverage_report(self) -> str:
+        report = getattr(self.targets, 'coverage_report', None)
+        return report() if report else ""
+
+    def close(self):
+        close = getattr(self.targets, 'close', None)
+        if close: close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        target = next(self.source)
+        self.cursor += 1
+        return target
+
+    def pending(self) -> int:
+        return self.total - self.cursor
+
+NO_SOURCE = 0xFFFF
+DEFAULT_PROXY_PORT = 443
+
+SKIP_DUPLICATE, SKIP_INVALID = 'duplicate', 'invalid'
+SKIP_RECENTLY_DEAD = 'recently dead'
+SKIP_PRIVATE, SKIP_LOOPBACK, SKIP_LINK_LOCAL, SKIP_MULTICAST, SKIP_RESERVED = 'private', 'loopback', 'link-local', 'multicast', 'reserved'
+BOGON_NETWORKS = [
+    ("0.0.0.0/8", SKIP_RESERVED), ("10.0.0.0/8", SKIP_PRIVATE), ("100.64.0.0/10", SKIP_PRIVATE),
+    ("127.0.0.0/8", SKIP_LOOPBACK), ("169.254.0.0/16", SKIP_LINK_LOCAL), ("172.16.0.0/12", SKIP_PRIVATE),
+    ("192.0.0.0/24", SKIP_RESERVED), ("192.0.2.0/24", SKIP_RESERVED), ("192.168.0.0/16", SKIP_PRIVATE),
+    ("198.18.0.0/15", SKIP_RESERVED), ("198.51.100.0/24", SKIP_RESERVED), ("203.0.113.0/24", SKIP_RESERVED),
+    ("224.0.0.0/4", SKIP_MULTICAST), ("240.0.0.0/4", SKIP_RESERVED),
+    ("::/128", SKIP_RESERVED), ("::1/128", SKIP_LOOPBACK), ("::ffff:0:0/96", SKIP_RESERVED), ("100::/64", SKIP_RESERVED),
+    ("2001:db8::/32", SKIP_RESERVED), ("fc00::/7", SKIP_PRIVATE), ("fe80::/10", SKIP_LINK_LOCAL), ("ff00::/8", SKIP_MULTICAST),
+]
+
+def _build_bogon_table(version: int) -> tuple[list, list]:
+    ranges = []
+    for cidr, reason in BOGON_NETWORKS:
+        net = ipaddress.ip_network(cidr)
+        if net.version == version:
+            ranges.append((int(net.network_address), int(net.broadcast_address), reason))
+    ranges.sort()
+    return [low for low, _, _ in ranges], ranges
+
+BOGON_TABLES = {4: _build_bogon_table(4), 6: _build_bogon_table(6)}
+DOTTED_QUAD_PATTERN = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+def bogon_reason(version: int, value: int) -> str | None:
+    # Sorted, non-overlapping table, so one bisect finds the only candidate.
+    starts, ranges = BOGON_TABLES[version]
+    i = bisect_right(starts, value) - 1
+    if i >= 0 and value <= ranges[i][1]:
+        return ranges[i][2]
+    return None
+
+def bogon_overlaps(version: int, first: int, last: int):
+    # Yields (low, high, reason) for every bogon block intersecting [first, last].
+    starts, ranges = BOGON_TABLES[version]
+    for low, high, reason in ranges[max(0, bisect_right(starts, first) - 1):]:
+        if low > last: break
+        if high >= first:
+            yield max(low, first), min(high, last), reason
+
+def has_malformed_port(address: str, port: int | None) -> bool:
+    if port is not None:
+        return not 0 < port <= 0xFFFF
+    address = address.strip()
+    if address.startswith('['):
+        return address.partition(']')[2] != ''
+    return address.count(':') == 1
+
+def describe_skipped(skipped: Counter) -> str:
+    total = sum(skipped.values())
+    if not total: return ""
+    reasons = ", ".join(f"{count:,} {reason}" for reason, count in skipped.most_common())
+    return f"Skipped {total:,} ({reasons})"
+
+def recently_dead_hint(skipped: Counter) -> str:
+    if not skipped[SKIP_RECENTLY_DEAD]: return ""
+    return f"\n{skipped[SKIP_RECENTLY_DEAD]:,} address(es) failed within the last {HISTORY_SKIP_DEAD_SECONDS / 60:.0f} minute(s); add --fresh to test them again."
+
+def describe_outcomes(outcomes: Counter) -> str:
+    # A failed proxy is a verdict; timeouts and worker errors are not, and
+    # those addresses are worth testing again later.
+    errors = sum(outcomes[outcome] for outcome in WORKER_ERROR_OUTCOMES)
+    parts = [f"{outcomes[OUTCOME_FAILED]:,} failed"]
+    if outcomes[OUTCOME_TIMEOUT]: parts.append(f"{outcomes[OUTCOME_TIMEOUT]:,} timed out")
+    if errors: parts.append(f"{errors:,} worker error(s)")
+    return "Not working: " + ", ".join(parts)
+
+class CompactTargets:
+    # Deduplicated target list for list-based tests. IPv4 targets live in
+    # parallel typed arrays (address, port, source index: 8 bytes each); only
+    # IPv6 addresses and hostnames fall back to a list of strings. Malformed,
+    # bogon and duplicate entries are dropped here, before any network call,
+    # and counted per reason in `skipped`.
+    def __init__(self):
+        self.addresses = array('I')
+        self.ports = array('H')
+        self.sources = array('H')
+        self.others = []
+        self._seen = set()
+        self.skipped = Counter()
+
+    def add(self, address: str, source_index: int | None = None):
+        if self._seen is None:
+            raise RuntimeError("Targets cannot be added once iteration has started.")
+        source = NO_SOURCE if source_index is None else source_index
+        host, port = split_proxy_address(address)
+        if not host or has_malformed_port(address, port):
+            self.skipped[SKIP_INVALID] += 1
+            return
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            if ':' in host or DOTTED_QUAD_PATTERN.match(host):
+                self.skipped[SKIP_INVALID] += 1
+                return
+            ip = None
+        if ip is not None:
+            reason = bogon_reason(ip.version, int(ip))
+            if reason:
+                self.skipped[reason] += 1
+                return
+        if ip is not None and ip.version == 4:
+            value = int(ip)
+            key = (value << 16) | (port or DEFAULT_PROXY_PORT)
+            if key in self._seen:
+                self.skipped[SKIP_DUPLICATE] += 1
+                return
+            self._seen.add(key)
+            self.addresses.append(value)
+            self.ports.append(port or 0)
+            self.sources.append(source)
+        else:
+            key = normalize_proxy_address(address)
+            if key in self._seen:
+                self.skipped[SKIP_DUPLICATE] += 1
+                return
+            self._seen.add(key)
+            self.others.append((address.strip(), source_index))
+
+    def __len__(self) -> int:
+        return len(self.addresses) + len(self.others)
+
+    def __iter__(self):
+        self._seen = None
+        for value, port, source in zip(self.addresses, self.ports, self.sources):
+            address = format_ip_int(value, 4)
+            yield Target(f"{address}:{port}" if port else address, None if source == NO_SOURCE else source, (4, value, port, ''))
+        for address, source_index in self.others:
+            yield Target(address, source_index, address_sort_key(address))
+
+class GrowingTargets(CompactTargets):
+    # CompactTargets that keeps accepting targets while checks consume them.
+    # A background task (domain resolution, file download) fills it; the
+    # executor only pulls from it while ready() is true.
+    def __init__(self):
+        super().__init__()
+        self.address_cursor = 0
+        self.other_cursor = 0
+        self.done = False
+        self.error = None
+        self.progress = asyncio.Event()
+        self.task = None
+
+    def start(self, fill):
+        self.task = asyncio.create_task(self._run(fill))
+
+    async def _run(self, fill):
+        try:
+            await fill
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error while collecting targets: {e}")
+            self.error = e
+        finally:
+            self.done = True
+            self.notify()
+
+    def notify(self):
+        self.progress.set()
+        check_executor.wakeup.set()
+
+    async def wait_for_first(self) -> bool:
+        # Waits until at least one target is available or filling is over;
+        # returns False when nothing was produced.
+        while not len(self) and not self.done:
+            self.progress.clear()
+            await self.progress.wait()
+        return len(self) > 0
+
+    def ready(self) -> bool:
+        return self.address_cursor < len(self.addresses) or self.other_cursor < len(self.others) or self.done
+
+    def close(self):
+        if self.task: self.task.cancel()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Target:
+        if self.address_cursor < len(self.addresses):
+            i = self.address_cursor
+            self.address_cursor += 1
+            value, port, source = self.addresses[i], self.ports[i], self.sources[i]
+            address = format_ip_int(value, 4)
+            return Target(f"{address}:{port}" if port else address, None if source == NO_SOURCE else source, (4, value, port, ''))
+        if self.other_cursor < len(self.others):
+            address, source_index = self.others[self.other_cursor]
+            self.other_cursor += 1
+            return Target(address, source_index, address_sort_key(address))
+        raise StopIteration
+
+ADDRESS_TOKEN_PATTERN = re.compile(rb'\b(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})(?::(\d+))?\b')
+ADDRESS_TOKEN_BYTES = frozenset(b'0123456789.:')
+MAX_TOKEN_CARRY = 64
+# Maps token characters to 1 and everything else to 0, so runs of token
+# characters can be found with bytes.find instead of a per-byte loop.
+TOKEN_BYTE_MARKS = bytes(1 if byte in ADDRESS_TOKEN_BYTES else 0 for byte in range(256))
+OVERLONG_TOKEN_RUN = b'\x01' * (MAX_TOKEN_CARRY + 1)
+
+class AddressTokenizer:
+    # Finds ip[:port] tokens in a byte stream fed in arbitrary chunks. The
+    # trailing run of token characters is held back for the next chunk, along
+    # with one byte of context so word boundaries match a whole-body scan.
+    # Runs of token characters longer than MAX_TOKEN_CARRY never yield a
+    # token, wherever the chunk boundaries fall, so the carry stays bounded.
+    def __init__(self):
+        self.buffer = b''
+        self.offset = 0
+        self.skipping = False
+
+    @staticmethod
+    def _scan(data: bytes, marks: bytes, start: int, end: int) -> list[tuple]:
+        tokens, pos = [], start
+        run = marks.find(OVERLONG_TOKEN_RUN, pos, end)
+        while run >= 0:
+            tokens += ADDRESS_TOKEN_PATTERN.findall(data, pos, run)
+            pos = marks.find(b'\x00', run, end)
+            if pos < 0: return tokens
+            run = marks.find(OVERLONG_TOKEN_RUN, pos, end)
+        tokens += ADDRESS_TOKEN_PATTERN.findall(data, pos, end)
+        return tokens
+
+    def feed(self, chunk: bytes) -> list[tuple]:
+        data = self.buffer + chunk if self.buffer else chunk
+        marks = data.translate(TOKEN_BYTE_MARKS)
+        start = self.offset
+        if self.skipping:
+            # Still inside an over-long run from an earlier chunk.
+            start = marks.find(b'\x00', start)
+            if start < 0:
+                self.buffer, self.offset = b'', 0
+                return []
+            self.skipping = False
+        end = len(data)
+        floor = max(start, end - MAX_TOKEN_CARRY - 1)
+        cut = max(floor, marks.rfind(b'\x00', floor, end) + 1)
+        if end - cut > MAX_TOKEN_CARRY:
+            self.skipping = True
+            self.buffer, self.offset = b'', 0
+            return self._scan(data, marks, start, end)
+        tokens = self._scan(data, marks, start, cut)
+        keep = max(cut - 1, 0)
+        self.buffer = data[keep:]
+        self.offset = cut - keep
+        return tokens
+
+    def finish(self) -> list[tuple]:
+        tokens = [] if self.skipping else ADDRESS_TOKEN_PATTERN.findall(self.buffer, self.offset)
+        self.buffer = b''
+        self.offset = 0
+        self.skipping = False
+        return tokens
+
+class FileTargets(GrowingTargets):
+    # Streams a remote list and feeds every ip[:port] token to the checks as
+    # soon as its chunk arrives; nothing but the deduplicated targets is kept.
+    def __init__(self, url: str, max_bytes: int = None):
+        super().__init__()
+        self.url = url
+        self.max_bytes = FILE_MAX_BYTES if max_bytes is None else max_bytes
+        self.bytes_read = 0
+        self.truncated = False
+        self.start(self._download())
+
+    def add_tokens(self, tokens: list[tuple]):
+        # Same rules as CompactTargets.add, specialised for pre-split IPv4
+        # tokens so a whole chunk is filtered without building strings.
+        seen, skipped, addresses, ports, sources = self._seen, self.skipped, self.addresses, self.ports, self.sources
+        starts, ranges = BOGON_TABLES[4]
+        for a, b, c, d, port_text in tokens:
+            a, b, c, d = int(a), int(b), int(c), int(d)
+            port = int(port_text) if port_text else 0
+            if a > 255 or b > 255 or c > 255 or d > 255 or port > 0xFFFF or (port_text and not port):
+                skipped[SKIP_INVALID] += 1
+                continue
+            value = (a << 24) | (b << 16) | (c << 8) | d
+            i = bisect_right(starts, value) - 1
+            if i >= 0 and value <= ranges[i][1]:
+                skipped[ranges[i][2]] += 1
+                continue
+            key = (value << 16) | (port or DEFAULT_PROXY_PORT)
+            if key in seen:
+                skipped[SKIP_DUPLICATE] += 1
+                continue
+            seen.add(key)
+            addresses.append(value)
+            ports.append(port)
+            sources.append(NO_SOURCE)
+
+    async def _download(self):
+        tokenizer = AddressTokenizer()
+        started = time.monotonic()
+        async with get_http_client().stream('GET', self.url, timeout=DOWNLOAD_TIMEOUT) as response:
             response.raise_for_status()
-            data = response.json()
-            if data.get("success"):
-                if isinstance(ip_obj, dict):
-                    data.update(ip_obj)
-                return data
+            async for chunk in response.aiter_bytes(FILE_CHUNK_SIZE):
+                if self.bytes_read + len(chunk) > self.max_bytes:
+                    chunk = chunk[:self.max_bytes - self.bytes_read]
+                    self.truncated = True
+                self.bytes_read += len(chunk)
+                self.add_tokens(tokenizer.feed(chunk))
+                self.notify()
+                if self.truncated:
+                    logger.warning(f"Stopped reading {self.url} at the {self.max_bytes} byte limit.")
+                    break
+        self.add_tokens(tokenizer.finish())
+        elapsed = time.monotonic() - started
+        logger.info(f"Ingested {self.bytes_read / 1e6:.1f} MB from {self.url} in {elapsed:.1f}s, {len(self)} unique target(s).")
+
+def compact_targets(addresses, source_index: int | None = None) -> CompactTargets:
+    targets = CompactTargets()
+    for address in addresses:
+        targets.add(address, source_index)
+    return targets
+
+def country_list_url(country_code: str) -> str:
+    return COUNTRY_URLS.get(country_code) or f"{COUNTRY_FILE_BASE_URL}{country_code.upper()}.txt"
+
+class CountryListCache:
+    # On-disk copies of the country proxy lists. Bodies live in files next to
+    # a small JSON sidecar with the validators (ETag / Last-Modified); only the
+    # sidecars are kept in memory. A stale list is served immediately while a
+    # conditional GET refreshes it in the background.
+    def __init__(self, directory: str, fresh_for: float):
+        self.directory = directory
+        self.fresh_for = fresh_for
+        self.meta = {}
+        self.refreshing = {}
+        self.hits = self.stale_hits = self.misses = self.not_modified = self.downloads = self.errors = 0
+
+    def _paths(self, country_code: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, country_code.upper())
+        return f"{base}.list", f"{base}.json"
+
+    def _load_meta(self, country_code: str) -> dict | None:
+        if country_code not in self.meta:
+            body_path, meta_path = self._paths(country_code)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.meta[country_code] = meta if os.path.exists(body_path) else None
+            except (OSError, ValueError):
+                self.meta[country_code] = None
+        return self.meta[country_code]
+
+    def _write(self, country_code: str, meta: dict, body: bytes | None):
+        os.makedirs(self.directory, exist_ok=True)
+        body_path, meta_path = self._paths(country_code)
+        if body is not None:
+            with open(f"{body_path}.tmp", 'wb') as f:
+                f.write(body)
+            os.replace(f"{body_path}.tmp", body_path)
+        with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def _read(self, country_code: str) -> str:
+        with open(self._paths(country_code)[0], 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+
+    async def _revalidate(self, country_code: str):
+        meta = self._load_meta(country_code)
+        headers = {}
+        if meta and meta.get('etag'): headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = await get_http_client().get(country_list_url(country_code), headers=headers, timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code == 304 and meta:
+                self.not_modified += 1
+                meta = dict(meta, fetched_at=time.time())
+                await asyncio.to_thread(self._write, country_code, meta, None)
+            else:
+                response.raise_for_status()
+                self.downloads += 1
+                meta = {'etag': response.headers.get('etag'), 'last_modified': response.headers.get('last-modified'), 'fetched_at': time.time()}
+                await asyncio.to_thread(self._write, country_code, meta, response.content)
+            self.meta[country_code] = meta
+        except Exception as e:
+            self.errors += 1
+            if meta is None: raise
+            logger.warning(f"Could not refresh the {country_code} proxy list, serving the cached copy: {e}")
+
+    def refresh(self, country_code: str) -> asyncio.Task:
+        task = self.refreshing.get(country_code)
+        if task is None:
+            task = self.refreshing[country_code] = asyncio.create_task(self._revalidate(country_code))
+            task.add_done_callback(lambda _, code=country_code: self.refreshing.pop(code, None))
+        return task
+
+    def is_fresh(self, country_code: str) -> bool:
+        meta = self._load_meta(country_code)
+        return bool(meta) and time.time() - meta.get('fetched_at', 0) < self.fresh_for
+
+    async def get(self, country_code: str) -> str:
+        meta = self._load_meta(country_code)
+        if meta is None:
+            self.misses += 1
+            await asyncio.shield(self.refresh(country_code))
+        elif self.is_fresh(country_code):
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self.refresh(country_code)
+        return await asyncio.to_thread(self._read, country_code)
+
+    async def prefetch(self, country_codes):
+        limiter = asyncio.Semaphore(COUNTRY_PREFETCH_CONCURRENCY)
+
+        async def prefetch_one(country_code: str):
+            if self.is_fresh(country_code): return
+            async with limiter:
+                try:
+                    await asyncio.shield(self.refresh(country_code))
+                except Exception as e:
+                    logger.warning(f"Could not prefetch the {country_code} proxy list: {e}")
+
+        await asyncio.gather(*(prefetch_one(code) for code in country_codes))
+        logger.info(f"Country proxy lists ready: {sum(1 for code in country_codes if self._load_meta(code))}/{len(country_codes)} cached.")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'cached': sum(1 for meta in self.meta.values() if meta), 'refreshing': len(self.refreshing),
+            'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses,
+            'not_modified': self.not_modified, 'downloads': self.downloads, 'errors': self.errors,
+            'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+country_lists = CountryListCache(COUNTRY_CACHE_DIR, COUNTRY_CACHE_TTL)
+
+def parse_ip_range(range_str: str) -> tuple[int, int, int] | None:
+    # Returns (ip version, first address, last address) as integers, so a
+    # range is never materialised as a list of strings.
+    try:
+        if '/' in range_str:
+            net = ipaddress.ip_network(range_str, strict=False)
+            first, last = int(net.network_address), int(net.broadcast_address)
+            if net.version == 4 and net.prefixlen < 31:
+                first, last = first + 1, last - 1
+            elif net.version == 6 and net.prefixlen < 127:
+                first += 1
+            return net.version, first, last
+        if '-' in range_str:
+            start_str, end_str = range_str.split('-', 1)
+            start = ipaddress.ip_address(start_str)
+            if end_str.isdigit():
+                if start.version != 4: return None
+                end_octet = int(end_str)
+                if not int(start) & 0xFF <= end_octet <= 255: return None
+                return 4, int(start), (int(start) & ~0xFF) | end_octet
+            end = ipaddress.ip_address(end_str)
+            if end.version != start.version or int(end) < int(start): return None
+            return start.version, int(start), int(end)
+    except ValueError as e: logger.warning(f"Invalid range format: {range_str} - {e}")
+    return None
+
+def format_ip_int(value: int, version: int) -> str:
+    if version == 4:
+        return f"{value >> 24}.{(value >> 16) & 0xFF}.{(value >> 8) & 0xFF}.{value & 0xFF}"
+    return f"[{ipaddress.IPv6Address(value)}]"
+
+class RangeTargets:
+    # Lazily expands parsed ranges in order. Overlaps between ranges are cut
+    # out up front (interval arithmetic), so every address is produced once and
+    # turned into a string only when the scheduler asks for it. Bogon blocks
+    # are cut out the same way and counted in `skipped`.
+    def __init__(self, ranges: list[tuple[int, tuple[int, int, int]]]):
+        self.segments = []
+        self.skipped = Counter()
+        covered = []
+        for range_index, (version, first, last) in ranges:
+            pieces = [(first, last)]
+            for covered_version, low, high in covered:
+                if covered_version != version: continue
+                pieces = [part for a, b in pieces for part in ((a, min(b, low - 1)), (max(a, high + 1), b)) if part[0] <= part[1]]
+            for a, b in pieces:
+                self.segments.extend((range_index, version, low, high) for low, high in self._drop_bogons(version, a, b))
+            covered.append((version, first, last))
+        self.total = sum(b - a + 1 for _, _, a, b in self.segments)
+
+    def _drop_bogons(self, version: int, first: int, last: int) -> list[tuple[int, int]]:
+        kept, cursor = [], first
+        for low, high, reason in bogon_overlaps(version, first, last):
+            self.skipped[reason] += high - low + 1
+            if low > cursor: kept.append((cursor, low - 1))
+            cursor = high + 1
+        if cursor <= last: kept.append((cursor, last))
+        return kept
+
+    def __len__(self) -> int:
+        # len() must fit a C ssize_t; an IPv6 /64 alone does not. Callers
+        # compare `total` against the limits, this only keeps len() safe.
+        return min(self.total, sys.maxsize)
+
+    def __bool__(self) -> bool:
+        return self.total > 0
+
+    def __iter__(self):
+        for range_index, version, first, last in self.segments:
+            for value in range(first, last + 1):
+                yield Target(format_ip_int(value, version), range_index, (version, value, 0, ''))
+
+class RangeBlocks:
+    # The blocks (addresses sharing a sub-prefix) of a set of range segments,
+    # as a sequence whose entries are computed on access. The block count
+    # follows from the prefix lengths alone, so a range can be measured and
+    # rejected without building anything.
+    def __init__(self, segments: list, prefix: int | None = None):
+        self.segments = []
+        offset = 0
+        for range_index, version, first, last in segments:
+            host_bits = max(0, (32 if version == 4 else 128) - (prefix or ADAPTIVE_DEFAULT_PREFIX[version]))
+            self.segments.append((offset, range_index, version, first, last, host_bits))
+            offset += (last >> host_bits) - (first >> host_bits) + 1
+        self.count = offset
+        self.offsets = [segment[0] for segment in self.segments]
+        self.by_address = sorted((segment[2], segment[3], k) for k, segment in enumerate(self.segments))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> tuple[int, int, int, int]:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        offset, range_index, version, first, last, host_bits = self.segments[bisect_right(self.offsets, i) - 1]
+        start = ((first >> host_bits) + i - offset) << host_bits
+        return range_index, version, max(first, start), min(last, start | ((1 << host_bits) - 1))
+
+    def index_of(self, version: int, value: int) -> int:
+        position = bisect_right(self.by_address, (version, value, len(self.segments))) - 1
+        offset, _, _, first, _, host_bits = self.segments[self.by_address[position][2]]
+        return offset + (value >> host_bits) - (first >> host_bits)
+
+class AdaptiveRangeTargets:
+    # Density-driven scan of large ranges. Every block (addresses sharing a
+    # sub-prefix) is first probed at a few evenly spaced hosts; once those
+    # results are in, the remaining budget goes to complete scans of blocks
+    # that had hits, densest first. Hitless blocks get no further checks.
+    REPORT_RESERVE = 400
+
+    def __init__(self, base: RangeTargets, blocks: RangeBlocks, samples_per_block: int = ADAPTIVE_SAMPLES_PER_BLOCK, budget_fraction: float = ADAPTIVE_BUDGET_FRACTION):
+        # build_range_targets checks the address and block limits first, so
+        # `blocks` is already known to be small enough to walk.
+        self.skipped = base.skipped
+        self.total_addresses = base.total
+        self.samples_per_block = max(1, samples_per_block)
+        self.blocks = blocks
+        self.hits = [0] * len(self.blocks)
+        self.sample_total = sum(len(self._sample_values(i)) for i in range(len(self.blocks)))
+        self.budget = max(0, min(int(self.total_addresses * budget_fraction), MAX_RANGE_ADDRESSES) - self.sample_total)
+        self.sampled_results = 0
+        self.sample_hits = self.follow_up_hits = 0
+        self.dispatched = 0
+        self.chosen = None
+        self.follow_up_total = 0
+        self.iterator = self._samples()
+
+    def _sample_values(self, i: int) -> list[int]:
+        _, _, first, last = self.blocks[i]
+        size = last - first + 1
+        count = min(self.samples_per_block, size)
+        step = size // count
+        return [first + j * step + step // 2 for j in range(count)]
+
+    def _target(self, i: int, value: int) -> Target:
+        range_index, version, _, _ = self.blocks[i]
+        return Target(format_ip_int(value, version), range_index, (version, value, 0, ''))
+
+    def _samples(self):
+        for i in range(len(self.blocks)):
+            for value in self._sample_values(i):
+                yield self._target(i, value)
+
+    def _follow_ups(self):
+        for i in self.chosen:
+            _, _, first, last = self.blocks[i]
+            sampled = set(self._sample_values(i))
+            for value in range(first, last + 1):
+                if value not in sampled:
+                    yield self._target(i, value)
+
+    def _plan_follow_ups(self):
+        # Greedy by hit density; a block that does not fit the remaining
+        # budget is passed over in favour of smaller ones.
+        candidates = sorted((i for i, hits in enumerate(self.hits) if hits), key=lambda i: (-self.hits[i] / len(self._sample_values(i)), -self.hits[i]))
+        self.chosen, left = [], self.budget
+        for i in candidates:
+            _, _, first, last = self.blocks[i]
+            cost = last - first + 1 - len(self._sample_values(i))
+            if cost <= left:
+                self.chosen.append(i)
+                left -= cost
+        self.follow_up_total = self.budget - left
+        self.iterator = self._follow_ups()
+
+    def record(self, target: Target, outcome: str, result: CheckResult | None):
+        version, value = target.sort_key[0], target.sort_key[1]
+        sampling = self.chosen is None
+        if sampling: self.sampled_results += 1
+        if result is None: return
+        if sampling:
+            self.hits[self.blocks.index_of(version, value)] += 1
+            self.sample_hits += 1
+        else:
+            self.follow_up_hits += 1
+
+    def ready(self) -> bool:
+        if self.chosen is not None or self.dispatched < self.sample_total: return True
+        if self.sampled_results < self.sample_total: return False
+        self._plan_follow_ups()
+        return True
+
+    def __len__(self) -> int:
+        return self.sample_total + self.follow_up_total
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Target:
+        if self.chosen is None and self.dispatched >= self.sample_total:
+            raise StopIteration
+        target = next(self.iterator)
+        self.dispatched += 1
+        return target
+
+    def coverage_report(self) -> str:
+        checked = min(self.dispatched, len(self))
+        hit_blocks = sum(1 for hits in self.hits if hits)
+        report = (
+            f"Adaptive scan: {len(self.blocks):,} block(s) probed with {self.sample_total:,} samples, {hit_blocks:,} had hits, "
+            f"{len(self.chosen or []):,} fully scanned. Checked {checked:,} of {self.total_addresses:,} addresses "
+            f"({checked / self.total_addresses:.1%}); found {self.sample_hits:,} in samples and {self.follow_up_hits:,} in follow-up scans."
+        )
+        if self.chosen is not None:
+            chosen = set(self.chosen)
+            missed = sum(
+                self.hits[i] / len(self._sample_values(i)) * (self.blocks[i][3] - self.blocks[i][2] + 1 - len(self._sample_values(i)))
+                for i in range(len(self.blocks)) if self.hits[i] and i not in chosen
+            )
+            found = self.sample_hits + self.follow_up_hits
+            if found:
+                report += f" Estimated share of live proxies found: {found / (found + missed):.0%}."
+        return report
+
+def split_sample_option(inputs: list) -> tuple[list, int | None, bool]:
+    # `--sample` enables adaptive scanning with the default block size;
+    # `--sample=/22` (or `--sample 22`) picks the block prefix length.
+    remaining, prefix, enabled = [], None, False
+    items = list(inputs)
+    i = 0
+    while i < len(items):
+        name, has_value, value = items[i].partition('=')
+        if name.lower() not in SAMPLE_FLAGS:
+            remaining.append(items[i])
+            i += 1
+            continue
+        enabled = True
+        if not has_value and i + 1 < len(items) and items[i + 1].lstrip('/').isdigit():
+            value, i = items[i + 1], i + 1
+        if value.lstrip('/').isdigit(): prefix = int(value.lstrip('/'))
+        i += 1
+    return remaining, prefix, enabled
+
+def build_range_targets(inputs: list) -> tuple[RangeTargets | AdaptiveRangeTargets, dict, str | None]:
+    inputs, prefix, adaptive = split_sample_option(inputs)
+    range_map, ranges = {}, []
+    for i, range_str in enumerate(inputs):
+        range_map[i] = range_str
+        parsed = parse_ip_range(range_str)
+        if parsed: ranges.append((i, parsed))
+    if adaptive:
+        if prefix is not None and any(not 0 < prefix <= (32 if version == 4 else 128) for _, (version, _, _) in ranges):
+            return RangeTargets([]), range_map, f"Invalid block prefix /{prefix} for --sample."
+        base = RangeTargets(ranges)
+        if base.total > ADAPTIVE_MAX_ADDRESSES:
+            return RangeTargets([]), range_map, f"The range(s) contain {base.total:,} addresses, which is more than the sampling limit of {ADAPTIVE_MAX_ADDRESSES:,}."
+        blocks = RangeBlocks(base.segments, prefix)
+        if len(blocks) > MAX_RANGE_ADDRESSES // ADAPTIVE_SAMPLES_PER_BLOCK:
+            return RangeTargets([]), range_map, f"The range(s) split into {len(blocks):,} blocks; use a shorter block prefix with --sample."
+        return AdaptiveRangeTargets(base, blocks), range_map, None
+    targets = RangeTargets(ranges)
+    if targets.total > MAX_RANGE_ADDRESSES:
+        return RangeTargets([]), range_map, f"The range(s) contain {targets.total:,} addresses, which is more than the limit of {MAX_RANGE_ADDRESSES:,}."
+    return targets, range_map, None
+
+def history_target_key(version: int, value: int, port: int) -> tuple:
+    return version, value, port or DEFAULT_PROXY_PORT
+
+class HistoryOrderedTargets:
+    # Puts addresses that worked within HISTORY_GOOD_SECONDS in front of a
+    # list or range source and drops the ones that failed within
+    # HISTORY_SKIP_DEAD_SECONDS (counted in `skipped`).
+    def __init__(self, base, good: dict[tuple, Target], dead: set[tuple]):
+        self.base = base
+        self.good = good
+        self.dead = dead
+        self.skipped = Counter(base.skipped)
+        if dead: self.skipped[SKIP_RECENTLY_DEAD] += len(dead)
+
+    def __len__(self) -> int:
+        return len(self.base) - len(self.dead)
+
+    def __iter__(self):
+        yield from self.good.values()
+        good, dead = self.good, self.dead
+        for target in self.base:
+            version, value, port = target.sort_key[:3]
+            if version != 99:
+                key = history_target_key(version, value, port)
+                if key in good or key in dead: continue
+            yield target
+
+async def prefer_known_good(targets, fresh: bool = False):
+    # Looks the targets of a list or range test up in the check history.
+    # Streaming sources and sampled scans keep their own order.
+    if type(targets) not in (CompactTargets, RangeTargets) or not targets:
+        return targets
+    store = get_history_store()
+    now = time.time()
+    if isinstance(targets, RangeTargets):
+        rows, candidates = [], None
+        for range_index, version, first, last in targets.segments:
+            rows += [(row, range_index) for row in await asyncio.to_thread(store.lookup_span, version, first, last, DEFAULT_PROXY_PORT)]
+    else:
+        candidates = {history_target_key(*target.sort_key[:3]): target for target in targets if target.sort_key[0] != 99}
+        ip_keys = list({history_ip_key(version, value) for version, value, _ in candidates})
+        rows = [(row, None) for row in await asyncio.to_thread(store.lookup_keys, ip_keys)]
+    good, dead = {}, set()
+    for (ip_key, port, success, checked_at), range_index in rows:
+        version_text, _, value_text = ip_key.partition(':')
+        if version_text == '99': continue
+        version, value = int(version_text), int(value_text, 16)
+        key = history_target_key(version, value, port)
+        if candidates is not None:
+            target = candidates.get(key)
+            if target is None: continue
+        else:
+            target = Target(format_ip_int(value, version), range_index, (version, value, 0, ''))
+        if success and now - checked_at <= HISTORY_GOOD_SECONDS:
+            good[key] = target
+        elif not success and not fresh and now - checked_at <= HISTORY_SKIP_DEAD_SECONDS:
+            dead.add(key)
+    if not good and not dead:
+        return targets
+    logger.info(f"History: {len(good)} known-good target(s) first, {len(dead)} recently dead skipped.")
+    return HistoryOrderedTargets(targets, good, dead)
+
+def format_number_with_emojis(n: int) -> str:
+    return "".join(NUMBER_EMOJIS[int(digit)] for digit in str(n))
+
+def format_result_block(res: CheckResult, overall_idx: int, domain_map: dict = None, range_map: dict = None) -> str:
+    source_map = domain_map or range_map
+    if source_map and len(source_map) > 1 and res.source_index is not None:
+        number_emoji = format_number_with_emojis(res.source_index + 1)
+    else:
+        number_emoji = format_number_with_emojis(overall_idx + 1)
+
+    as_name = res.as_name
+    if len(as_name) > 70: as_name = as_name[:67] + '...'
+
+    # The ping goes inside the details parentheses, if the worker reported one.
+    ping_str = f" - Ping : {res.ping} ms" if res.ping is not None else ""
+    details = f"({res.country} - {as_name}{ping_str})"
+
+    proxy_ip_for_url = res.proxy_ip.split(':')[0].replace('[','').replace(']','')
+    risk_link = RISK_SCORE_URL_TEMPLATE.format(ip=proxy_ip_for_url)
+
+    line1 = f"{number_emoji} {res.proxy_ip} {details}"
+    line2 = f"risk and score: {risk_link}"
+    return f"```{line1}\n{line2}```"
+
+def get_result_source_prefix(res: CheckResult, domain_map: dict = None, range_map: dict = None) -> str:
+    source_map = domain_map or range_map
+    if source_map and res.source_index in source_map:
+        return f"{format_number_with_emojis(res.source_index + 1)} "
+    return ""
+
+class ResultExport:
+    # Serializes the final results once: a plain list for copying plus real
+    # CSV and JSON files with every field, each gzipped above
+    # EXPORT_GZIP_THRESHOLD. The copy list is split into code blocks that fit
+    # one message (up to COPY_BLOCK_MAX_MESSAGES of them, beyond that only the
+    # files are sent), and every file is uploaded only once; later chats are
+    # sent the file_id Telegram returned for the first upload.
+    FIELDS = ('proxy', 'ping_ms', 'country', 'as_name', 'source')
+    COPY_HEADER = "To copy all IPs, tap the code block below"
+
+    def __init__(self, results: list, domain_map: dict = None, range_map: dict = None):
+        source_map = domain_map or range_map or {}
+        rows = [{
+            'proxy': res.proxy_ip,
+            'ping_ms': self._ping(res),
+            'country': res.country,
+            'as_name': res.as_name,
+            'source': source_map.get(res.source_index),
+        } for res in results]
+        self.count = len(rows)
+        self.copy_lines = [row['proxy'] for row in rows]
+        csv_buffer = io.StringIO()
+        writer = csv.DictWriter(csv_buffer, fieldnames=self.FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+        name = f"successful_proxies_{uuid.uuid4().hex[:6]}"
+        self.files = [self._artifact(f"{name}.{extension}", data.encode('utf-8')) for extension, data in (
+            ('txt', "\n".join(self.copy_lines)),
+            ('csv', csv_buffer.getvalue()),
+            ('json', json.dumps(rows, ensure_ascii=False)),
+        )]
+        self.file_ids = {}
+        self.uploads = 0
+
+    @staticmethod
+    def _ping(res: CheckResult):
+        ping = ping_value(res)
+        if ping == float('inf'):
             return None
-        except Exception as e:
-            logger.error(f"Worker API Error for {proxy_address}: {e}")
+        return int(ping) if ping.is_integer() else ping
+
+    @staticmethod
+    def _artifact(filename: str, data: bytes) -> tuple[str, bytes]:
+        if len(data) > EXPORT_GZIP_THRESHOLD:
+            return f"{filename}.gz", gzip.compress(data, compresslevel=6)
+        return filename, data
+
+    def copy_blocks(self) -> list[str]:
+        # MarkdownV2 code blocks; the proxies themselves need no escaping there.
+        chunks, current, size = [], [], 0
+        budget = COPY_BLOCK_LIMIT - len(self.COPY_HEADER) - 32
+        for line in self.copy_lines:
+            if current and size + len(line) + 1 > budget:
+                chunks.append(current)
+                current, size = [], 0
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            chunks.append(current)
+        if len(chunks) > COPY_BLOCK_MAX_MESSAGES:
+            return [f"{self.count:,} proxies are too many to list here; they are in the files below\\."]
+        texts = []
+        for i, chunk in enumerate(chunks):
+            part = f" \\(part {i + 1}/{len(chunks)}\\)" if len(chunks) > 1 else ""
+            body = "\n".join(chunk)
+            texts.append(f"{self.COPY_HEADER}{part}:\n```\n{body}\n```")
+        return texts
+
+    async def send(self, bot, chat_id, priority: str = PRIORITY_INTERACTIVE):
+        for text in self.copy_blocks():
+            await outbox.call(bot, 'send_message', priority=priority, chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN_V2)
+        for filename, data in self.files:
+            file_id = self.file_ids.get(filename)
+            message = await outbox.call(bot, 'send_document', priority=priority, chat_id=chat_id, document=file_id or io.BytesIO(data), filename=filename)
+            if file_id is None:
+                self.uploads += 1
+                document = getattr(message, 'document', None)
+                if document is not None:
+                    self.file_ids[filename] = document.file_id
+
+async def build_result_export(results: list, domain_map: dict = None, range_map: dict = None) -> ResultExport:
+    # Large result sets take a noticeable moment to serialize and compress.
+    return await asyncio.to_thread(ResultExport, results, domain_map, range_map)
+
+class DnsCache:
+    # Domain -> resolved addresses, shared by every user. Answers are kept for
+    # the TTL the worker reports (clamped), failed lookups for a short fixed
+    # time; concurrent lookups of one domain share a single worker request.
+    def __init__(self, max_entries: int, default_ttl: float, min_ttl: float, max_ttl: float, failure_ttl: float):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.failure_ttl = failure_ttl
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = self.misses = self.coalesced = self.failures = self.evictions = 0
+        self.resolves = 0
+        self.latency_total = self.latency_max = 0.0
+
+    def get(self, key: str) -> tuple | None:
+        entry = self.entries.get(key)
+        if entry is None: return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
             return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, ips: tuple, ttl: float | None):
+        if ips:
+            ttl = min(self.max_ttl, max(self.min_ttl, self.default_ttl if ttl is None else ttl))
+        else:
+            ttl = self.failure_ttl
+        self.entries[key] = (time.monotonic() + ttl, ips)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_latency(self, seconds: float):
+        self.resolves += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self.entries), 'in_flight': len(self.pending), 'hits': self.hits, 'misses': self.misses,
+            'coalesced': self.coalesced, 'failures': self.failures, 'evictions': self.evictions,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'avg_latency': self.latency_total / self.resolves if self.resolves else 0.0, 'max_latency': self.latency_max,
+        }
+
+dns_cache = DnsCache(DNS_CACHE_MAX_ENTRIES, DNS_CACHE_DEFAULT_TTL, DNS_CACHE_MIN_TTL, DNS_CACHE_MAX_TTL, DNS_CACHE_FAILURE_TTL)
 
-def parse_ip_range(range_str: str) -> list[str]:
-    ips = []
+async def fetch_domain_ips(domain: str) -> tuple[tuple, float | None, bool]:
+    # Returns (addresses, ttl, cacheable). Transport errors are not cached so
+    # a flaky worker does not pin a domain as unresolvable.
+    # A failed lookup comes back as a 500 with {"success": false} and says
+    # nothing about the endpoint; any other error status counts against it.
+    endpoint = worker_pool.pick()
+    started = worker_pool.begin(endpoint)
+    health = None
     try:
-        if '/' in range_str:
-             net = ipaddress.ip_network(range_str, strict=False)
-             if net.num_addresses > 65536: return []
-             ips = [str(ip) for ip in net.hosts()]
-        elif '-' in range_str:
-            parts = range_str.split('.')
-            if len(parts) == 4 and '-' in parts[3]:
-                prefix, start_end = ".".join(parts[:3]), parts[3]
-                start, end = map(int, start_end.split('-'))
-                if 0 <= start <= end <= 255: ips = [f"{prefix}.{i}" for i in range(start, end + 1)]
-    except ValueError as e: logger.warning(f"Invalid range format: {range_str} - {e}")
+        timeout = httpx.Timeout(WORKER_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+        response = await get_http_client().get(f"{endpoint.url}/api/resolve", params={'domain': domain}, timeout=timeout)
+        try: response.raise_for_status()
+        except httpx.HTTPStatusError:
+            if response.status_code != 500 or response.json().get("success") is not False: raise
+        api_result = response.json()
+        health = OUTCOME_SUCCESS
+    except httpx.TimeoutException as e:
+        logger.error(f"Timeout resolving domain {domain} ({endpoint.url}): {e}")
+        health = OUTCOME_TIMEOUT
+        return (), None, False
+    except Exception as e:
+        logger.error(f"Error resolving domain {domain} ({endpoint.url}): {e}")
+        health = OUTCOME_ERROR
+        return (), None, False
+    finally:
+        worker_pool.finish(endpoint, started, health)
+        dns_cache.record_latency(time.monotonic() - started)
+    if not api_result.get("success"):
+        return (), None, True
+    return tuple(sys.intern(ip) for ip in api_result.get("ips", [])), api_result.get("ttl"), True
+
+async def resolve_domain(domain: str) -> tuple:
+    key = domain.lower()
+    cached = dns_cache.get(key)
+    if cached is not None:
+        dns_cache.hits += 1
+        return cached
+
+    task = dns_cache.pending.get(key)
+    if task is None:
+        dns_cache.misses += 1
+        task = dns_cache.pending[key] = asyncio.create_task(fetch_domain_ips(domain))
+
+        def on_done(finished, key=key):
+            dns_cache.pending.pop(key, None)
+            if finished.cancelled() or finished.exception() is not None: return
+            ips, ttl, cacheable = finished.result()
+            if not ips: dns_cache.failures += 1
+            if cacheable: dns_cache.put(key, ips, ttl)
+        task.add_done_callback(on_done)
+    else:
+        dns_cache.coalesced += 1
+    ips, _, _ = await asyncio.shield(task)
     return ips
 
-def format_number_with_emojis(n: int) -> str:
-    return "".join(NUMBER_EMOJIS[int(digit)] for digit in str(n))
+class ResolvingTargets(GrowingTargets):
+    # Target source fed by background domain resolution. Each domain's
+    # addresses become checkable as soon as that domain resolves, so testing
+    # does not wait for the slowest lookup in the list.
+    def __init__(self, domains: list):
+        super().__init__()
+        self.domains = domains
+        self.resolved = 0
+        self.start(self._resolve_all())
 
-def get_result_source_prefix(res: dict, domain_map: dict = None, range_map: dict = None) -> str:
-    prefix = ""
-    if domain_map and 'domain_index' in res and res['domain_index'] in domain_map:
-        prefix = f"{format_number_with_emojis(res['domain_index'] + 1)} "
-    elif range_map and 'range_index' in res and res['range_index'] in range_map:
-        prefix = f"{format_number_with_emojis(res['range_index'] + 1)} "
-    return prefix
+    async def _resolve_one(self, index: int, domain: str, limiter: asyncio.Semaphore):
+        async with limiter:
+            ips = await resolve_domain(domain)
+        if ips: self.resolved += 1
+        for ip in ips:
+            self.add(ip, index)
+        self.notify()
 
-async def _validate_and_resolve_domains(inputs: list) -> (list, str, list, dict):
+    async def _resolve_all(self):
+        limiter = asyncio.Semaphore(DNS_CONCURRENCY)
+        await asyncio.gather(*(self._resolve_one(i, domain, limiter) for i, domain in enumerate(self.domains)), return_exceptions=True)
+
+def _validate_domains(inputs: list) -> tuple[list, str | None]:
+    if not inputs:
+        # Only option flags were sent (e.g. `/domain --fresh`).
+        return None, "Nothing to test. Usage: `/domain <domain> ... [--fresh] [--top N] [--max-ping MS]`"
     invalid_domains = []
     valid_domains = []
     for domain in inputs:
@@ -154,32 +2543,22 @@ async def _validate_and_resolve_domains(inputs: list) -> (list, str, list, dict)
             f"Example of a correct format:\n"
             f"`nima.nscl.ir`"
         )
-        return None, error_message, None, None
+        return None, error_message
+    return valid_domains, None
 
-    ips_to_check, domain_map = [], {}
-    async with httpx.AsyncClient() as client:
-        for i, domain_item in enumerate(valid_domains):
-            try:
-                params = {'domain': domain_item}
-                response = await client.get(f"{WORKER_URL}/api/resolve", params=params, timeout=45.0)
-                response.raise_for_status()
-                api_result = response.json()
-                if api_result.get("success"):
-                    domain_map[i] = domain_item
-                    for ip in api_result.get("ips", []):
-                        ips_to_check.append({"ip": ip, "domain_index": i})
-            except Exception as e:
-                logger.error(f"Error resolving domain {domain_item}: {e}")
-    
-    unique_ips_to_check = list({item['ip']: item for item in ips_to_check}.values())
-    return valid_domains, None, unique_ips_to_check, domain_map
+async def _validate_and_resolve_domains(inputs: list) -> (list, str, ResolvingTargets, dict):
+    valid_domains, error_message = _validate_domains(inputs)
+    if error_message:
+        return None, error_message, None, None
+    domain_map = dict(enumerate(valid_domains))
+    return valid_domains, None, ResolvingTargets(valid_domains), domain_map
 
-async def test_ips_and_update_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, ips_to_check: list, title: str, domain_map: dict = None, range_map: dict = None):
+async def test_ips_and_update_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, ips_to_check: CompactTargets | RangeTargets, title: str, domain_map: dict = None, range_map: dict = None, user_id: int = None, fresh: bool = False, goal: TopResults = None):
     test_id = str(uuid.uuid4())
     context.user_data[test_id] = {
-        'status': 'running', 'ips': ips_to_check, 'checked_ips': set(),
+        'status': 'running', 'queue': TargetQueue(ips_to_check),
         'successful': [], 'domain_map': domain_map, 'range_map': range_map,
-        'result_message_ids': [message_id]
+        'result_message_ids': [message_id], 'user_id': user_id or chat_id, 'fresh': fresh, 'goal': goal
     }
     
     keyboard = [[
@@ -189,12 +2568,15 @@ async def test_ips_and_update_message(context: ContextTypes.DEFAULT_TYPE, chat_i
     reply_markup = InlineKeyboardMarkup(keyboard)
     context.user_data[test_id]['markup'] = reply_markup
 
-    initial_text = f"Starting test for {len(ips_to_check)} IPs..."
+    queue = context.user_data[test_id]['queue']
+    initial_text = f"Starting test for {len(queue)} IPs..."
+    if queue.skipped:
+        initial_text += f"\n{describe_skipped(queue.skipped)}"
     try:
-        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=initial_text, reply_markup=reply_markup)
+        await outbox.call(context.bot, 'edit_message_text', chat_id=chat_id, message_id=message_id, text=initial_text, reply_markup=reply_markup)
     except BadRequest:
         try:
-            new_message = await context.bot.send_message(chat_id=chat_id, text=initial_text, reply_markup=reply_markup)
+            new_message = await outbox.call(context.bot, 'send_message', chat_id=chat_id, text=initial_text, reply_markup=reply_markup)
             context.user_data[test_id]['result_message_ids'] = [new_message.message_id]
         except Exception as e:
             logger.error(f"Failed to send new message: {e}")
@@ -202,6 +2584,259 @@ async def test_ips_and_update_message(context: ContextTypes.DEFAULT_TYPE, chat_i
     
     context.application.create_task(process_ips_in_batches(context, chat_id, test_id, title))
 
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        # No token becomes available for `seconds`, e.g. after a RetryAfter.
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class OutboundCall:
+    __slots__ = ('bot', 'method', 'chat_id', 'kwargs', 'priority', 'merge_key', 'future', 'attempts')
+
+    def __init__(self, bot, method: str, chat_id, kwargs: dict, priority: str, merge_key):
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.merge_key = merge_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+class TelegramOutbox:
+    # Central queue for the Bot API calls of tests: live result messages,
+    # their pause/resume/cancel edits, /post and scheduled posts. It paces
+    # calls with a global and a per-chat token bucket, keeps calls to one
+    # chat in order, honours RetryAfter, and collapses queued edits of one
+    # message into the latest. A command's direct replies to its user (one
+    # or a few per command) still call the API themselves.
+    def __init__(self):
+        self.queues = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BACKGROUND: deque()}
+        self.pending_edits = {}
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self.chat_buckets = {}
+        self.blocked_until = {}
+        self.busy_chats = set()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.sent = self.merged = self.dropped = self.failed = self.retries = 0
+        self.retry_after_seconds = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = TELEGRAM_PRIVATE_CHAT_RATE if is_private else TELEGRAM_GROUP_CHAT_RATE
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    def _chat_delay(self, chat_id, now: float) -> float:
+        blocked = self.blocked_until.get(chat_id, 0.0) - now
+        return max(blocked, self._chat_bucket(chat_id).delay(now))
+
+    async def call(self, bot, method: str, priority: str = PRIORITY_INTERACTIVE, **kwargs):
+        chat_id = kwargs.get('chat_id')
+        merge_key = (chat_id, kwargs.get('message_id')) if method == 'edit_message_text' else None
+        queued = self.pending_edits.get(merge_key) if merge_key else None
+        if queued is not None:
+            queued.kwargs = kwargs
+            self.merged += 1
+            return await asyncio.shield(queued.future)
+        call = OutboundCall(bot, method, chat_id, kwargs, priority, merge_key)
+        if merge_key:
+            self.pending_edits[merge_key] = call
+        self.queues[priority].append(call)
+        self._ensure_dispatcher()
+        self.wakeup.set()
+        return await asyncio.shield(call.future)
+
+    def _next_ready(self, now: float):
+        wait = None
+        for queue in self.queues.values():
+            held = set()
+            for call in queue:
+                if call.chat_id in held or call.chat_id in self.busy_chats:
+                    held.add(call.chat_id)
+                    continue
+                delay = self._chat_delay(call.chat_id, now)
+                if delay > 0:
+                    held.add(call.chat_id)
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                queue.remove(call)
+                return call, 0.0
+        return None, wait
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            call, wait = None, None
+            if len(self.busy_chats) < OUTBOX_CONCURRENCY:
+                wait = self.global_bucket.delay(now)
+                if wait <= 0:
+                    call, wait = self._next_ready(now)
+            if call is not None:
+                self.global_bucket.take(now)
+                self._chat_bucket(call.chat_id).take(now)
+                self.busy_chats.add(call.chat_id)
+                if call.merge_key and self.pending_edits.get(call.merge_key) is call:
+                    del self.pending_edits[call.merge_key]
+                asyncio.create_task(self._execute(call))
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=wait if wait else 1.0)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    async def _execute(self, call: OutboundCall):
+        call.attempts += 1
+        try:
+            document = call.kwargs.get('document')
+            if hasattr(document, 'seek'):
+                document.seek(0)
+            result = await getattr(call.bot, call.method)(**call.kwargs)
+            self.sent += 1
+            call.future.set_result(result)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            self.retry_after_seconds += retry_after
+            self.blocked_until[call.chat_id] = time.monotonic() + retry_after
+            logger.warning(f"Telegram flood control for chat {call.chat_id}: retry in {retry_after}s")
+            newer = self.pending_edits.get(call.merge_key) if call.merge_key else None
+            if newer is not None and newer is not call:
+                # A newer edit of the same message was queued meanwhile; the
+                # stale text is dropped and its callers get the newer result.
+                self.merged += 1
+                newer.future.add_done_callback(lambda done, stale=call.future: self._follow(done, stale))
+            elif call.attempts >= OUTBOX_MAX_RETRIES:
+                self.dropped += 1
+                call.future.set_exception(e)
+            else:
+                self.retries += 1
+                if call.merge_key and call.merge_key not in self.pending_edits:
+                    self.pending_edits[call.merge_key] = call
+                self.queues[call.priority].appendleft(call)
+        except Exception as e:
+            self.failed += 1
+            call.future.set_exception(e)
+        finally:
+            self.busy_chats.discard(call.chat_id)
+            self.wakeup.set()
+
+    @staticmethod
+    def _follow(source: asyncio.Future, target: asyncio.Future):
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    def _ensure_dispatcher(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    def stats(self) -> dict:
+        return {
+            'queued': sum(len(queue) for queue in self.queues.values()), 'in_flight': len(self.busy_chats),
+            'sent': self.sent, 'merged': self.merged, 'dropped': self.dropped, 'failed': self.failed,
+            'retries': self.retries, 'retry_after_seconds': self.retry_after_seconds,
+        }
+
+outbox = TelegramOutbox()
+
+def count_markdown_entities(text: str) -> int:
+    # Upper bound on the entities Telegram's Markdown parser makes of text:
+    # code blocks, inline code and bold/italic runs.
+    blocks = text.count('```')
+    return blocks // 2 + (text.count('`') - 3 * blocks) // 2 + text.count('*') // 2 + text.count('_') // 2
+
+class ResultPage:
+    def __init__(self):
+        self.blocks = []
+        self.length = 0
+        self.entities = 0
+        self.body = None
+        self.dirty = True
+        self.sent_text = None
+        self.last_edit = 0.0
+
+    @property
+    def frozen(self) -> bool:
+        return self.body is not None
+
+class ResultPages:
+    # Splits result blocks into Telegram-sized pages, shared by the live
+    # messages, /post and /history so they all page the same way. A page is
+    # closed when the next block would exceed its character budget or
+    # MESSAGE_ENTITY_LIMIT; a closed page keeps its joined body and is not
+    # edited again.
+    FOOTER_RESERVE = 200
+    ENTITY_RESERVE = 4
+
+    def __init__(self, title: str, limit: int = 4000, footer_reserve: int = 0, entity_limit: int = MESSAGE_ENTITY_LIMIT, header_reserve: int = PAGE_HEADER_RESERVE):
+        self.title = title
+        self.limit = limit
+        self.footer_reserve = footer_reserve
+        self.header_reserve = header_reserve
+        self.entity_budget = entity_limit - self.ENTITY_RESERVE - count_markdown_entities(f"**{title}**")
+        self.capacities = (limit - self._prefix_length(0), limit - self._prefix_length(1))
+        self.pages = []
+
+    def _page_title(self, index: int) -> str:
+        return self.title if index == 0 else f"Continuation {self.title.strip('**')}"
+
+    def _prefix_length(self, index: int) -> int:
+        return len(self._page_title(index)) + 4 + self.header_reserve + 5 + (self.FOOTER_RESERVE + self.footer_reserve if index == 0 else 0)
+
+    def append(self, block: str, entities: int = None):
+        if entities is None:
+            entities = count_markdown_entities(block)
+        if not self.pages:
+            self.pages.append(ResultPage())
+        page = self.pages[-1]
+        capacity = self.capacities[len(self.pages) > 1]
+        if page.blocks and (page.length + len(block) + 1 > capacity or page.entities + entities > self.entity_budget):
+            page.body = "\n".join(page.blocks)
+            page.blocks = []
+            page = ResultPage()
+            self.pages.append(page)
+        page.blocks.append(block)
+        page.length += len(block) + 1
+        page.entities += entities
+        page.dirty = True
+
+    def pages_to_refresh(self) -> list[int]:
+        last = len(self.pages) - 1
+        return [i for i, page in enumerate(self.pages) if i == 0 or i == last or page.dirty]
+
+    def render(self, index: int, header: str = None) -> str:
+        page = self.pages[index]
+        body = page.body if page.frozen else "\n".join(page.blocks)
+        header = f"\n{header}" if header else ""
+        return f"**{self._page_title(index)}**{header}\n---\n{body}"
+
 async def process_ips_in_batches(context: ContextTypes.DEFAULT_TYPE, chat_id: int, test_id: str, title: str):
     try:
         test_data = context.user_data.get(test_id)
@@ -209,234 +2844,369 @@ async def process_ips_in_batches(context: ContextTypes.DEFAULT_TYPE, chat_id: in
 
         domain_map = test_data.get('domain_map')
         range_map = test_data.get('range_map')
-        batch_size = 30
-        last_sent_texts = {}
-        
-        async def check_and_append(ip_obj):
-            ip_to_track = ip_obj['ip'] if isinstance(ip_obj, dict) else ip_obj
-            test_data['checked_ips'].add(ip_to_track)
-            result = await validate_proxy_with_worker(ip_obj)
-            if result:
-                test_data['successful'].append(result)
-
-        while len(test_data['checked_ips']) < len(test_data['ips']):
-            current_state = context.user_data.get(test_id, {}).get('status', 'stopped')
-            if current_state == 'stopped': break
-            if current_state == 'paused':
-                await asyncio.sleep(1)
-                continue
-
-            unchecked_ip_objects = [ip_obj for ip_obj in test_data['ips'] if (ip_obj['ip'] if isinstance(ip_obj, dict) else ip_obj) not in test_data['checked_ips']]
-            batch = unchecked_ip_objects[:batch_size]
-            if not batch:
-                logger.warning(f"Test {test_id} stalled. Breaking loop.")
-                break
-                
-            await asyncio.gather(*(check_and_append(ip_obj) for ip_obj in batch))
-            
-            messages_to_send = []
-            current_parts = []
-            
-            for overall_idx, res in enumerate(test_data['successful']):
-                if not current_parts:
-                    page_index = len(messages_to_send)
-                    is_first_page = (page_index == 0)
-                    current_title = title if is_first_page else f"**Continuation {title.strip('**')}**"
-                    header = f"Checked: {len(test_data['checked_ips'])}/{len(test_data['ips'])} | Successful: {len(test_data['successful'])}"
-                    current_parts.extend([f"**{current_title}**", header, "---"])
-
-                number_emoji = ""
-                if domain_map and len(domain_map) > 1 and 'domain_index' in res:
-                    number_emoji = format_number_with_emojis(res['domain_index'] + 1)
-                elif range_map and len(range_map) > 1 and 'range_index' in res:
-                    number_emoji = format_number_with_emojis(res['range_index'] + 1)
-                else:
-                    number_emoji = format_number_with_emojis(overall_idx + 1)
-
-                geo_info = res.get('info', {})
-                as_name = geo_info.get('as', 'N/A')
-                if len(as_name) > 70: as_name = as_name[:67] + '...'
+        queue = test_data['queue']
+        goal = test_data.get('goal')
+        ranked = goal is not None and goal.limit is not None
+        pages = ResultPages(title, footer_reserve=getattr(queue.targets, 'REPORT_RESERVE', 0))
 
-                # --- Start of modifications ---
+        def current_status():
+            return context.user_data.get(test_id, {}).get('status', 'stopped')
 
-                ping_value = res.get('ping')
-                # Create the ping string with a leading separator, if ping exists.
-                ping_str = f" - Ping : {ping_value} ms" if ping_value is not None else ""
+        def header_line():
+            skipped = sum(queue.skipped.values())
+            line = f"Checked: {queue.checked}/{len(queue)} | Successful: {len(test_data['successful'])}" + (f" | Skipped: {skipped}" if skipped else "")
+            timeouts, errors = queue.outcomes[OUTCOME_TIMEOUT], sum(queue.outcomes[outcome] for outcome in WORKER_ERROR_OUTCOMES)
+            if timeouts: line += f" | Timeouts: {timeouts}"
+            if errors: line += f" | Worker errors: {errors}"
+            if worker_circuit.current_state() != CircuitBreaker.CLOSED: line += " | Worker unavailable, paused"
+            return f"{line} | {goal.describe()}" if goal else line
 
-                # Key change: Inject the ping string directly into the details parentheses.
-                details = f"({geo_info.get('country', 'N/A')} - {as_name}{ping_str})"
-                
-                proxy_ip_for_url = res.get('proxyIP').split(':')[0].replace('[','').replace(']','')
-                risk_link = RISK_SCORE_URL_TEMPLATE.format(ip=proxy_ip_for_url)
+        def rebuild_ranked_pages():
+            # The kept top-K is small (TOP_RESULTS_MAX), so it is re-laid out
+            # from the heap; publish state carries over page by page.
+            old_pages = pages.pages
+            pages.pages = []
+            for i, res in enumerate(goal.results()):
+                pages.append(format_result_block(res, i, domain_map, range_map), 1)
+            for old_page, page in zip(old_pages, pages.pages):
+                page.sent_text, page.last_edit = old_page.sent_text, old_page.last_edit
 
-                # Assemble the final output lines.
-                line1 = f"{number_emoji} {res.get('proxyIP')} {details}"
-                line2 = f"risk and score: {risk_link}"
-
-                full_content_for_block = f"{line1}\n{line2}"
-                new_line = f"```{full_content_for_block}```"
+        async def append_result(ip_obj, outcome, result):
+            queue.checked += 1
+            queue.outcomes[outcome] += 1
+            if result:
+                test_data['successful'].append(result)
+                if goal is None:
+                    pages.append(format_result_block(result, len(test_data['successful']) - 1, domain_map, range_map), 1)
+                elif goal.offer(result):
+                    if ranked: rebuild_ranked_pages()
+                    else: pages.append(format_result_block(result, goal.qualified - 1, domain_map, range_map), 1)
 
-                # --- End of modifications ---
-                
-                if len("\n".join(current_parts)) + len(new_line) + 2 > 4000: # +2 for newlines
-                    messages_to_send.append("\n".join(current_parts))
-                    header = f"Checked: {len(test_data['checked_ips'])}/{len(test_data['ips'])} | Successful: {len(test_data['successful'])}"
-                    current_parts = [f"**Continuation {title.strip('**')}**", header, "---", new_line]
+        async def publish_page(index: int, text: str, markup):
+            page = pages.pages[index]
+            try:
+                if index >= len(test_data['result_message_ids']):
+                    new_msg = await outbox.call(context.bot, 'send_message', chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup, disable_web_page_preview=True)
+                    test_data['result_message_ids'].append(new_msg.message_id)
                 else:
-                    current_parts.append(new_line)
-
-            if current_parts:
-                messages_to_send.append("\n".join(current_parts))
+                    message_id = test_data['result_message_ids'][index]
+                    await outbox.call(context.bot, 'edit_message_text', chat_id=chat_id, message_id=message_id, text=text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup, disable_web_page_preview=True)
+                page.sent_text, page.dirty = text, False
+            except BadRequest as e:
+                if "Message is not modified" in str(e): page.sent_text, page.dirty = text, False
+                else: logger.warning(f"Update failed for message page {index}: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error during update for message page {index}: {e}")
+            page.last_edit = time.monotonic()
 
-            for i, text_content in enumerate(messages_to_send):
-                try:
-                    last_sent_texts[i] = text_content
-                    is_first_message = (i == 0)
-                    current_markup = test_data.get('markup') if is_first_message else None
-                    if i >= len(test_data['result_message_ids']):
-                        new_msg = await context.bot.send_message(chat_id=chat_id, text=text_content, parse_mode=ParseMode.MARKDOWN, reply_markup=current_markup, disable_web_page_preview=True)
-                        test_data['result_message_ids'].append(new_msg.message_id)
-                    else:
-                        message_id = test_data['result_message_ids'][i]
-                        await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text_content, parse_mode=ParseMode.MARKDOWN, reply_markup=current_markup, disable_web_page_preview=True)
-                except BadRequest as e:
-                    if "Message is not modified" not in str(e): logger.warning(f"Update failed for message page {i}: {e}")
-                except Exception as e:
-                    logger.error(f"Unexpected error during update for message page {i}: {e}")
+        async def refresh_live_messages(force: bool = False):
+            # Only the first page (counters and buttons), the open tail page and
+            # pages that were filled since the last pass are ever re-rendered.
+            header = header_line()
+            now = time.monotonic()
+            for index in pages.pages_to_refresh():
+                if index > len(test_data['result_message_ids']): break
+                page = pages.pages[index]
+                if not force and now - page.last_edit < LIVE_EDIT_INTERVAL: continue
+                text = pages.render(index, header)
+                if text == page.sent_text: continue
+                await publish_page(index, text, test_data.get('markup') if index == 0 else None)
 
-            await asyncio.sleep(1.5)
+        checks = context.application.create_task(stream_checks(
+            queue, append_result, owner=test_data['user_id'],
+            is_paused=lambda: current_status() == 'paused',
+            is_stopped=lambda: current_status() == 'stopped' or (goal is not None and goal.reached()), fresh=test_data['fresh'],
+        ))
+        while not checks.done():
+            await asyncio.wait({checks}, timeout=LIVE_UPDATE_INTERVAL)
+            if current_status() != 'paused':
+                await refresh_live_messages()
+        checks.result()
+        await refresh_live_messages(force=True)
 
         status = "Cancelled" if context.user_data.get(test_id, {}).get('status') == 'stopped' else "Completed"
+        skipped_note = describe_skipped(queue.skipped)
+        skipped_note = f"\n{describe_outcomes(queue.outcomes)}" + (f"\n{skipped_note}" if skipped_note else "")
+        if goal is not None and goal.reached() and status == "Completed":
+            skipped_note = f"\nStopped early after the first {goal.qualified} qualifying result(s); {len(queue) - queue.checked:,} IP(s) left unchecked may include faster ones.{skipped_note}"
+        coverage_note = queue.coverage_report()
+        if coverage_note: skipped_note += f"\n{coverage_note}"
         
-        for i, message_id in enumerate(test_data['result_message_ids']):
+        if not pages.pages:
             try:
-                final_text = last_sent_texts.get(i)
-                if not final_text:
-                    continue
-
-                if f"Test {status}" not in final_text:
-                    final_text += f"\n\n**Test {status}.**"
-                if i == 0 and not test_data['successful']:
-                     final_text = f"**{title}**\nNo successful proxies found.\n\n**Test {status}.**"
+                final_text = f"**{title}**\nNo {'qualifying' if goal else 'successful'} proxies found.\n\n**Test {status}.**{skipped_note}"
+                await outbox.call(context.bot, 'edit_message_text', chat_id=chat_id, message_id=test_data['result_message_ids'][0], text=final_text, parse_mode=ParseMode.MARKDOWN, reply_markup=None, disable_web_page_preview=True)
+            except Exception as e:
+                logger.error(f"Error during finalization of test {test_id}: {e}")
 
-                await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=final_text, parse_mode=ParseMode.MARKDOWN, reply_markup=None, disable_web_page_preview=True)
+        header = header_line()
+        for i, message_id in enumerate(test_data['result_message_ids'][:len(pages.pages)]):
+            try:
+                final_text = f"{pages.render(i, header)}\n\n**Test {status}.**" + (skipped_note if i == 0 else "")
+                await outbox.call(context.bot, 'edit_message_text', chat_id=chat_id, message_id=message_id, text=final_text, parse_mode=ParseMode.MARKDOWN, reply_markup=None, disable_web_page_preview=True)
             except Exception as e:
                 logger.error(f"Error during finalization of message {message_id}: {e}")
 
-        if test_data['successful']:
-            final_sorted_ips = sorted([res['proxyIP'] for res in test_data['successful']], key=lambda ip: ipaddress.ip_address(ip.split(':')[0].replace('[','').replace(']','')))
-            copy_text = "\n".join(final_sorted_ips)
-            await context.bot.send_message(chat_id=chat_id, text=f"To copy all IPs, tap the code block below:\n```\n{copy_text}\n```", parse_mode=ParseMode.MARKDOWN_V2)
-
-            file_name = f"successful_proxies_{uuid.uuid4().hex[:6]}"
-            txt_file = io.BytesIO(copy_text.encode('utf-8'))
-            await context.bot.send_document(chat_id=chat_id, document=txt_file, filename=f"{file_name}.txt")
-            csv_file = io.BytesIO(copy_text.encode('utf-8'))
-            await context.bot.send_document(chat_id=chat_id, document=csv_file, filename=f"{file_name}.csv")
+        final_results = goal.results() if goal is not None else sorted(test_data['successful'], key=attrgetter('sort_key'))
+        if final_results:
+            export = await build_result_export(final_results, domain_map, range_map)
+            await export.send(context.bot, chat_id)
             
     finally:
         if test_id in context.user_data: del context.user_data[test_id]
 
-async def run_test_and_post(context: ContextTypes.DEFAULT_TYPE, target_chat_id, ips_to_check: list, title: str, confirmation_message, domain_map: dict = None, range_map: dict = None):
+async def run_test_and_post(context: ContextTypes.DEFAULT_TYPE, target_chat_ids, ips_to_check: CompactTargets | RangeTargets, title: str, confirmation_message, domain_map: dict = None, range_map: dict = None, fresh: bool = False, goal: TopResults = None, owner=None):
+    # Runs one scan and posts its results to every chat in target_chat_ids.
+    # Scheduled posts pass no confirmation message and name their own owner.
+    if not isinstance(target_chat_ids, list):
+        target_chat_ids = [target_chat_ids]
     try:
         successful_results_with_info = []
-        batch_size = 30
-        for i in range(0, len(ips_to_check), batch_size):
-            batch = ips_to_check[i:i + batch_size]
-            
-            results = await asyncio.gather(*(validate_proxy_with_worker(ip_obj) for ip_obj in batch))
-            
-            successful_results_with_info.extend([res for res in results if res])
-            await asyncio.sleep(1)
+        outcomes = Counter()
 
-        if not successful_results_with_info:
-            await context.bot.send_message(chat_id=target_chat_id, text=f"**{title}**\nNo successful proxies found.", parse_mode=ParseMode.MARKDOWN)
-            return
+        async def append_result(ip_obj, outcome, result):
+            outcomes[outcome] += 1
+            if result and (goal is None or goal.offer(result)):
+                successful_results_with_info.append(result)
 
-        TELEGRAM_MESSAGE_LIMIT = 4000
-        message_parts = []
-        message_count = 0
-        
-        for res_index, res in enumerate(successful_results_with_info):
-            if not message_parts:
-                message_count += 1
-                is_first_message = (message_count == 1)
-                current_title = title if is_first_message else f"**Continuation {title.strip('**')}**"
-                message_parts.extend([f"**{current_title}**", "---"])
-
-            number_emoji = ""
-            if domain_map and len(domain_map) > 1 and 'domain_index' in res:
-                number_emoji = format_number_with_emojis(res['domain_index'] + 1)
-            elif range_map and len(range_map) > 1 and 'range_index' in res:
-                number_emoji = format_number_with_emojis(res['range_index'] + 1)
-            else:
-                number_emoji = format_number_with_emojis(res_index + 1)
+        await stream_checks(ips_to_check, append_result, owner=owner if owner is not None else confirmation_message.chat_id, priority=PRIORITY_BACKGROUND, fresh=fresh,
+                            is_stopped=(lambda: goal.reached()) if goal is not None else None)
+        if goal is not None:
+            successful_results_with_info = goal.results()
+        coverage_report = getattr(ips_to_check, 'coverage_report', None)
+        coverage_note = f"\n{describe_outcomes(outcomes)}" + (f"\n{coverage_report()}" if coverage_report else "")
+        final_results = successful_results_with_info if goal is not None else sorted(successful_results_with_info, key=attrgetter('sort_key'))
+        export = await build_result_export(final_results, domain_map, range_map) if final_results else None
 
-            geo_info = res.get('info', {})
-            as_name = geo_info.get('as', 'N/A')
-            if len(as_name) > 70:
-                as_name = as_name[:67] + '...'
+        for target_chat_id in target_chat_ids:
+            try:
+                await post_results(context, target_chat_id, successful_results_with_info, title, coverage_note, domain_map, range_map, export)
+            except Exception as e:
+                if len(target_chat_ids) == 1:
+                    raise
+                logger.error(f"Error posting results to {target_chat_id}: {e}")
 
-            # --- Start of modifications ---
+    except Exception as e:
+        logger.error(f"Error in run_test_and_post: {e}")
+        if confirmation_message is not None:
+            await outbox.call(context.bot, 'send_message', chat_id=confirmation_message.chat_id, text=f"An unexpected error occurred while posting: {e}")
+    finally:
+        if confirmation_message is not None:
+            try:
+                await outbox.call(context.bot, 'delete_message', chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
+            except Exception:
+                pass
 
-            ping_value = res.get('ping')
-            # Create the ping string with a leading separator, if ping exists.
-            ping_str = f" - Ping : {ping_value} ms" if ping_value is not None else ""
-            
-            # Key change: Inject the ping string directly into the details parentheses.
-            details = f"({geo_info.get('country', 'N/A')} - {as_name}{ping_str})"
-            
-            proxy_ip_for_url = res.get('proxyIP').split(':')[0].replace('[','').replace(']','')
-            risk_link = RISK_SCORE_URL_TEMPLATE.format(ip=proxy_ip_for_url)
+async def post_results(context: ContextTypes.DEFAULT_TYPE, target_chat_id, successful_results_with_info: list, title: str, coverage_note: str, domain_map: dict = None, range_map: dict = None, export: ResultExport = None):
+    if not successful_results_with_info:
+        await outbox.call(context.bot, 'send_message', priority=PRIORITY_BACKGROUND, chat_id=target_chat_id, text=f"**{title}**\nNo successful proxies found.{coverage_note}", parse_mode=ParseMode.MARKDOWN)
+        return
 
-            # Assemble the final output lines.
-            line1 = f"{number_emoji} {res.get('proxyIP')} {details}"
-            line2 = f"risk and score: {risk_link}"
-            
-            full_content_for_block = f"{line1}\n{line2}"
-            new_line = f"```{full_content_for_block}```"
-
-            # --- End of modifications ---
-
-            if len("\n".join(message_parts)) + len(new_line) + 2 > TELEGRAM_MESSAGE_LIMIT:
-                await context.bot.send_message(chat_id=target_chat_id, text="\n".join(message_parts), parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-                await asyncio.sleep(0.5)
-                
-                message_count += 1
-                new_title = f"**Continuation {title.strip('**')}**"
-                message_parts = [new_title, "---", new_line]
-            else:
-                message_parts.append(new_line)
+    TELEGRAM_MESSAGE_LIMIT = 4000
+    pages = ResultPages(title, TELEGRAM_MESSAGE_LIMIT, header_reserve=POST_FOOTER_RESERVE)
+    for res_index, res in enumerate(successful_results_with_info):
+        pages.append(format_result_block(res, res_index, domain_map, range_map), 1)
 
-        if message_parts:
-            message_parts.append("\n**Test Completed.**")
-            final_message_text = "\n".join(message_parts)
-            await context.bot.send_message(chat_id=target_chat_id, text=final_message_text, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-            await asyncio.sleep(0.5)
+    last = len(pages.pages) - 1
+    for index in range(len(pages.pages)):
+        text = pages.render(index)
+        if index == last:
+            text += "\n\n**Test Completed.**"
+            if len(text) + len(coverage_note) <= TELEGRAM_MESSAGE_LIMIT:
+                text += coverage_note
+                coverage_note = ""
+        await outbox.call(context.bot, 'send_message', priority=PRIORITY_BACKGROUND, chat_id=target_chat_id, text=text, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+    if coverage_note:
+        await outbox.call(context.bot, 'send_message', priority=PRIORITY_BACKGROUND, chat_id=target_chat_id, text=coverage_note.strip(), disable_web_page_preview=True)
 
-        final_sorted_ips = sorted([res['proxyIP'] for res in successful_results_with_info], key=lambda ip: ipaddress.ip_address(ip.split(':')[0].replace('[','').replace(']','')))
-        copy_text = "\n".join(final_sorted_ips)
-        
-        await context.bot.send_message(chat_id=target_chat_id, text=f"To copy all IPs, tap the code block below:\n```\n{copy_text}\n```", parse_mode=ParseMode.MARKDOWN_V2)
+    if export is not None:
+        await export.send(context.bot, target_chat_id, PRIORITY_BACKGROUND)
         
-        file_name = f"successful_proxies_{uuid.uuid4().hex[:6]}"
-        txt_file = io.BytesIO(copy_text.encode('utf-8'))
-        await context.bot.send_document(chat_id=target_chat_id, document=txt_file, filename=f"{file_name}.txt")
-        csv_file = io.BytesIO(copy_text.encode('utf-8'))
-        await context.bot.send_document(chat_id=target_chat_id, document=csv_file, filename=f"{file_name}.csv")
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    # Handles updates concurrently, but one at a time per user (per chat for
+    # updates without a user), so ConversationHandler steps and button
+    # presses of one user keep their order while a slow handler for one user
+    # no longer delays everyone else. Updates waiting for their user's turn
+    # do not hold one of the UPDATE_CONCURRENCY slots.
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(UPDATE_BACKLOG_LIMIT)
+        self.concurrency = max_concurrent_updates
+        self.limiter = asyncio.Semaphore(max_concurrent_updates)
+        self.locks = {}
+        self.waiting = Counter()
+        self.pending = self.active = self.processed = self.queued_behind = 0
 
-    except Exception as e:
-        logger.error(f"Error in run_test_and_post: {e}")
-        await context.bot.send_message(chat_id=confirmation_message.chat_id, text=f"An unexpected error occurred while posting: {e}")
-    finally:
+    @staticmethod
+    def ordering_key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return 'user', update.effective_user.id
+        if update.effective_chat is not None:
+            return 'chat', update.effective_chat.id
+        return None
+
+    async def _run(self, coroutine):
+        async with self.limiter:
+            self.pending -= 1
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.ordering_key(update)
+        self.pending += 1
+        if key is None:
+            await self._run(coroutine)
+            return
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        elif lock.locked():
+            self.queued_behind += 1
+        self.waiting[key] += 1
         try:
-            await context.bot.delete_message(chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
-        except Exception:
-            pass
-            
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+                del self.locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {'active': self.active, 'limit': self.concurrency, 'users': len(self.locks),
+                'pending': self.pending, 'processed': self.processed, 'queued_behind': self.queued_behind}
+
+update_processor = OrderedUpdateProcessor(UPDATE_CONCURRENCY)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("ðŸ‘‹ Welcome! Use the menu commands to start.")
 
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_user.id):
+        return
+    pool = get_http_pool_stats()
+    lines = [
+        "**HTTP Pool**",
+        f"Open: {pool['open']} | Active: {pool['active']} | Idle: {pool['idle']} | Waiting: {pool['waiting']}",
+        f"HTTP/2: {'on' if pool['http2'] else 'off'}",
+    ]
+    executor = check_executor.snapshot()
+    lines += [
+        "",
+        "**Check Executor**",
+        f"In flight: {executor['in_flight']}/{executor['limit']} | Worker trouble rate: {executor['trouble_rate']:.0%}",
+    ]
+    batching = worker_batcher.stats()
+    lines.append(f"Worker mode: {batching['mode']} | Batches: {batching['batches']} (avg {batching['avg_size']:.1f}, {batching['in_flight']} open) | Single fallbacks: {batching['fallbacks']} | Rerouted: {batching['rerouted']}")
+    latency, circuit = worker_latency.stats(), worker_circuit.stats()
+    percentiles = " / ".join("-" if latency[key] is None else f"{latency[key] * 1000:.0f}ms" for key in ('p50', 'p95', 'p99'))
+    lines.append(f"Worker latency p50/p95/p99: {percentiles} | Timeout: {latency['timeout']:.1f}s | Hedged: {latency['hedges']} (won {latency['hedge_wins']})")
+    circuit_state = f"{circuit['state']} (retry in {circuit['retry_in']:.0f}s)" if circuit['state'] == CircuitBreaker.OPEN else circuit['state']
+    lines.append(f"Circuit: {circuit_state} | Trips: {circuit['trips']} | Failed fast: {circuit['rejected']}")
+    lines += ["", "**Worker Endpoints**"]
+    for endpoint in worker_pool.stats():
+        latency_text = "-" if endpoint['latency'] is None else f"{endpoint['latency'] * 1000:.0f}ms"
+        lines.append(f"`{endpoint['url']}` - {endpoint['state']}{'' if endpoint['batching'] else ', no batching'}")
+        lines.append(f"Outstanding: {endpoint['outstanding']} | Latency: {latency_text} | Errors: {endpoint['error_rate']:.0%} recent, {endpoint['errors']}/{endpoint['calls']} total | Ejected: {endpoint['ejections']}x")
+    for owner, entry in sorted(executor['owners'].items(), key=lambda item: -item[1]['in_flight']):
+        queued = f"{entry['queued']}+" if entry['unknown'] else str(entry['queued'])
+        lines.append(f"`{owner}` - tests: {entry['tests']} | queued: {queued} | in flight: {entry['in_flight']} ({', '.join(sorted(entry['priorities']))})")
+    if not executor['owners']:
+        lines.append("No active tests.")
+    sent = outbox.stats()
+    lines += [
+        "",
+        "**Telegram Outbox**",
+        f"Queued: {sent['queued']} | In flight: {sent['in_flight']} | Sent: {sent['sent']}",
+        f"Merged edits: {sent['merged']} | Dropped: {sent['dropped']} | Failed: {sent['failed']}",
+        f"Retries: {sent['retries']} | Retry-after total: {sent['retry_after_seconds']:.0f}s",
+    ]
+    dns = dns_cache.stats()
+    lines += [
+        "",
+        "**DNS Cache**",
+        f"Entries: {dns['entries']} | In flight: {dns['in_flight']} | Hit rate: {dns['hit_rate']:.0%}",
+        f"Hits: {dns['hits']} | Misses: {dns['misses']} | Coalesced: {dns['coalesced']} | Failed: {dns['failures']}",
+        f"Resolve latency avg: {dns['avg_latency'] * 1000:.0f}ms | max: {dns['max_latency'] * 1000:.0f}ms",
+    ]
+    lists = country_lists.stats()
+    lines += [
+        "",
+        "**Country Lists**",
+        f"Cached: {lists['cached']}/{len(COUNTRIES)} | Refreshing: {lists['refreshing']} | Hit rate: {lists['hit_rate']:.0%}",
+        f"Fresh: {lists['hits']} | Stale: {lists['stale_hits']} | Misses: {lists['misses']}",
+        f"Downloads: {lists['downloads']} | Not modified: {lists['not_modified']} | Errors: {lists['errors']}",
+    ]
+    cache = result_cache.stats()
+    lines += [
+        "",
+        "**Result Cache**",
+        f"Entries: {cache['entries']} | In flight: {cache['in_flight']} | Hit rate: {cache['hit_rate']:.0%}",
+        f"Hits: {cache['hits']} | Misses: {cache['misses']} | Coalesced: {cache['coalesced']}",
+        f"Evictions: {cache['evictions']} | Expired: {cache['expirations']}",
+    ]
+    history = get_history_store().stats()
+    lines += [
+        "",
+        "**Check History**",
+        f"Recorded: {history['recorded']} | Written: {history['written']} in {history['flushes']} batch(es) | Pending: {history['pending']}",
+    ]
+    schedules = post_scheduler.stats()
+    lines += [
+        "",
+        "**Scheduled Posts**",
+        f"Entries: {schedules['entries']} in {schedules['slots']} shared scan(s) | Running: {schedules['running']}/{SCHEDULE_CONCURRENCY}",
+        f"Runs: {schedules['runs']} | Skipped (still running): {schedules['skipped']}",
+    ]
+    updates = update_processor.stats()
+    lines += [
+        "",
+        "**Updates**",
+        f"Mode: {'webhook' if WEBHOOK_URL and WEBHOOK_AVAILABLE else 'polling'} | Handling: {updates['active']}/{updates['limit']} | Waiting: {updates['pending']} ({updates['users']} user(s))",
+        f"Processed: {updates['processed']} | Queued behind same user: {updates['queued_behind']}",
+    ]
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /history [minutes] [country]: working proxies from the check history,
+    # answered from disk without any worker call.
+    args = context.args or []
+    minutes = HISTORY_DEFAULT_MINUTES
+    if args and args[0].isdigit():
+        minutes = max(1, int(args[0]))
+        args = args[1:]
+    country = " ".join(args) or None
+    # The country lands in a Markdown title; only plain names are accepted.
+    if country and (len(country) > 64 or not HISTORY_COUNTRY_PATTERN.fullmatch(country)):
+        await update.message.reply_text("Usage: /history [minutes] [country], e.g. /history 30 Germany")
+        return
+    total, rows = await asyncio.to_thread(get_history_store().recent_good, time.time() - minutes * 60, country)
+    scope = f" in {country}" if country else ""
+    if not rows:
+        await update.message.reply_text(f"No working proxies{scope} were seen in the last {minutes} minute(s).")
+        return
+    pages = ResultPages(f"Working proxies{scope} from the last {minutes} minute(s) ({total:,}, fastest first)", header_reserve=0)
+    for i, (proxy, ping, country_name, as_name, _) in enumerate(rows):
+        pages.append(format_result_block(CheckResult(proxy, ping, country_name or 'N/A', as_name or 'N/A'), i), 1)
+    more = f"\n... and {total - len(rows):,} more." if total > len(rows) else ""
+    for index in range(len(pages.pages)):
+        text = pages.render(index) + (more if index == len(pages.pages) - 1 else "")
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
 async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     if update.callback_query:
@@ -489,37 +3259,47 @@ async def handle_main_conversation_input(update: Update, context: ContextTypes.D
 
 async def process_command_logic(update: Update, context: ContextTypes.DEFAULT_TYPE, command: str, inputs: list, message):
     chat_id, message_id = message.chat_id, message.message_id
-    
+    inputs, fresh = split_fresh_flag(inputs)
+    inputs, goal, goal_error = split_goal_options(inputs)
+    if goal_error:
+        await message.edit_text(goal_error)
+        return
+    if not inputs:
+        # Only option flags were sent (e.g. `/file --fresh`).
+        usage = {'proxyip': "<ip[:port]> ...", 'iprange': "<range> ...", 'file': "<file url>"}
+        await message.edit_text(f"Nothing to test. Usage: `/{command} {usage.get(command, '<input>')} [--fresh] [--top N] [--max-ping MS]`", parse_mode=ParseMode.MARKDOWN)
+        return
+
     ips_with_context = []
     if command == "proxyip":
-        ips_with_context = [{"ip": ip} for ip in inputs]
-        await test_ips_and_update_message(context, chat_id, message_id, ips_with_context, "Proxy IP Results")
+        ips_with_context = await prefer_known_good(compact_targets(inputs), fresh)
+        if not ips_with_context:
+            await message.edit_text(f"No valid public IPs to test.\n{describe_skipped(ips_with_context.skipped)}{recently_dead_hint(ips_with_context.skipped)}")
+        else:
+            await test_ips_and_update_message(context, chat_id, message_id, ips_with_context, "Proxy IP Results", user_id=update.effective_user.id, fresh=fresh, goal=goal)
     elif command == "iprange":
-        range_map = {}
-        for i, range_str in enumerate(inputs):
-            range_map[i] = range_str
-            for ip in parse_ip_range(range_str):
-                ips_with_context.append({"ip": ip, "range_index": i})
+        ips_with_context, range_map, error_message = build_range_targets(inputs)
+        if error_message:
+            await message.edit_text(error_message)
+            return
+        ips_with_context = await prefer_known_good(ips_with_context, fresh)
 
         title_header = "**Results for IP Range(s):**"
         title_parts = [f"{format_number_with_emojis(i+1)} `{name}`" for i, name in range_map.items()]
         title = f"{title_header}\n" + "\n".join(title_parts)
 
         if not ips_with_context:
-            await message.edit_text("Invalid range format or no IPs found in range(s).")
+            await message.edit_text(f"Invalid range format or no public IPs found in range(s).\n{describe_skipped(ips_with_context.skipped)}{recently_dead_hint(ips_with_context.skipped)}".strip())
         else:
-            await test_ips_and_update_message(context, chat_id, message_id, ips_with_context, title, range_map=range_map)
+            await test_ips_and_update_message(context, chat_id, message_id, ips_with_context, title, range_map=range_map, user_id=update.effective_user.id, fresh=fresh, goal=goal)
     elif command == "file":
         file_url = inputs[0]
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(file_url, timeout=15)
-                response.raise_for_status()
-                text = response.text
-            ips_found = list(set(re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', text)))
-            ips_with_context = [{"ip": ip} for ip in ips_found]
-            if not ips_with_context: await message.edit_text("No valid IPs found in the file.")
-            else: await test_ips_and_update_message(context, chat_id, message.message_id, ips_with_context, "File Test Results")
+            ips_with_context = FileTargets(file_url)
+            if not await ips_with_context.wait_for_first():
+                if ips_with_context.error: await message.edit_text(f"Error processing file: {ips_with_context.error}")
+                else: await message.edit_text("No valid IPs found in the file.")
+            else: await test_ips_and_update_message(context, chat_id, message.message_id, ips_with_context, "File Test Results", user_id=update.effective_user.id, fresh=fresh, goal=goal)
         except Exception as e: await message.edit_text(f"Error processing file: {e}") 
 
 async def domain_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -541,7 +3321,11 @@ async def handle_domain_input(update: Update, context: ContextTypes.DEFAULT_TYPE
     return await validate_and_process_domains(update, context, inputs)
 
 async def validate_and_process_domains(update: Update, context: ContextTypes.DEFAULT_TYPE, inputs: list) -> int:
-    valid_domains, error_message, ips_to_check, domain_map = await _validate_and_resolve_domains(inputs)
+    inputs, fresh = split_fresh_flag(inputs)
+    inputs, goal, error_message = split_goal_options(inputs)
+    valid_domains, ips_to_check, domain_map = [], None, {}
+    if not error_message:
+        valid_domains, error_message, ips_to_check, domain_map = await _validate_and_resolve_domains(inputs)
 
     if error_message:
         await update.message.reply_text(
@@ -558,10 +3342,10 @@ async def validate_and_process_domains(update: Update, context: ContextTypes.DEF
     else:
         title = f"**Results for:** `{valid_domains[0]}`"
 
-    if not ips_to_check:
+    if not await ips_to_check.wait_for_first():
         await sent_message.edit_text("Could not resolve any IPs from the provided domains.")
     else:
-        await test_ips_and_update_message(context, sent_message.chat_id, sent_message.message_id, ips_to_check, title, domain_map=domain_map)
+        await test_ips_and_update_message(context, sent_message.chat_id, sent_message.message_id, ips_to_check, title, domain_map=domain_map, user_id=update.effective_user.id, fresh=fresh, goal=goal)
     
     return ConversationHandler.END
 
@@ -569,6 +3353,10 @@ async def freeproxyip_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if '@' in update.message.text.split()[0] and update.message.chat.type != ChatType.PRIVATE:
         await update.message.reply_text(f"Please use `/freeproxyip` without mentioning the bot's name.", parse_mode=ParseMode.MARKDOWN)
         return
+    _, _, error_message = split_goal_options(update.message.text.split()[1:])
+    if error_message:
+        await update.message.reply_text(error_message)
+        return
         
     keyboard = []
     row = []
@@ -581,6 +3369,7 @@ async def freeproxyip_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             row = []
     if row: keyboard.append(row)
     keyboard.append([InlineKeyboardButton("ðŸ”™ Back", callback_data="freeproxy_cancel")])
+    context.user_data['freeproxy_options'] = update.message.text.split()[1:]
     await update.message.reply_text("Select from the list of countries below:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def addchat_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -662,13 +3451,7 @@ async def addchat_receive_name(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data.clear()
         return ConversationHandler.END
     
-    db = load_db()
-    user_chats = db.get(user_id_str, [])
-        
-    if not any(c['chat_id'] == chat_id for c in user_chats):
-        user_chats.append({"chat_id": chat_id, "name": name})
-        db[user_id_str] = user_chats
-        save_db(db)
+    if get_chat_store().add_user_chat(user_id_str, chat_id, name):
         await update.message.reply_text(f"âœ… Destination '{name}' was successfully registered!")
     else:
         await update.message.reply_text("This chat has already been registered.")
@@ -681,7 +3464,7 @@ async def deletechat_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await update.message.reply_text("To use this command, please send it to me in a private chat.")
         return ConversationHandler.END
 
-    user_chats = load_db().get(str(update.message.from_user.id), [])
+    user_chats = get_chat_store().get_user_chats(update.message.from_user.id)
     if not user_chats:
         await update.message.reply_text("You have no saved chats to delete.")
         return ConversationHandler.END
@@ -706,33 +3489,50 @@ async def deletechat_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     user_id_str = str(query.from_user.id)
-    db = load_db()
+    store = get_chat_store()
     
     if query.data == "del_confirm_no":
-        user_chats = db.get(user_id_str, [])
+        user_chats = store.get_user_chats(user_id_str)
         keyboard = [[InlineKeyboardButton(chat['name'], callback_data=f"del_chat_{chat['chat_id']}")] for chat in user_chats]
         keyboard.append([InlineKeyboardButton("ðŸ”™ Back", callback_data="del_cancel")])
         await query.edit_message_text("Select a destination to delete:", reply_markup=InlineKeyboardMarkup(keyboard))
         return SELECT_CHAT_TO_DELETE
 
     chat_id_to_delete = context.user_data.pop('chat_to_delete', None)
-    user_chats = db.get(user_id_str, [])
-    updated_chats = [chat for chat in user_chats if str(chat['chat_id']) != str(chat_id_to_delete)]
     
-    if len(updated_chats) < len(user_chats):
-        db[user_id_str] = updated_chats
-        save_db(db)
+    if chat_id_to_delete and store.delete_user_chat(user_id_str, chat_id_to_delete):
         await query.edit_message_text("âœ… Destination successfully deleted.")
     else:
         await query.edit_message_text("Could not find the destination to delete.")
     return ConversationHandler.END
 
+def test_type_keyboard(prefix: str) -> list:
+    return [
+        [InlineKeyboardButton("Proxy IP Test", callback_data=f"{prefix}proxyip")],
+        [InlineKeyboardButton("IP Range Test", callback_data=f"{prefix}iprange")],
+        [InlineKeyboardButton("Domain Test", callback_data=f"{prefix}domain")],
+        [InlineKeyboardButton("File URL Test", callback_data=f"{prefix}file")],
+        [InlineKeyboardButton("âœ¨ Free Proxies by Country", callback_data=f"{prefix}freeproxyip")],
+    ]
+
+def country_keyboard(prefix: str, back_data: str) -> list:
+    keyboard = []
+    row = []
+    sorted_countries = sorted([(code, name) for code, name in COUNTRIES.items() if code != 'ALL'], key=lambda item: item[1])
+    sorted_countries.insert(0, ('ALL', COUNTRIES['ALL']))
+    for code, name in sorted_countries:
+        row.append(InlineKeyboardButton(name, callback_data=f"{prefix}{code}"))
+        if len(row) == 3: keyboard.append(row); row = []
+    if row: keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("ðŸ”™ Back", callback_data=back_data)])
+    return keyboard
+
 async def post_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if update.message.chat.type != ChatType.PRIVATE:
         await update.message.reply_text("To use this command, please send it to me in a private chat.")
         return ConversationHandler.END
 
-    user_chats = load_db().get(str(update.message.from_user.id), [])
+    user_chats = get_chat_store().get_user_chats(update.message.from_user.id)
     if not user_chats:
         await update.message.reply_text("You haven't added any destinations yet. Use /addchat to add one first.")
         return ConversationHandler.END
@@ -745,14 +3545,7 @@ async def post_select_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
     await query.answer()
     context.user_data['target_chat_id'] = query.data.split('_')[-1]
-    keyboard = [
-        [InlineKeyboardButton("Proxy IP Test", callback_data="post_cmd_proxyip")],
-        [InlineKeyboardButton("IP Range Test", callback_data="post_cmd_iprange")],
-        [InlineKeyboardButton("Domain Test", callback_data="post_cmd_domain")],
-        [InlineKeyboardButton("File URL Test", callback_data="post_cmd_file")],
-        [InlineKeyboardButton("âœ¨ Free Proxies by Country", callback_data="post_cmd_freeproxyip")],
-    ]
-    await query.edit_message_text("Now, select the type of test:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.edit_message_text("Now, select the type of test:", reply_markup=InlineKeyboardMarkup(test_type_keyboard("post_cmd_")))
     return SELECT_COMMAND
 
 async def post_select_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -762,16 +3555,7 @@ async def post_select_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data['post_command'] = command
     
     if command == 'freeproxyip':
-        keyboard = []
-        row = []
-        sorted_countries = sorted([(code, name) for code, name in COUNTRIES.items() if code != 'ALL'], key=lambda item: item[1])
-        sorted_countries.insert(0, ('ALL', COUNTRIES['ALL']))
-        for code, name in sorted_countries:
-            row.append(InlineKeyboardButton(name, callback_data=f"post_country_{code}"))
-            if len(row) == 3: keyboard.append(row); row = []
-        if row: keyboard.append(row)
-        keyboard.append([InlineKeyboardButton("ðŸ”™ Back", callback_data="post_cmd_back")])
-        await query.edit_message_text("Select from the list of countries below:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Select from the list of countries below:", reply_markup=InlineKeyboardMarkup(country_keyboard("post_country_", "post_cmd_back")))
         return AWAIT_POST_COUNTRY
     elif command == 'domain':
         await query.edit_message_text(f"Great! Now please send the input for the `{command}` command.", parse_mode=ParseMode.MARKDOWN)
@@ -791,8 +3575,10 @@ async def post_handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return ConversationHandler.END
 
 async def post_handle_domain_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    inputs = update.message.text.split()
-    valid_domains, error_message, _, _ = await _validate_and_resolve_domains(inputs)
+    inputs, fresh = split_fresh_flag(update.message.text.split())
+    domains, _, error_message = split_goal_options(inputs)
+    if not error_message:
+        valid_domains, error_message = _validate_domains(domains)
     
     if error_message:
         await update.message.reply_text(f"{error_message}\n\nPlease send the corrected domain(s), or /cancel to quit.", parse_mode=ParseMode.MARKDOWN)
@@ -802,7 +3588,7 @@ async def post_handle_domain_input(update: Update, context: ContextTypes.DEFAULT
     if not target_chat_id_str: return ConversationHandler.END
 
     confirmation_message = await update.message.reply_text("âœ… Request received. The test will run in the background. Final results will be posted shortly...")
-    context.application.create_task(run_post_command_logic(context, target_chat_id_str, command, valid_domains, confirmation_message))
+    context.application.create_task(run_post_command_logic(context, target_chat_id_str, command, inputs, confirmation_message, fresh=fresh))
     context.user_data.clear()
     return ConversationHandler.END
 
@@ -810,8 +3596,7 @@ async def post_handle_country_selection(update: Update, context: ContextTypes.DE
     query = update.callback_query
     await query.answer()
     if query.data == "post_cmd_back":
-        keyboard = [[InlineKeyboardButton("Proxy IP Test", callback_data="post_cmd_proxyip")], [InlineKeyboardButton("IP Range Test", callback_data="post_cmd_iprange")], [InlineKeyboardButton("Domain Test", callback_data="post_cmd_domain")], [InlineKeyboardButton("File URL Test", callback_data="post_cmd_file")], [InlineKeyboardButton("âœ¨ Free Proxies by Country", callback_data="post_cmd_freeproxyip")]]
-        await query.edit_message_text("Now, select the type of test:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Now, select the type of test:", reply_markup=InlineKeyboardMarkup(test_type_keyboard("post_cmd_")))
         return SELECT_COMMAND
 
     target_chat_id_str, country_code = context.user_data.get('target_chat_id'), query.data.split('_')[-1]
@@ -823,22 +3608,42 @@ async def post_handle_country_selection(update: Update, context: ContextTypes.DE
     context.user_data.clear()
     return ConversationHandler.END
 
-async def run_post_command_logic(context: ContextTypes.DEFAULT_TYPE, target_chat_id_str: str, command: str, inputs: list, confirmation_message, title_prefix: str = ""):
-    ips_to_check, domain_map, range_map, title = [], {}, {}, title_prefix
+def parse_target_chat_id(target_chat_id_str):
     try:
-        target_chat_id = int(target_chat_id_str) if target_chat_id_str.startswith('-') else target_chat_id_str
+        return int(target_chat_id_str) if str(target_chat_id_str).startswith('-') else target_chat_id_str
     except ValueError:
-        target_chat_id = target_chat_id_str
+        return target_chat_id_str
+
+async def run_post_command_logic(context: ContextTypes.DEFAULT_TYPE, target_chat_id_str, command: str, inputs: list, confirmation_message, title_prefix: str = "", fresh: bool = False, owner=None):
+    # target_chat_id_str may be a list of chats (scheduled posts), which then
+    # share one scan; without a confirmation message errors are only logged.
+    ips_to_check, domain_map, range_map, title = CompactTargets(), {}, {}, title_prefix
+    inputs, fresh_flag = split_fresh_flag(inputs)
+    inputs, goal, goal_error = split_goal_options(inputs)
+    fresh = fresh or fresh_flag
+    target_chat_ids = [parse_target_chat_id(chat_id) for chat_id in (target_chat_id_str if isinstance(target_chat_id_str, list) else [target_chat_id_str])]
+    target_chat_id = target_chat_ids[0] if len(target_chat_ids) == 1 else target_chat_ids
+
+    async def report_error(text: str):
+        if confirmation_message is None:
+            logger.warning(f"Scheduled post to {target_chat_ids} failed: {text}")
+            return
+        await outbox.call(context.bot, 'send_message', chat_id=confirmation_message.chat_id, text=text)
+        try: await outbox.call(context.bot, 'delete_message', chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
+        except Exception: pass
 
+    if goal_error:
+        await report_error(goal_error)
+        return
     try:
         if command == "proxyip":
-            ips_to_check = [{"ip": ip} for ip in inputs]
+            ips_to_check = compact_targets(inputs)
             title = title or "Proxy IP Test Results:"
         elif command == "iprange":
-            for i, r in enumerate(inputs):
-                range_map[i] = r
-                for ip in parse_ip_range(r):
-                    ips_to_check.append({"ip": ip, "range_index": i})
+            ips_to_check, range_map, error_message = build_range_targets(inputs)
+            if error_message:
+                await report_error(error_message)
+                return
             
             title_header = "**Results for IP Range(s):**"
             title_parts = [f"{format_number_with_emojis(i+1)} `{name}`" for i, name in range_map.items()]
@@ -861,33 +3666,238 @@ async def run_post_command_logic(context: ContextTypes.DEFAULT_TYPE, target_chat
             
             title = f"{title_header}\n" + "\n".join(title_parts)
         elif command == "file":
-            async with httpx.AsyncClient() as client:
-                response = await client.get(inputs[0], timeout=15)
-                response.raise_for_status()
-                ips_found = list(set(re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', response.text)))
-                ips_to_check = [{"ip": ip} for ip in ips_found]
+            ips_to_check = FileTargets(inputs[0])
             title = title or "File Test Results:"
         elif command == "freeproxyip":
             country_code = inputs[0]
-            url = COUNTRY_URLS.get(country_code) or f"{COUNTRY_FILE_BASE_URL}{country_code.upper()}.txt"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=15)
-                response.raise_for_status()
-                ips_found = list(set(re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', response.text)))
-                ips_to_check = [{"ip": ip} for ip in ips_found]
+            text = await country_lists.get(country_code)
+            ips_found = re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', text)
+            ips_to_check = compact_targets(ips_found)
             title = title_prefix or f"{COUNTRIES.get(country_code)} Test Results:"
-                
+
+        ips_to_check = await prefer_known_good(ips_to_check, fresh)
+        if isinstance(ips_to_check, GrowingTargets) and not await ips_to_check.wait_for_first() and ips_to_check.error:
+            raise ips_to_check.error
+        skipped_note = describe_skipped(getattr(ips_to_check, 'skipped', Counter()))
+        if skipped_note:
+            logger.info(f"Post to {target_chat_id}: {skipped_note}")
         if not ips_to_check:
-            await context.bot.send_message(chat_id=target_chat_id, text="No valid IPs found from your input to test.")
-            await context.bot.delete_message(chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
+            if confirmation_message is None:
+                await report_error("No valid IPs found to test.")
+                return
+            await outbox.call(context.bot, 'send_message', priority=PRIORITY_BACKGROUND, chat_id=target_chat_id, text="No valid IPs found from your input to test.")
+            await outbox.call(context.bot, 'delete_message', chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
             return
             
-        await run_test_and_post(context, target_chat_id, ips_to_check, title, confirmation_message, domain_map, range_map)
+        await run_test_and_post(context, target_chat_id, ips_to_check, title, confirmation_message, domain_map, range_map, fresh, goal, owner)
     except Exception as e:
         logger.error(f"Error in post preparation: {e}")
-        await context.bot.send_message(chat_id=confirmation_message.chat_id, text=f"An error occurred during post operation: {e}")
-        try: await context.bot.delete_message(chat_id=confirmation_message.chat_id, message_id=confirmation_message.message_id)
-        except Exception: pass
+        await report_error(f"An error occurred during post operation: {e}")
+
+def schedule_source_label(command: str, inputs: str) -> str:
+    if command == 'freeproxyip':
+        return COUNTRIES.get(inputs, inputs)
+    label = f"/{command} {inputs}"
+    return label if len(label) <= 40 else label[:39] + "\u2026"
+
+def describe_interval(interval: int) -> str:
+    hours = interval // 3600
+    return "every hour" if hours == 1 else f"every {hours} hours"
+
+def schedule_jitter(interval: int) -> float:
+    return min(interval * SCHEDULE_JITTER, SCHEDULE_MAX_JITTER)
+
+def next_schedule_time(interval: int, now: float) -> float:
+    jitter = schedule_jitter(interval)
+    return now + interval + random.uniform(-jitter, jitter)
+
+class PostScheduler:
+    # Runs the stored /schedule entries from one background loop. Entries for
+    # the same test and interval share a slot, so one scan is posted to every
+    # subscribed chat. At most SCHEDULE_CONCURRENCY scans run at once, all at
+    # background priority, and a slot whose previous scan is still running is
+    # skipped rather than stacked up. Run times are jittered so slots created
+    # together, or missed during a restart, do not fire in the same second.
+    def __init__(self):
+        self.limiter = asyncio.Semaphore(SCHEDULE_CONCURRENCY)
+        self.wakeup = asyncio.Event()
+        self.running = {}
+        self.runs = 0
+        self.skipped = 0
+
+    def wake(self):
+        self.wakeup.set()
+
+    def start_due(self, application: Application, store: ChatStore):
+        now = time.time()
+        for command, inputs, interval, chat_ids in store.due_schedules(now):
+            key = (command, inputs, interval)
+            store.set_schedule_next_run(command, inputs, interval, next_schedule_time(interval, now))
+            if key in self.running:
+                self.skipped += 1
+                logger.warning(f"Scheduled post of {schedule_source_label(command, inputs)} is still running, skipping this slot.")
+                continue
+            task = application.create_task(self.post(application, key, chat_ids))
+            self.running[key] = task
+            task.add_done_callback(lambda _, key=key: self.running.pop(key, None))
+
+    async def post(self, application: Application, key: tuple, chat_ids: list):
+        command, inputs, interval = key
+        label = schedule_source_label(command, inputs)
+        async with self.limiter:
+            self.runs += 1
+            logger.info(f"Scheduled post of {label} ({describe_interval(interval)}) to {len(chat_ids)} chat(s).")
+            title_prefix = f"**{COUNTRIES.get(inputs, inputs)} Test Results**" if command == 'freeproxyip' else ""
+            await run_post_command_logic(application, chat_ids, command, inputs.split(), None, title_prefix=title_prefix,
+                                         owner=f"schedule:{command}:{inputs[:24]}:{interval // 3600}h")
+
+    async def run(self, application: Application):
+        store = get_chat_store()
+        await asyncio.sleep(SCHEDULE_STARTUP_DELAY)
+        now = time.time()
+        for command, inputs, interval, _ in store.due_schedules(now):
+            store.set_schedule_next_run(command, inputs, interval, now + random.uniform(0, schedule_jitter(interval)))
+        while True:
+            self.wakeup.clear()
+            try:
+                self.start_due(application, store)
+            except Exception as e:
+                logger.error(f"An error occurred in the post scheduler: {e}")
+            next_run = store.next_schedule_run()
+            timeout = SCHEDULE_POLL_INTERVAL if next_run is None else min(SCHEDULE_POLL_INTERVAL, max(1.0, next_run - time.time()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        entries, slots = get_chat_store().count_schedules()
+        return {'entries': entries, 'slots': slots, 'running': len(self.running), 'runs': self.runs, 'skipped': self.skipped}
+
+post_scheduler = PostScheduler()
+
+async def schedule_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.chat.type != ChatType.PRIVATE:
+        await update.message.reply_text("To use this command, please send it to me in a private chat.")
+        return ConversationHandler.END
+
+    user_chats = get_chat_store().get_user_chats(update.message.from_user.id)
+    if not user_chats:
+        await update.message.reply_text("You haven't added any destinations yet. Use /addchat to add one first.")
+        return ConversationHandler.END
+
+    keyboard = [[InlineKeyboardButton(chat['name'], callback_data=f"sched_chat_{chat['chat_id']}")] for chat in user_chats]
+    await update.message.reply_text("Please select a destination for the scheduled posts:", reply_markup=InlineKeyboardMarkup(keyboard))
+    return SELECT_SCHEDULE_CHAT
+
+async def schedule_select_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    context.user_data['schedule_chat_id'] = query.data.split('_')[-1]
+    await query.edit_message_text("Now, select the type of test to repeat:", reply_markup=InlineKeyboardMarkup(test_type_keyboard("sched_cmd_")))
+    return SELECT_SCHEDULE_COMMAND
+
+async def schedule_select_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    command = query.data.split('_')[-1]
+    context.user_data['schedule_command'] = command
+    if command == 'freeproxyip':
+        await query.edit_message_text("Select from the list of countries below:", reply_markup=InlineKeyboardMarkup(country_keyboard("sched_country_", "sched_cmd_back")))
+        return AWAIT_SCHEDULE_COUNTRY
+    await query.edit_message_text(f"Great! Now please send the input for the `{command}` command.", parse_mode=ParseMode.MARKDOWN)
+    return AWAIT_SCHEDULE_INPUT
+
+def interval_keyboard() -> list:
+    buttons = [InlineKeyboardButton(describe_interval(hours * 3600).capitalize(), callback_data=f"sched_every_{hours}") for hours in SCHEDULE_INTERVAL_HOURS]
+    return [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+
+async def schedule_handle_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    command = context.user_data.get('schedule_command')
+    if not command: return ConversationHandler.END
+    inputs = update.message.text.split()
+    test_inputs, _ = split_fresh_flag(inputs)
+    test_inputs, _, goal_error = split_goal_options(test_inputs)
+
+    error_message = None
+    if goal_error:
+        error_message = goal_error
+    elif not test_inputs:
+        error_message = "No input found."
+    elif command == 'domain':
+        _, error_message = _validate_domains(test_inputs)
+    elif command == 'iprange':
+        _, _, error_message = build_range_targets(test_inputs)
+    elif command == 'file' and not test_inputs[0].startswith(('http://', 'https://')):
+        error_message = "Please send a valid file URL starting with http:// or https://."
+    if error_message:
+        await update.message.reply_text(f"{error_message}\n\nPlease send the corrected input, or /cancel to quit.", parse_mode=ParseMode.MARKDOWN if command == 'domain' else None)
+        return AWAIT_SCHEDULE_INPUT
+
+    context.user_data['schedule_inputs'] = " ".join(inputs)
+    await update.message.reply_text("How often should this test be posted?", reply_markup=InlineKeyboardMarkup(interval_keyboard()))
+    return SELECT_SCHEDULE_INTERVAL
+
+async def schedule_handle_country_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    if query.data == "sched_cmd_back":
+        await query.edit_message_text("Now, select the type of test to repeat:", reply_markup=InlineKeyboardMarkup(test_type_keyboard("sched_cmd_")))
+        return SELECT_SCHEDULE_COMMAND
+    context.user_data['schedule_inputs'] = query.data.split('_')[-1]
+    await query.edit_message_text("How often should this test be posted?", reply_markup=InlineKeyboardMarkup(interval_keyboard()))
+    return SELECT_SCHEDULE_INTERVAL
+
+async def schedule_select_interval(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    user_id_str = str(query.from_user.id)
+    # Only this conversation's keys are dropped; live tests keep their state
+    # in user_data under their test ids.
+    chat_id, command, inputs = (context.user_data.pop(key, None) for key in ('schedule_chat_id', 'schedule_command', 'schedule_inputs'))
+    if not (chat_id and command and inputs):
+        await query.edit_message_text("Something went wrong. Please start over with /schedule.")
+        return ConversationHandler.END
+
+    interval = int(query.data.split('_')[-1]) * 3600
+    store = get_chat_store()
+    if not store.add_schedule(user_id_str, chat_id, command, inputs, interval, time.time() + random.uniform(0, schedule_jitter(interval))):
+        await query.edit_message_text(f"This test is already scheduled for that destination, or you have reached the limit of {SCHEDULE_MAX_PER_USER} scheduled posts. Use /unschedule to remove one.")
+        return ConversationHandler.END
+
+    post_scheduler.wake()
+    name = next((chat['name'] for chat in store.get_user_chats(user_id_str) if str(chat['chat_id']) == str(chat_id)), chat_id)
+    await query.edit_message_text(f"âœ… {schedule_source_label(command, inputs)} will be posted to '{name}' {describe_interval(interval)}. The first post follows within a few minutes.\nUse /unschedule to stop it.")
+    return ConversationHandler.END
+
+def unschedule_keyboard(schedules: list) -> list:
+    keyboard = [[InlineKeyboardButton(f"{entry['name']}: {schedule_source_label(entry['command'], entry['inputs'])}, {describe_interval(entry['interval'])}", callback_data=f"unsched_{entry['id']}")] for entry in schedules]
+    keyboard.append([InlineKeyboardButton("ðŸ”™ Back", callback_data="unsched_cancel")])
+    return keyboard
+
+async def unschedule_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.chat.type != ChatType.PRIVATE:
+        await update.message.reply_text("To use this command, please send it to me in a private chat.")
+        return ConversationHandler.END
+
+    schedules = get_chat_store().get_user_schedules(update.message.from_user.id)
+    if not schedules:
+        await update.message.reply_text("You have no scheduled posts.")
+        return ConversationHandler.END
+    await update.message.reply_text("Select a scheduled post to stop:", reply_markup=InlineKeyboardMarkup(unschedule_keyboard(schedules)))
+    return SELECT_SCHEDULE_TO_DELETE
+
+async def unschedule_select(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    if query.data == "unsched_cancel":
+        await query.edit_message_text("Operation cancelled.")
+        return ConversationHandler.END
+    if get_chat_store().delete_schedule(query.from_user.id, query.data.split('_')[-1]):
+        await query.edit_message_text("âœ… Scheduled post stopped.")
+    else:
+        await query.edit_message_text("Could not find the scheduled post to stop.")
+    return ConversationHandler.END
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
@@ -905,17 +3915,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.answer()
         country_code = data
         country_name_full = COUNTRIES.get(country_code, "Selected Country")
-        url = COUNTRY_URLS.get(country_code) or f"{COUNTRY_FILE_BASE_URL}{country_code.upper()}.txt"
         sent_message = await query.edit_message_text(text=f"Fetching IPs for {country_name_full}...")
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=15)
-                response.raise_for_status()
-                text = response.text
-            ips_found = list(set(re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', text)))
-            ips_with_context = [{"ip": ip} for ip in ips_found]
-            if not ips_with_context: await sent_message.edit_message_text(f"No IPs found for {country_name_full}.")
-            else: await test_ips_and_update_message(context, query.message.chat_id, sent_message.message_id, ips_with_context, f"**{country_name_full} Test Results**")
+            text = await country_lists.get(country_code)
+            ips_found = re.findall(r'\b(?:\d{1,3}\.){3}\d{1,3}(?::\d+)?\b', text)
+            options, fresh = split_fresh_flag(context.user_data.get('freeproxy_options', []))
+            _, goal, _ = split_goal_options(options)
+            ips_with_context = await prefer_known_good(compact_targets(ips_found), fresh)
+            if not ips_with_context: await sent_message.edit_message_text(f"No IPs found for {country_name_full}.{recently_dead_hint(ips_with_context.skipped)}")
+            else: await test_ips_and_update_message(context, query.message.chat_id, sent_message.message_id, ips_with_context, f"**{country_name_full} Test Results**", user_id=query.from_user.id, fresh=fresh, goal=goal)
         except Exception as e: await sent_message.edit_message_text(f"Error getting proxies for {country_name_full}: {e}")
         return
 
@@ -947,11 +3955,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             current_text = query.message.text_markdown
             if pause_message not in current_text:
                 try:
-                    await query.edit_message_text(
-                        text=f"{current_text}{pause_message}",
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
+                    await outbox.call(context.bot, 'edit_message_text', chat_id=query.message.chat_id, message_id=query.message.message_id,
+                                      text=f"{current_text}{pause_message}", parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
                 except BadRequest as e:
                     if "Message is not modified" not in str(e):
                         logger.warning(f"Failed to edit message for pause: {e}")
@@ -970,11 +3975,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             if pause_message in current_text:
                 new_text = current_text.replace(pause_message, "")
                 try:
-                    await query.edit_message_text(
-                        text=new_text,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
+                    await outbox.call(context.bot, 'edit_message_text', chat_id=query.message.chat_id, message_id=query.message.message_id,
+                                      text=new_text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
                 except BadRequest as e:
                     if "Message is not modified" not in str(e):
                         logger.warning(f"Failed to edit message for resume: {e}")
@@ -983,7 +3985,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await query.answer()
             context.user_data[test_id]['status'] = 'stopped'
             try:
-                await query.edit_message_reply_markup(reply_markup=None)
+                await outbox.call(context.bot, 'edit_message_reply_markup', chat_id=query.message.chat_id, message_id=query.message.message_id, reply_markup=None)
             except BadRequest:
                 pass
     finally:
@@ -998,18 +4000,31 @@ async def post_init(application: Application):
         BotCommand("domain", "ðŸ” Resolving Domains"),
         BotCommand("file", "ðŸ” Check Proxy IPs From a File URL"),
         BotCommand("freeproxyip", "âœ¨ Get Free Proxies By Country"),
+        BotCommand("history", "ðŸ•˜ Working Proxies From Recent Tests"),
         BotCommand("addchat", "âž• Register a Channel/Group"),
         BotCommand("deletechat", "ðŸ—‘ï¸ Delete a Registered Channel/Group"),
         BotCommand("post", "ðŸš€ Post Results To a Chat"),
+        BotCommand("schedule", "ðŸ“… Schedule Recurring Posts"),
+        BotCommand("unschedule", "ðŸ—‘ï¸ Stop a Scheduled Post"),
         BotCommand("cancel", "âŒ Cancel Current Operation"),
     ]
     await application.bot.set_my_commands(commands)
+    get_http_client()
+    get_chat_store()
+    get_history_store()
     application.create_task(run_periodic_cleanup(application))
-    
+    application.create_task(post_scheduler.run(application))
+    application.create_task(country_lists.prefetch(list(COUNTRIES)))
+
+async def post_shutdown(application: Application):
+    await close_http_client()
+    close_chat_store()
+    await close_history_store()
+
 def main() -> None:
     cprint("made with â¤ï¸â€ðŸ”¥ by @mehdiasmart", "light_cyan")
     
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    application = Application.builder().token(BOT_TOKEN).concurrent_updates(update_processor).post_init(post_init).post_shutdown(post_shutdown).build()
     
     simple_command_list = ["proxyip", "iprange", "file"]
     
@@ -1065,17 +4080,50 @@ def main() -> None:
         fallbacks=[CommandHandler("cancel", cancel_conversation)],
     )
 
+    schedule_handler = ConversationHandler(
+        entry_points=[CommandHandler("schedule", schedule_start)],
+        states={
+            SELECT_SCHEDULE_CHAT: [CallbackQueryHandler(schedule_select_chat, pattern="^sched_chat_")],
+            SELECT_SCHEDULE_COMMAND: [CallbackQueryHandler(schedule_select_command, pattern="^sched_cmd_")],
+            AWAIT_SCHEDULE_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, schedule_handle_input)],
+            AWAIT_SCHEDULE_COUNTRY: [CallbackQueryHandler(schedule_handle_country_selection, pattern="^sched_country_|^sched_cmd_back$")],
+            SELECT_SCHEDULE_INTERVAL: [CallbackQueryHandler(schedule_select_interval, pattern="^sched_every_")],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_conversation)],
+    )
+
+    unschedule_handler = ConversationHandler(
+        entry_points=[CommandHandler("unschedule", unschedule_start)],
+        states={
+            SELECT_SCHEDULE_TO_DELETE: [CallbackQueryHandler(unschedule_select, pattern="^unsched_")],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_conversation)],
+    )
+
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("freeproxyip", freeproxyip_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("history", history_command))
     application.add_handler(main_conv_handler)
     application.add_handler(domain_conv_handler)
     application.add_handler(addchat_handler)
     application.add_handler(deletechat_handler)
     application.add_handler(post_handler)
+    application.add_handler(schedule_handler)
+    application.add_handler(unschedule_handler)
     application.add_handler(CallbackQueryHandler(button_handler, pattern="^country_|^pause_|^resume_|^cancel_|^freeproxy_cancel$"))
     application.add_handler(CommandHandler("cancel", cancel_conversation))
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL and WEBHOOK_AVAILABLE:
+        # Telegram sends WEBHOOK_SECRET with every call; requests without it
+        # are rejected by the listener before they reach any handler.
+        logger.info(f"Starting in webhook mode on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}.")
+        application.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH, webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+                                secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    else:
+        if WEBHOOK_URL:
+            logger.warning("WEBHOOK_URL is set but the webhook extra is not installed (pip install \"python-telegram-bot[webhooks]\"); falling back to polling.")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
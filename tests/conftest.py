@@ -0,0 +1,37 @@
+import importlib.util
+import os
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    # proxy-ip-bot.py is not an importable module name, so load it by path.
+    # The stores open their databases lazily; point them at a scratch dir.
+    scratch = tmp_path_factory.mktemp("bot")
+    os.environ.setdefault("DB_PATH", str(scratch / "bot.sqlite3"))
+    os.environ.setdefault("HISTORY_PATH", str(scratch / "history.sqlite3"))
+    spec = importlib.util.spec_from_file_location("proxy_ip_bot", os.path.join(ROOT, "proxy-ip-bot.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def fake_worker(bot, monkeypatch):
+    # Installs stand-in workers: each `handler(request) -> httpx.Response`
+    # becomes one WORKER_URL endpoint (http://worker0.test, worker1, ...)
+    # and answers the calls the bot sends there through its shared client.
+    def install(*handlers):
+        urls = [f"http://worker{i}.test" for i in range(len(handlers))]
+        routes = dict(zip((httpx.URL(url).host for url in urls), handlers))
+
+        async def route(request):
+            response = routes[request.url.host](request)
+            return await response if hasattr(response, "__await__") else response
+
+        monkeypatch.setattr(bot, "http_client", httpx.AsyncClient(transport=httpx.MockTransport(route)))
+        monkeypatch.setattr(bot, "worker_pool", bot.WorkerPool(urls))
+        return bot.worker_pool.endpoints
+    return install
@@ -0,0 +1,44 @@
+import asyncio
+
+from telegram.error import BadRequest, RetryAfter
+
+class FakeBot:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    async def get_chat(self, chat_id):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+class FakeStore:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_user(self, user_id):
+        self.deleted.append(user_id)
+        return True
+
+def check_user(bot, fake_bot, store):
+    async def run():
+        return await bot._check_user_still_exists(fake_bot, store, "42", asyncio.Semaphore(1), bot.TokenBucket(100, 1))
+    return asyncio.run(run())
+
+def test_flood_control_is_retried_once(bot):
+    fake_bot, store = FakeBot([RetryAfter(0), BadRequest("Chat not found")]), FakeStore()
+    assert check_user(bot, fake_bot, store) is True
+    assert fake_bot.calls == 2 and store.deleted == ["42"]
+
+def test_repeated_flood_control_skips_the_user(bot):
+    fake_bot, store = FakeBot([RetryAfter(0), RetryAfter(0)]), FakeStore()
+    assert check_user(bot, fake_bot, store) is False
+    assert fake_bot.calls == 2 and store.deleted == []
+
+def test_pause_holds_the_bucket(bot):
+    bucket = bot.TokenBucket(10, 5)
+    now = bucket.updated
+    bucket.pause(now, 2.0)
+    assert abs(bucket.delay(now) - 2.0) < 1e-9
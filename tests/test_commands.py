@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+class FakeMessage:
+    chat_id = 1
+    message_id = 2
+
+    def __init__(self):
+        self.edits = []
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+
+def test_file_with_only_flags_replies_with_usage(bot):
+    message = FakeMessage()
+    asyncio.run(bot.process_command_logic(None, None, "file", ["--fresh"], message))
+    assert len(message.edits) == 1
+    assert "Usage: `/file <file url>" in message.edits[0]
+
+def test_goal_options_take_only_positive_numbers(bot):
+    remaining, goal, error = bot.split_goal_options(["1.1.1.1", "--top", "5", "--max-ping=300"])
+    assert remaining == ["1.1.1.1"] and error is None
+    assert (goal.limit, goal.max_ping) == (5, 300)
+
+def test_goal_option_without_number_is_a_usage_error(bot):
+    for inputs in (["--top", "1.1.1.1"], ["1.1.1.1", "--top"], ["--top=0"], ["-p", "fast"]):
+        remaining, goal, error = bot.split_goal_options(inputs)
+        assert goal is None and "Usage" in error
+
+class FakeChatMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+def test_domain_with_only_flags_asks_again(bot):
+    for inputs in (["--fresh"], ["--top", "5"]):
+        message = FakeChatMessage()
+        state = asyncio.run(bot.validate_and_process_domains(SimpleNamespace(message=message), None, inputs))
+        assert state == bot.AWAIT_DOMAIN_INPUT
+        assert len(message.replies) == 1
+        assert "Usage: `/domain <domain>" in message.replies[0]
+
+class FakeScheduleStore:
+    def __init__(self):
+        self.schedules = []
+
+    def add_schedule(self, user_id, chat_id, command, inputs, interval, next_run):
+        self.schedules.append((chat_id, command, inputs, interval))
+        return True
+
+    def get_user_chats(self, user_id):
+        return [{'chat_id': "-100", 'name': "Channel"}]
+
+class FakeQuery:
+    data = "sched_every_6"
+    from_user = SimpleNamespace(id=42)
+
+    def __init__(self):
+        self.edits = []
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+def test_finishing_a_schedule_keeps_live_tests(bot, monkeypatch):
+    store = FakeScheduleStore()
+    monkeypatch.setattr(bot, "get_chat_store", lambda: store)
+    live_test = {'status': 'running'}
+    user_data = {'test_1': live_test, 'schedule_chat_id': "-100", 'schedule_command': "domain", 'schedule_inputs': "example.com"}
+    context = SimpleNamespace(user_data=user_data)
+    state = asyncio.run(bot.schedule_select_interval(SimpleNamespace(callback_query=FakeQuery()), context))
+    assert state == bot.ConversationHandler.END
+    assert store.schedules == [("-100", "domain", "example.com", 6 * 3600)]
+    assert user_data == {'test_1': live_test}
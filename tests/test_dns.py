@@ -0,0 +1,20 @@
+import asyncio
+
+import httpx
+
+def resolve(bot, domain):
+    return asyncio.run(bot.fetch_domain_ips(domain))
+
+def test_resolved_domain_returns_addresses_and_ttl(bot, fake_worker):
+    fake_worker(lambda request: httpx.Response(200, json={"success": True, "ips": ["1.1.1.1", "[2606:4700::1111]"], "ttl": 120}))
+    assert resolve(bot, "example.com") == (("1.1.1.1", "[2606:4700::1111]"), 120, True)
+
+def test_failed_lookup_is_cacheable(bot, fake_worker):
+    fake_worker(lambda request: httpx.Response(500, json={"success": False, "error": "No A or AAAA records found for this domain."}))
+    assert resolve(bot, "nx.example.com") == ((), None, True)
+
+def test_error_status_is_not_cached(bot, fake_worker):
+    fake_worker(lambda request: httpx.Response(502, text="<html>Bad gateway</html>"))
+    assert resolve(bot, "example.com") == ((), None, False)
+    fake_worker(lambda request: httpx.Response(500, text="worker exception"))
+    assert resolve(bot, "example.com") == ((), None, False)
@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+class FakeHistory:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def recent_good(self, since, country=None):
+        self.queries.append(country)
+        return len(self.rows) + 5, self.rows
+
+def run_history(bot, monkeypatch, args, rows=()):
+    history = FakeHistory(list(rows))
+    monkeypatch.setattr(bot, "get_history_store", lambda: history)
+    message = FakeMessage()
+    update = SimpleNamespace(message=message)
+    asyncio.run(bot.history_command(update, SimpleNamespace(args=args)))
+    return message.replies, history.queries
+
+def test_country_with_markdown_is_refused(bot, monkeypatch):
+    for country in (["*bold"], ["a_b"], ["[x](tg://user?id=1)"], ["`code`"]):
+        replies, queries = run_history(bot, monkeypatch, ["30"] + country)
+        assert queries == []
+        assert replies[0].startswith("Usage: /history")
+
+def test_country_names_are_accepted(bot, monkeypatch):
+    replies, queries = run_history(bot, monkeypatch, ["Côte", "d'Ivoire"])
+    assert queries == ["Côte d'Ivoire"]
+    assert replies == ["No working proxies in Côte d'Ivoire were seen in the last 60 minute(s)."]
+
+def test_long_history_is_split_into_messages(bot, monkeypatch):
+    rows = [(f"1.2.3.{i}:443", 100 + i, "Germany", "A" * 300, 0) for i in range(20)]
+    replies, _ = run_history(bot, monkeypatch, ["Germany"], rows)
+    assert len(replies) > 1
+    assert all(len(text) <= 4096 for text in replies)
+    assert replies[-1].endswith("... and 5 more.")
+    assert all(any(f"1.2.3.{i}:443" in text for text in replies) for i in range(20))
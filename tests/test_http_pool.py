@@ -0,0 +1,20 @@
+import asyncio
+
+import httpx
+
+def test_pool_counts_of_the_shared_client(bot, monkeypatch):
+    async def run():
+        client = bot.create_http_client()
+        monkeypatch.setattr(bot, "http_client", client)
+        stats = bot.get_http_pool_stats()
+        await client.aclose()
+        return stats
+    stats = asyncio.run(run())
+    assert (stats['open'], stats['idle'], stats['active'], stats['waiting']) == (0, 0, 0, 0)
+
+def test_unreadable_pool_is_reported_as_na(bot, monkeypatch):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    monkeypatch.setattr(bot, "http_client", client)
+    stats = bot.get_http_pool_stats()
+    assert (stats['open'], stats['idle'], stats['active'], stats['waiting']) == ('n/a',) * 4
+    assert stats['http2'] == bot.HTTP2_ENABLED
@@ -0,0 +1,35 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+class FloodedBot:
+    # The first edit is held until `release` and then hits flood control;
+    # later edits go through and echo their text back.
+    def __init__(self):
+        self.sent = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        self.sent.append(text)
+        if len(self.sent) == 1:
+            self.started.set()
+            await self.release.wait()
+            raise RetryAfter(0)
+        return text
+
+def test_retried_edit_gives_way_to_newer_edit(bot):
+    async def run():
+        outbox, fake_bot = bot.TelegramOutbox(), FloodedBot()
+        stale = asyncio.create_task(outbox.call(fake_bot, 'edit_message_text', chat_id=7, message_id=1, text="old"))
+        await fake_bot.started.wait()
+        newer = asyncio.create_task(outbox.call(fake_bot, 'edit_message_text', chat_id=7, message_id=1, text="new"))
+        await asyncio.sleep(0)
+        fake_bot.release.set()
+        results = await asyncio.wait_for(asyncio.gather(stale, newer), timeout=5)
+        outbox.dispatcher.cancel()
+        return results, fake_bot.sent, outbox.stats()
+    results, sent, stats = asyncio.run(run())
+    assert sent == ["old", "new"]
+    assert results == ["new", "new"]
+    assert stats['merged'] == 1 and stats['retries'] == 0
@@ -0,0 +1,42 @@
+def test_small_range_is_enumerated(bot):
+    targets, range_map, error = bot.build_range_targets(["1.2.3.0/30"])
+    assert error is None
+    assert range_map == {0: "1.2.3.0/30"}
+    assert [target.address for target in targets] == ["1.2.3.1", "1.2.3.2"]
+    assert len(targets) == targets.total == 2
+
+def test_range_over_limit_is_refused(bot):
+    targets, _, error = bot.build_range_targets(["1.0.0.0/8"])
+    assert error is not None and "limit" in error
+    assert not targets
+
+def test_ipv6_slash_32_is_refused_not_overflowed(bot):
+    # 2**96 addresses; len() of that would raise OverflowError.
+    targets, _, error = bot.build_range_targets(["2606:4700::/32"])
+    assert error is not None and "limit" in error
+    assert not targets and len(targets) == 0
+
+def test_huge_range_len_is_clamped(bot):
+    targets = bot.RangeTargets([(0, bot.parse_ip_range("2606:4700::/32"))])
+    assert targets.total > bot.sys.maxsize
+    assert len(targets) == bot.sys.maxsize
+    assert targets
+
+def test_sample_blocks_match_the_range(bot):
+    targets, _, error = bot.build_range_targets(["1.2.0.0/18", "--sample"])
+    assert error is None
+    blocks = targets.blocks
+    assert len(blocks) == 64
+    assert blocks[0] == (0, 4, bot.parse_ip_range("1.2.0.0/18")[1], int(bot.ipaddress.ip_address("1.2.0.255")))
+    assert blocks[63][3] == int(bot.ipaddress.ip_address("1.2.63.254"))
+    for i in (0, 17, 63):
+        _, version, first, last = blocks[i]
+        assert blocks.index_of(version, first) == blocks.index_of(version, last) == i
+
+def test_oversized_samples_are_refused_before_building_blocks(bot):
+    start = bot.time.perf_counter()
+    for inputs in (["1.0.0.0/8", "--sample=32"], ["2606:4700::/96", "--sample"], ["2606:4700::/64", "--sample"]):
+        targets, _, error = bot.build_range_targets(inputs)
+        assert error is not None
+        assert not targets
+    assert bot.time.perf_counter() - start < 1
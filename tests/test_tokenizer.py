@@ -0,0 +1,36 @@
+import random
+
+def tokenize(bot, data, sizes):
+    tokenizer = bot.AddressTokenizer()
+    tokens, pos = [], 0
+    for size in sizes:
+        tokens += tokenizer.feed(data[pos:pos + size])
+        pos += size
+    tokens += tokenizer.feed(data[pos:])
+    return tokens + tokenizer.finish()
+
+def random_chunks(rng, length):
+    sizes = []
+    while sum(sizes) < length:
+        sizes.append(rng.choice((1, 2, 3, 7, 16, 63, 64, 65, 66, 200)))
+    return sizes
+
+def test_chunked_scan_matches_whole_body(bot):
+    rng = random.Random(7)
+    # Every run of token characters stays within the carry limit.
+    data = b"".join(rng.choice((b"1.2.3.4", b"5.6.7.8:443", b"x9.9.9.9", b"10.0.0.1:8080", b"abc", b"300.1.1.1", b"1.2")) + rng.choice((b" ", b"\n", b","))
+                    for _ in range(3000))
+    assert tokenize(bot, data, []) == bot.ADDRESS_TOKEN_PATTERN.findall(data)
+    for _ in range(20):
+        assert tokenize(bot, data, random_chunks(rng, len(data))) == bot.ADDRESS_TOKEN_PATTERN.findall(data)
+
+def test_runs_longer_than_the_carry_never_match(bot):
+    long_run = b"1.2.3.4:" + b"5" * 100
+    data = b"8.8.8.8 " + long_run + b" 9.9.9.9:53\n" + b"1.1.1.1." * 20 + b"\n4.4.4.4"
+    expected = [(b"8", b"8", b"8", b"8", b""), (b"9", b"9", b"9", b"9", b"53"), (b"4", b"4", b"4", b"4", b"")]
+    assert tokenize(bot, data, []) == expected
+    rng = random.Random(11)
+    for _ in range(200):
+        assert tokenize(bot, data, random_chunks(rng, len(data))) == expected
+    for split in range(1, len(data)):
+        assert tokenize(bot, data, [split]) == expected
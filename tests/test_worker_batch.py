@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+
+def check_answer(target, ping=90):
+    return {"success": True, "proxyIP": target, "ping": ping, "info": {"country": "Germany", "as": "Hetzner"}}
+
+class FakeWorker:
+    # Answers /api/check and /api/check-batch like _worker.js, or with a fixed
+    # status for the batch route.
+    def __init__(self, batch_status=200, max_batch=25):
+        self.batch_status = batch_status
+        self.max_batch = max_batch
+        self.batches = []
+        self.singles = []
+
+    def __call__(self, request):
+        if request.url.path == "/api/check-batch":
+            targets = json.loads(request.content)["targets"]
+            self.batches.append(targets)
+            if self.batch_status != 200:
+                return httpx.Response(self.batch_status, json={"success": False})
+            if len(targets) > self.max_batch:
+                return httpx.Response(413, json={"success": False})
+            lines = "".join(json.dumps({**check_answer(target), "target": target}) + "\n" for target in reversed(targets))
+            return httpx.Response(200, content=lines.encode(), headers={"Content-Type": "application/x-ndjson"})
+        target = request.url.params["proxyip"]
+        self.singles.append(target)
+        return httpx.Response(200, json=check_answer(target))
+
+def run_checks(bot, batcher, addresses):
+    async def run():
+        return await asyncio.gather(*(batcher.check(address) for address in addresses))
+    return asyncio.run(run())
+
+ADDRESSES = [f"1.2.3.{i}:443" for i in range(1, 11)]
+
+def test_concurrent_checks_share_a_batch(bot, fake_worker):
+    worker = FakeWorker()
+    fake_worker(worker)
+    batcher = bot.WorkerBatcher(5, 0.01)
+    verdicts = run_checks(bot, batcher, ADDRESSES)
+    assert worker.batches == [ADDRESSES[:5], ADDRESSES[5:]]
+    assert worker.singles == []
+    assert [verdict[1][0] for verdict in verdicts] == ADDRESSES
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+
+def test_missing_batch_route_falls_back_to_single_checks(bot, fake_worker):
+    worker = FakeWorker(batch_status=404)
+    fake_worker(worker)
+    batcher = bot.WorkerBatcher(5, 0.01)
+    verdicts = run_checks(bot, batcher, ADDRESSES)
+    assert sorted(worker.singles) == sorted(ADDRESSES)
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+    assert not bot.worker_pool.supports_batch()
+
+def test_rejected_batch_is_checked_one_by_one(bot, fake_worker):
+    worker = FakeWorker(batch_status=400)
+    fake_worker(worker)
+    batcher = bot.WorkerBatcher(5, 0.01)
+    verdicts = run_checks(bot, batcher, ADDRESSES)
+    assert len(worker.batches) == 2
+    assert sorted(worker.singles) == sorted(ADDRESSES)
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+    assert bot.worker_pool.supports_batch()
+
+def test_too_large_batch_halves_the_batch_size(bot, fake_worker):
+    worker = FakeWorker(max_batch=4)
+    fake_worker(worker)
+    batcher = bot.WorkerBatcher(10, 0.01)
+    verdicts = run_checks(bot, batcher, ADDRESSES)
+    assert worker.batches == [ADDRESSES]
+    assert sorted(worker.singles) == sorted(ADDRESSES)
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+    assert batcher.batch_size == 5
+    worker.singles.clear()
+    run_checks(bot, batcher, ADDRESSES[:4])
+    assert worker.batches[-1] == ADDRESSES[:4] and worker.singles == []
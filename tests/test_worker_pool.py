@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import httpx
+
+class StandIn:
+    # One stand-in worker endpoint for /api/check: healthy (after `delay`)
+    # or failing with a 500 until `failing` is cleared.
+    def __init__(self, failing=False, delay=0.02):
+        self.failing = failing
+        self.delay = delay
+        self.requests = 0
+
+    async def __call__(self, request):
+        self.requests += 1
+        if self.failing:
+            return httpx.Response(500, text="worker exception")
+        await asyncio.sleep(self.delay)
+        target = request.url.params["proxyip"]
+        return httpx.Response(200, json={"success": True, "proxyIP": target, "ping": 90, "info": {"country": "Germany", "as": "Hetzner"}})
+
+def check_all(bot, count):
+    async def run():
+        return await asyncio.gather(*(bot.check_proxy_with_worker(f"1.2.3.{i}:443") for i in range(1, count + 1)))
+    return asyncio.run(run())
+
+def fast_forward(endpoint):
+    # Stands in for waiting out the ejection.
+    endpoint.ejected_until = time.monotonic() - 0.001
+
+def test_calls_are_spread_by_load(bot, fake_worker):
+    first, second = StandIn(), StandIn()
+    fake_worker(first, second)
+    verdicts = check_all(bot, 10)
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+    assert first.requests == second.requests == 5
+
+def test_slower_endpoint_gets_less_traffic(bot, fake_worker):
+    fast, slow = StandIn(delay=0.005), StandIn(delay=0.1)
+    fast_endpoint, slow_endpoint = fake_worker(fast, slow)
+    check_all(bot, 2)
+    assert slow_endpoint.latency > fast_endpoint.latency
+    fast.requests = slow.requests = 0
+    check_all(bot, 20)
+    assert fast.requests > slow.requests
+
+def test_failing_endpoint_is_ejected_and_probed(bot, fake_worker):
+    broken, healthy = StandIn(failing=True), StandIn()
+    broken_endpoint, healthy_endpoint = fake_worker(broken, healthy)
+
+    # Errors are retried once on the other endpoint, so every check succeeds.
+    verdicts = check_all(bot, 20)
+    assert all(verdict[0] == bot.OUTCOME_SUCCESS for verdict in verdicts)
+    assert broken_endpoint.ejections == 1
+    assert broken_endpoint.state(time.monotonic()) == 'ejected'
+    assert broken_endpoint.ejected_until - time.monotonic() > bot.WORKER_EJECT_SECONDS - 5
+
+    # While ejected, all traffic goes to the healthy endpoint.
+    broken.requests, healthy.requests = 0, 0
+    check_all(bot, 10)
+    assert broken.requests == 0 and healthy.requests == 10
+
+    # After the back-off a single probe goes out; it fails, so the endpoint
+    # is ejected again for twice as long.
+    fast_forward(broken_endpoint)
+    check_all(bot, 10)
+    assert broken.requests == 1
+    assert broken_endpoint.ejections == 2
+    assert broken_endpoint.ejected_until - time.monotonic() > 2 * bot.WORKER_EJECT_SECONDS - 5
+
+    # The next probe succeeds and the endpoint is back in rotation.
+    broken.failing = False
+    broken.requests = 0
+    fast_forward(broken_endpoint)
+    check_all(bot, 10)
+    assert broken.requests == 1
+    assert broken_endpoint.state(time.monotonic()) == 'up'
+    assert broken_endpoint.eject_seconds == bot.WORKER_EJECT_SECONDS
+    check_all(bot, 10)
+    assert broken.requests > 1